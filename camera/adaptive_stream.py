@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+adaptive_stream.py - Per-Client Adaptive MJPEG Quality Ladder
+Each viewer gets a rate controller that watches how long its socket writes
+take (backpressure) and how many frames it skips, then steps between a small
+ladder of pre-defined resolution/quality variants. The broadcaster encodes a
+variant once per frame, and only while some client is on that level.
+"""
+import collections
+import time
+
+Variant = collections.namedtuple('Variant', ['name', 'scale', 'quality'])
+
+# Ordered best to worst; index is the client "level"
+QUALITY_LADDER = [
+    Variant('high', 1.0, 80),
+    Variant('medium', 0.75, 65),
+    Variant('low', 0.5, 50),
+    Variant('minimal', 0.35, 40)
+]
+
+# EWMA smoothing factor for per-frame measurements
+EWMA_ALPHA = 0.2
+# Step down when writes use this share of the frame interval, or frames drop
+BUSY_DOWNGRADE = 0.8
+DROP_DOWNGRADE = 0.25
+# Step up only when writes are this idle and nothing was dropped
+BUSY_UPGRADE = 0.3
+# Minimum seconds between level changes (hysteresis)
+MIN_DWELL = 2.0
+
+class AdaptiveRateController:
+    """Chooses a ladder level for one client from its send measurements."""
+    def __init__(self, ladder=QUALITY_LADDER, source_fps=30, start_level=0, enabled=True):
+        self.ladder = ladder
+        self.frame_interval = 1.0 / max(1, source_fps)
+        self.level = start_level
+        self.enabled = enabled
+        self.ewma_send_s = 0.0
+        self.ewma_drop_ratio = 0.0
+        self.ewma_bytes_per_sec = 0.0
+        self.ewma_fps = 0.0
+        self.level_changes = 0
+        self._last_change = time.monotonic()
+        self._last_frame_at = None
+
+    @property
+    def variant(self):
+        return self.ladder[self.level]
+
+    def record(self, nbytes, send_seconds, dropped):
+        """Feed one delivered frame: payload size, blocking write time, frames skipped before it."""
+        now = time.monotonic()
+        if self._last_frame_at is not None:
+            interval = max(1e-6, now - self._last_frame_at)
+            self.ewma_fps += EWMA_ALPHA * (1.0 / interval - self.ewma_fps)
+            self.ewma_bytes_per_sec += EWMA_ALPHA * (nbytes / interval - self.ewma_bytes_per_sec)
+        self._last_frame_at = now
+        self.ewma_send_s += EWMA_ALPHA * (send_seconds - self.ewma_send_s)
+        drop_ratio = dropped / (dropped + 1.0)
+        self.ewma_drop_ratio += EWMA_ALPHA * (drop_ratio - self.ewma_drop_ratio)
+
+        if self.enabled and now - self._last_change >= MIN_DWELL:
+            self._adjust(now)
+
+    def _adjust(self, now):
+        busy = self.ewma_send_s / self.frame_interval
+        if (busy > BUSY_DOWNGRADE or self.ewma_drop_ratio > DROP_DOWNGRADE) \
+                and self.level < len(self.ladder) - 1:
+            self._set_level(self.level + 1, now)
+        elif busy < BUSY_UPGRADE and self.ewma_drop_ratio < 0.05 and self.level > 0:
+            self._set_level(self.level - 1, now)
+
+    def _set_level(self, level, now):
+        self.level = level
+        self.level_changes += 1
+        self._last_change = now
+        # Measurements taken at the old level no longer describe the new one
+        self.ewma_drop_ratio = 0.0
+        self.ewma_send_s = 0.0
+
+    def as_dict(self):
+        variant = self.variant
+        return {
+            'level': variant.name,
+            'scale': variant.scale,
+            'quality': variant.quality,
+            'fps': round(self.ewma_fps, 2),
+            'bytes_per_sec': int(self.ewma_bytes_per_sec),
+            'send_ms': round(self.ewma_send_s * 1000, 2),
+            'level_changes': self.level_changes
+        }
@@ -2,40 +2,149 @@
 """
 camera_server.py - Camera Web Streaming Server (Real-time)
 """
-from flask import Flask, Response, send_file, jsonify
+from flask import Flask, Response, send_file, jsonify, request, g
 import cv2
 import socket
 import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+import config
+if __name__ == "__main__":
+    config.load_or_exit()
+import metrics
+from frame_broadcaster import FrameBroadcaster
+from motion_gate import MotionGate
+from h264_stream import H264Stream, H264_AVAILABLE
+from frame_bus import FrameBusTee, FrameBusSource, FrameBusError, CAMERA_BUS, ANNOTATED_BUS, live_writer
+from video_source import SyntheticSource, open_camera, configure_capture, describe_capture
+from session_recorder import SessionRecorder, FrameRecorderSink, cli_record_path
 
 app = Flask(__name__)
 
 # Camera configuration
-CAMERA_INDEX = 0
-FRAME_WIDTH = 640
-FRAME_HEIGHT = 480
-JPEG_QUALITY = 80
-FPS = 30
+SERVER_PORT = config.get('camera.port', 5000)
+CAMERA_INDEX = config.get('camera.index', 0)
+FRAME_WIDTH = config.get('camera.width', 640)
+FRAME_HEIGHT = config.get('camera.height', 480)
+JPEG_QUALITY = config.get('camera.jpeg_quality', 80)
+FPS = config.get('camera.fps', 30)
+
+# Capture options: keep one driver buffer so frames are never stale, ask for the
+# camera's MJPEG format and forward its JPEG bytes untouched to full-quality viewers
+CAPTURE_BUFFER_SIZE = 1
+CAPTURE_FOURCC = 'MJPG'
+MJPEG_PASSTHROUGH = True
+
+# Drop to a couple of encoded frames per second while the scene is static (--no-motion-gate disables)
+MOTION_GATE = True
+
+# Optional low-latency H.264 (fragmented MP4) stream at /video_h264 (--h264, needs PyAV)
+H264_MODE = False
+H264_KEYFRAME_INTERVAL = 1.0
+H264_CRF = 28
+
+# Publish every captured frame to the shared-memory frame bus so the gesture
+# bridge can run on the same camera (--frame-bus)
+FRAME_BUS = False
+
+# Step each viewer down the quality ladder when its link cannot keep up (--no-adaptive disables)
+ADAPTIVE_BITRATE = True
+
+# Use a generated test pattern instead of a webcam (--synthetic)
+USE_SYNTHETIC = False
 
-# Global video capture instance
+# Record every captured frame to this session directory for replay (--record [DIR])
+RECORD_PATH = None
+
+# Global video capture instance and the single capture/encode thread reading it
 camera = None
+broadcaster = None
+annotated_broadcaster = None
+h264_stream = None
+recorder = None
+_init_lock = threading.Lock()
+
+_FRAMES_SENT = metrics.counter(
+    'smartcar_camera_frames_sent_total', 'MJPEG frames yielded to clients')
+_BYTES_SENT = metrics.counter(
+    'smartcar_camera_bytes_sent_total', 'MJPEG payload bytes yielded to clients')
+_ACTIVE_STREAMS = metrics.gauge(
+    'smartcar_camera_active_streams', 'Open /video_feed client streams')
 
 def init_camera():
-    """Initialize camera device."""
-    global camera
+    """Initialize camera device and start the shared frame broadcaster."""
+    with _init_lock:
+        return _init_camera_locked()
+
+def _init_camera_locked():
+    global camera, broadcaster, h264_stream, recorder
     if camera is None:
-        camera = cv2.VideoCapture(CAMERA_INDEX)
-        camera.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
-        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
-        camera.set(cv2.CAP_PROP_FPS, FPS)
-        
-        if not camera.isOpened():
-            print(f"Error: Unable to open camera index {CAMERA_INDEX}")
+        owner = live_writer(CAMERA_BUS) if FRAME_BUS else None
+        if owner:
+            print(f"Error: frame bus '{CAMERA_BUS}' is already published by process {owner}")
             return False
-        
-        print(f"Camera index {CAMERA_INDEX} initialized successfully.")
-        return True
+        if USE_SYNTHETIC:
+            camera = SyntheticSource(FRAME_WIDTH, FRAME_HEIGHT, FPS)
+            configure_capture(camera, buffer_size=CAPTURE_BUFFER_SIZE, fourcc=CAPTURE_FOURCC,
+                              passthrough=MJPEG_PASSTHROUGH)
+            print("Synthetic test-pattern source initialized.")
+        else:
+            camera = open_camera(CAMERA_INDEX, FRAME_WIDTH, FRAME_HEIGHT, FPS,
+                                 buffer_size=CAPTURE_BUFFER_SIZE, fourcc=CAPTURE_FOURCC,
+                                 passthrough=MJPEG_PASSTHROUGH)
+            if camera is None:
+                print(f"Error: Unable to open camera index {CAMERA_INDEX}")
+                return False
+            print(f"Camera index {CAMERA_INDEX} initialized successfully.")
+    
+        if FRAME_BUS:
+            camera = FrameBusTee(camera, CAMERA_BUS)
+            print(f"Publishing camera frames to frame bus '{CAMERA_BUS}'.")
+    
+    if broadcaster is None or not broadcaster.running:
+        broadcaster = FrameBroadcaster(camera, jpeg_quality=JPEG_QUALITY,
+                                       adaptive=ADAPTIVE_BITRATE, source_fps=FPS,
+                                       motion_gate=MotionGate(enabled=MOTION_GATE))
+        broadcaster.start()
+    
+    if H264_MODE and H264_AVAILABLE and (h264_stream is None or h264_stream not in broadcaster.sinks):
+        if h264_stream is None:
+            h264_stream = H264Stream(int(camera.get(cv2.CAP_PROP_FRAME_WIDTH)) or FRAME_WIDTH,
+                                     int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT)) or FRAME_HEIGHT,
+                                     FPS, keyframe_interval=H264_KEYFRAME_INTERVAL, crf=H264_CRF)
+            h264_stream.start()
+        broadcaster.sinks.append(h264_stream)
+    
+    if RECORD_PATH and recorder is None:
+        recorder = SessionRecorder(RECORD_PATH, source='camera_server')
+        recorder.record_event('camera', width=int(camera.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                              height=int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT)), fps=FPS)
+    if recorder and not any(isinstance(sink, FrameRecorderSink) for sink in broadcaster.sinks):
+        broadcaster.sinks.append(FrameRecorderSink(recorder, jpeg_quality=JPEG_QUALITY))
     return True
 
+def init_annotated():
+    """Attach to the gesture bridge's annotated frame bus. Returns False if it is not running."""
+    global annotated_broadcaster
+    with _init_lock:
+        if annotated_broadcaster is not None:
+            if annotated_broadcaster.running:
+                return True
+            annotated_broadcaster.source.release()
+            annotated_broadcaster = None
+        try:
+            source = FrameBusSource(ANNOTATED_BUS, consumer='camera_server')
+        except FrameBusError as e:
+            print(f"Annotated stream unavailable: {e}")
+            return False
+        annotated_broadcaster = FrameBroadcaster(source, jpeg_quality=JPEG_QUALITY,
+                                                 adaptive=ADAPTIVE_BITRATE, source_fps=FPS)
+        annotated_broadcaster.start()
+        return True
+
 def detect_camera_type():
     """Detect camera hardware driver type."""
     if os.path.exists('/dev/video0'):
@@ -60,28 +169,41 @@ def get_local_ip():
     except Exception:
         return "localhost"
 
-def generate_frames():
-    """Generator streaming video frames in MJPEG format."""
-    if not init_camera():
-        print("Error: Camera initialization failed.")
-        return
+def generate_frames(address=None, source=None):
+    """Generator streaming the shared broadcaster frames in MJPEG format."""
+    if source is None:
+        if not init_camera():
+            print("Error: Camera initialization failed.")
+            return
+        source = broadcaster
     
-    print("Starting camera video stream...")
+    print(f"Client {address or ''} attached to camera video stream.")
+    _ACTIVE_STREAMS.inc()
     
-    while True:
-        success, frame = camera.read()
-        
-        if not success:
-            print("Warning: Failed to capture frame.")
-            break
-        
-        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
-        if not ret:
-            continue
-        
-        frame_bytes = buffer.tobytes()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+    try:
+        for frame_bytes, captured_at in source.frames(address=address, with_timestamp=True):
+            _FRAMES_SENT.inc()
+            _BYTES_SENT.inc(len(frame_bytes))
+            # X-Timestamp (capture wall-clock time) lets clients measure glass-to-browser latency
+            header = (f'Content-Type: image/jpeg\r\n'
+                      f'Content-Length: {len(frame_bytes)}\r\n'
+                      f'X-Timestamp: {captured_at:.6f}\r\n\r\n').encode()
+            yield b'--frame\r\n' + header + frame_bytes + b'\r\n'
+    finally:
+        _ACTIVE_STREAMS.dec()
+
+@app.before_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _record_request_metrics(response):
+    """Record handler latency (streaming responses measure time to first byte)."""
+    route = request.url_rule.rule if request.url_rule else 'other'
+    elapsed = time.perf_counter() - g.get('request_start', time.perf_counter())
+    metrics.HTTP_REQUEST_SECONDS.labels('camera', route).observe(elapsed)
+    metrics.HTTP_REQUESTS.labels('camera', request.method, route, str(response.status_code)).inc()
+    return response
 
 @app.route('/')
 def index():
@@ -102,19 +224,219 @@ def camera_info():
         'fps': int(actual_fps),
         'quality': JPEG_QUALITY,
         'ip': get_local_ip(),
-        'port': 5000,
-        'camera_type': detect_camera_type(),
-        'camera_index': CAMERA_INDEX
+        'port': SERVER_PORT,
+        'camera_type': 'synthetic' if USE_SYNTHETIC else detect_camera_type(),
+        'camera_index': CAMERA_INDEX,
+        'frames_captured': broadcaster.frames_captured if broadcaster else 0,
+        'frames_encoded': broadcaster.frames_encoded if broadcaster else 0,
+        'frames_passthrough': broadcaster.frames_passthrough if broadcaster else 0,
+        'capture': describe_capture(camera) if camera else {},
+        'adaptive_bitrate': ADAPTIVE_BITRATE,
+        'quality_ladder': [v._asdict() for v in broadcaster.ladder] if broadcaster else [],
+        'clients': broadcaster.client_stats() if broadcaster else [],
+        'h264': h264_stream.as_dict() if h264_stream else {'available': H264_AVAILABLE, 'running': False},
+        'motion': broadcaster.motion_gate.as_dict() if broadcaster and broadcaster.motion_gate else {},
+        'recording': {'path': recorder.path, 'counts': recorder.counts} if recorder else None,
+        'frame_bus': {
+            'enabled': FRAME_BUS,
+            'consumers': camera.consumers() if isinstance(camera, FrameBusTee) else [],
+            'annotated_clients': annotated_broadcaster.client_stats() if annotated_broadcaster else []
+        }
     })
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of in-process metrics."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/video_feed')
 def video_feed():
     """Route streaming real-time video feed (MJPEG)."""
     return Response(
-        generate_frames(),
+        generate_frames(address=request.remote_addr),
         mimetype='multipart/x-mixed-replace; boundary=frame'
     )
 
+@app.route('/video_h264')
+def video_h264():
+    """Route streaming H.264 as fragmented MP4 (Media Source Extensions players)."""
+    if not init_camera() or h264_stream is None:
+        return jsonify({'success': False,
+                        'error': 'H.264 mode is off (start with --h264, needs PyAV)'}), 503
+    response = Response(h264_stream.fragments(), mimetype='video/mp4')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/snapshot.jpg')
+def snapshot():
+    """Single JPEG of the current view, from the cached encoded frame when fresh."""
+    if not init_camera():
+        return jsonify({'success': False, 'error': 'Camera unavailable'}), 503
+    jpeg, captured_at = broadcaster.snapshot()
+    if jpeg is None:
+        return jsonify({'success': False, 'error': 'No frame available'}), 503
+    response = Response(jpeg, content_type='image/jpeg')
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Timestamp'] = f"{captured_at:.6f}"
+    return response
+
+@app.route('/annotated_feed')
+def annotated_feed():
+    """Route streaming the gesture bridge's annotated frames (MJPEG)."""
+    if not init_annotated():
+        return jsonify({'success': False,
+                        'error': 'Gesture bridge is not publishing annotated frames'}), 503
+    return Response(
+        generate_frames(address=request.remote_addr, source=annotated_broadcaster),
+        mimetype='multipart/x-mixed-replace; boundary=frame'
+    )
+
+def _read_stream_latency(url, duration):
+    """Read an MJPEG stream over HTTP and return (capture-to-receive latencies in ms, bytes)."""
+    import urllib.request
+    latencies = []
+    received = 0
+    end = time.monotonic() + duration
+    with urllib.request.urlopen(url, timeout=5) as stream:
+        while time.monotonic() < end:
+            headers = {}
+            line = stream.readline()
+            while line not in (b'\r\n', b''):
+                if b':' in line:
+                    key, value = line.decode().split(':', 1)
+                    headers[key.strip().lower()] = value.strip()
+                line = stream.readline()
+            if not line:
+                break
+            if 'content-length' not in headers:
+                continue
+            received += len(stream.read(int(headers['content-length'])))
+            latencies.append((time.time() - float(headers['x-timestamp'])) * 1000)
+    return latencies, received
+
+def _read_h264_latency(url, duration, stream_source):
+    """Read the fMP4 stream over HTTP; capture times come from the in-process encoder.
+
+    The muxer numbers fragments (mfhd) in the same order as H264Stream, so a
+    fragment's sequence number finds its capture timestamp.
+    """
+    import urllib.request
+    latencies = []
+    received = 0
+    end = time.monotonic() + duration
+    sequence = None
+    with urllib.request.urlopen(url, timeout=5) as stream:
+        while time.monotonic() < end:
+            header = stream.read(8)
+            if len(header) < 8:
+                break
+            size = int.from_bytes(header[:4], 'big')
+            body = stream.read(size - 8)
+            received += size
+            kind = header[4:8]
+            if kind == b'moof':
+                # moof > mfhd (8 byte header, 4 byte version/flags, 4 byte sequence)
+                sequence = int.from_bytes(body[12:16], 'big')
+            elif kind == b'mdat' and sequence is not None:
+                fragment = stream_source.wait_fragment(sequence)
+                if fragment:
+                    latencies.append((time.time() - fragment[1]) * 1000)
+    return latencies, received
+
+def _percentiles(latencies):
+    latencies = sorted(latencies)
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.9)]
+
+def latency_benchmark(duration=5.0):
+    """Glass-to-browser approximation over HTTP for each capture configuration.
+
+    Uses the synthetic camera (which reports exposure time) and a local HTTP
+    client, so the figure covers driver buffering, decode/encode and the
+    server stack but not the network or browser rendering.
+    """
+    global camera, broadcaster, USE_SYNTHETIC, CAPTURE_BUFFER_SIZE, CAPTURE_FOURCC, MJPEG_PASSTHROUGH
+    from werkzeug.serving import make_server
+    from video_source import DEFAULT_DRIVER_BUFFERS
+
+    configs = [
+        ('default buffers, decode + re-encode', DEFAULT_DRIVER_BUFFERS, 'MJPG', False),
+        ('1 buffer, decode + re-encode', 1, 'MJPG', False),
+        ('1 buffer, MJPEG passthrough', 1, 'MJPG', True)
+    ]
+    USE_SYNTHETIC = True
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/video_feed"
+
+    print("=" * 60)
+    print("CAMERA STREAM LATENCY BENCHMARK (synthetic camera over HTTP)")
+    print("=" * 60)
+    try:
+        for label, buffer_size, fourcc, passthrough in configs:
+            CAPTURE_BUFFER_SIZE, CAPTURE_FOURCC, MJPEG_PASSTHROUGH = buffer_size, fourcc, passthrough
+            init_camera()
+            # A webcam starts exposing frames before the first read; let the driver queue fill
+            time.sleep(0.5)
+            cpu_start = time.process_time()
+            latencies = _read_stream_latency(url, duration)[0][10:]
+            cpu = time.process_time() - cpu_start
+            broadcaster.stop()
+            camera.release()
+            camera, broadcaster = None, None
+            if not latencies:
+                print(f"  {label:38s} no frames received")
+                continue
+            p50, p90 = _percentiles(latencies)
+            print(f"  {label:38s} p50 {p50:6.1f} ms | p90 {p90:6.1f} ms | "
+                  f"CPU {cpu / duration * 100:5.1f}% | {len(latencies)} frames")
+    finally:
+        server.shutdown()
+
+def codec_benchmark(duration=5.0):
+    """Bandwidth and latency of /video_feed (MJPEG) vs /video_h264 on the synthetic camera.
+
+    Latency is capture to fully received over local HTTP; browser decode and
+    MSE buffering (typically larger for MP4 than for an <img> MJPEG stream)
+    are not included.
+    """
+    global camera, broadcaster, h264_stream, USE_SYNTHETIC, H264_MODE, H264_KEYFRAME_INTERVAL
+    from werkzeug.serving import make_server
+    if not H264_AVAILABLE:
+        print("PyAV is not installed (pip install av); H.264 mode unavailable.")
+        return
+
+    USE_SYNTHETIC = True
+    H264_MODE = True
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    print("=" * 60)
+    print("MJPEG vs H.264 BENCHMARK (synthetic camera over HTTP)")
+    print("=" * 60)
+    try:
+        for label, keyframe_interval in [('MJPEG /video_feed', None),
+                                         ('H.264 keyframe every 1.0 s', 1.0),
+                                         ('H.264 keyframe every 0.25 s', 0.25)]:
+            H264_KEYFRAME_INTERVAL = keyframe_interval or 1.0
+            init_camera()
+            cpu_start = time.process_time()
+            if keyframe_interval is None:
+                latencies, received = _read_stream_latency(base + '/video_feed', duration)
+            else:
+                latencies, received = _read_h264_latency(base + '/video_h264', duration, h264_stream)
+            cpu = time.process_time() - cpu_start
+            broadcaster.stop()
+            if h264_stream:
+                h264_stream.stop()
+            camera.release()
+            camera, broadcaster, h264_stream = None, None, None
+            p50, p90 = _percentiles(latencies[10:]) if len(latencies) > 20 else (float('nan'),) * 2
+            print(f"  {label:28s} {received * 8 / duration / 1000:8.0f} kbit/s | "
+                  f"latency p50 {p50:5.1f} ms p90 {p90:5.1f} ms | CPU {cpu / duration * 100:5.1f}%")
+    finally:
+        server.shutdown()
+
 def main():
     """Start camera streaming server."""
     local_ip = get_local_ip()
@@ -132,7 +454,16 @@ def main():
         print(f"Camera Index: {CAMERA_INDEX}")
         print(f"Resolution: {actual_width}x{actual_height}")
         print(f"FPS: {actual_fps}")
+        capture = describe_capture(camera)
+        print(f"Capture: {capture['fourcc'] or 'default'} format, {capture['buffer_size']} driver buffer(s), "
+              f"MJPEG passthrough {'ON' if not capture['convert_rgb'] else 'OFF'}")
         print(f"JPEG Quality: {JPEG_QUALITY}%")
+        print(f"Adaptive Bitrate: {'ON' if ADAPTIVE_BITRATE else 'OFF'}")
+        print(f"Motion Gate: {'ON' if MOTION_GATE else 'OFF'}")
+        if H264_MODE:
+            print(f"H.264 Mode: {'ON (keyframe every %.1fs)' % H264_KEYFRAME_INTERVAL if H264_AVAILABLE else 'UNAVAILABLE (pip install av)'}")
+        print(f"Frame Bus: {CAMERA_BUS if FRAME_BUS else 'OFF'}")
+        print(f"Recording: {RECORD_PATH or 'OFF'}")
     else:
         print("\nWARNING: Camera hardware not detected!")
         print("Troubleshooting steps:")
@@ -142,8 +473,12 @@ def main():
         return
     
     print(f"\nAccess URLs:")
-    print(f"  - Local:  http://localhost:5000")
-    print(f"  - LAN:    http://{local_ip}:5000")
+    print(f"  - Local:  http://localhost:{SERVER_PORT}")
+    print(f"  - LAN:    http://{local_ip}:{SERVER_PORT}")
+    if FRAME_BUS:
+        print(f"  - Annotated gesture view: http://{local_ip}:{SERVER_PORT}/annotated_feed")
+    if H264_MODE:
+        print(f"  - H.264:  http://{local_ip}:{SERVER_PORT}/?mode=h264")
     print(f"\nPress Ctrl+C to terminate server.")
     print("=" * 60)
     print()
@@ -151,14 +486,34 @@ def main():
     try:
         app.run(
             host='0.0.0.0',
-            port=5000,
+            port=SERVER_PORT,
             debug=False,
             threaded=True
         )
     finally:
+        if h264_stream:
+            h264_stream.stop()
+        if annotated_broadcaster:
+            annotated_broadcaster.stop()
+            annotated_broadcaster.source.release()
+        if broadcaster:
+            broadcaster.stop()
+        if recorder:
+            recorder.close()
         if camera:
             camera.release()
             print("\nCamera device released.")
 
 if __name__ == "__main__":
-    main()
+    USE_SYNTHETIC = '--synthetic' in sys.argv
+    ADAPTIVE_BITRATE = '--no-adaptive' not in sys.argv
+    FRAME_BUS = '--frame-bus' in sys.argv
+    MOTION_GATE = '--no-motion-gate' not in sys.argv
+    H264_MODE = '--h264' in sys.argv
+    RECORD_PATH = cli_record_path(sys.argv)
+    if '--latency-benchmark' in sys.argv:
+        latency_benchmark()
+    elif '--codec-benchmark' in sys.argv:
+        codec_benchmark()
+    else:
+        main()
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+frame_broadcaster.py - Single Capture/Encode Thread with MJPEG Fan-Out
+One background thread owns the capture device, encodes each frame to JPEG
+once per quality variant in use, and publishes the bytes. Every /video_feed
+client reads the shared latest frame; a slow client skips to the newest frame
+instead of queueing, so capture and encode cost do not grow with the number
+of viewers. With adaptive streaming each client is stepped along the quality
+ladder from adaptive_stream.py according to its measured send backpressure.
+"""
+import collections
+import os
+import sys
+import threading
+import time
+
+import cv2
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+import metrics
+from video_source import raw_jpeg, decode_frame
+from adaptive_stream import QUALITY_LADDER, Variant, AdaptiveRateController
+
+_CAPTURE_SECONDS = metrics.histogram(
+    'smartcar_camera_capture_seconds', 'Camera frame read latency')
+_ENCODE_SECONDS = metrics.histogram(
+    'smartcar_camera_encode_seconds', 'JPEG encode latency per frame and variant', ('variant',))
+_FRAMES_ENCODED = metrics.counter(
+    'smartcar_camera_frames_encoded_total', 'Frames encoded by the broadcaster thread', ('variant',))
+_FRAMES_PASSTHROUGH = metrics.counter(
+    'smartcar_camera_frames_passthrough_total', 'Camera MJPEG frames forwarded without re-encoding')
+_FRAMES_GATED = metrics.counter(
+    'smartcar_camera_frames_gated_total', 'Captured frames not encoded because the scene was static')
+_FRAMES_DROPPED = metrics.counter(
+    'smartcar_camera_frames_dropped_total', 'Frames skipped by clients slower than the camera')
+_SUBSCRIBERS = metrics.gauge(
+    'smartcar_camera_subscribers', 'Clients attached to the frame broadcaster')
+
+class ClientStats:
+    """Per-subscriber delivery counters and adaptive rate state."""
+    def __init__(self, client_id, address=None, rate=None):
+        self.client_id = client_id
+        self.address = address
+        self.rate = rate
+        self.connected_at = time.monotonic()
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.frames_dropped = 0
+
+    @property
+    def level(self):
+        return self.rate.level if self.rate else 0
+
+    def as_dict(self):
+        elapsed = max(1e-6, time.monotonic() - self.connected_at)
+        stats = {
+            'id': self.client_id,
+            'address': self.address,
+            'connected_s': round(elapsed, 1),
+            'frames_sent': self.frames_sent,
+            'frames_dropped': self.frames_dropped,
+            'avg_fps': round(self.frames_sent / elapsed, 2),
+            'avg_bytes_per_sec': int(self.bytes_sent / elapsed)
+        }
+        if self.rate:
+            stats.update(self.rate.as_dict())
+        return stats
+
+class FrameBroadcaster:
+    """Capture + encode once, fan the latest JPEG out to any number of readers."""
+    def __init__(self, source, jpeg_quality=80, max_read_failures=30, adaptive=True,
+                 ladder=QUALITY_LADDER, source_fps=30, motion_gate=None):
+        self.source = source
+        self.motion_gate = motion_gate
+        # Extra consumers of raw captured frames (e.g. the H.264 encoder), called as sink.submit(frame, ts)
+        self.sinks = []
+        self.jpeg_quality = jpeg_quality
+        self.max_read_failures = max_read_failures
+        self.adaptive = adaptive
+        self.source_fps = source_fps
+        # Level 0 always runs at the configured full quality and resolution
+        self.ladder = [Variant(ladder[0].name, 1.0, jpeg_quality)] + list(ladder[1:])
+        self.frames_captured = 0
+        self.frames_encoded = 0
+        self.frames_passthrough = 0
+        self.running = False
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._variants = {}
+        self._timestamp = 0.0
+        self._clients = {}
+        self._snapshot_pending = False
+        self._next_client_id = 1
+        self._thread = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name='frame-broadcaster', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2.0)
+
+    def encode(self, frame, variant=None):
+        """Encode a BGR frame to JPEG bytes for a ladder variant (None on failure)."""
+        variant = variant or self.ladder[0]
+        if variant.scale < 1.0:
+            height, width = frame.shape[:2]
+            size = (max(1, int(width * variant.scale)), max(1, int(height * variant.scale)))
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, variant.quality])
+        return buffer.tobytes() if ok else None
+
+    def _run(self):
+        failures = 0
+        while self.running:
+            t0 = time.perf_counter()
+            success, frame = self.source.read()
+            _CAPTURE_SECONDS.observe(time.perf_counter() - t0)
+            # Synthetic sources report exposure time; for real devices read time is the best we have
+            captured_at = getattr(self.source, 'last_timestamp', None) or time.time()
+
+            if not success:
+                failures += 1
+                if failures >= self.max_read_failures:
+                    print("Warning: Camera stopped delivering frames. Broadcaster exiting.")
+                    break
+                time.sleep(0.01)
+                continue
+            failures = 0
+            self.frames_captured += 1
+
+            for sink in self.sinks:
+                sink.submit(frame, captured_at)
+
+            # Keep draining the device while idle, but only pay for encoding with viewers
+            with self._cond:
+                levels = {c.level for c in self._clients.values()}
+                if self._snapshot_pending:
+                    levels.add(0)
+                    self._snapshot_pending = False
+                    force = True
+                else:
+                    force = False
+            if not levels:
+                continue
+            if self.motion_gate and not force and not self.motion_gate.check(frame):
+                _FRAMES_GATED.inc()
+                continue
+
+            # A camera MJPEG buffer is forwarded as-is to full-quality viewers and
+            # only decoded when some client needs a scaled variant
+            camera_jpeg = raw_jpeg(frame)
+            image = None if camera_jpeg is not None else frame
+            variants = {}
+            for level in sorted(levels):
+                if level == 0 and camera_jpeg is not None:
+                    variants[0] = camera_jpeg
+                    self.frames_passthrough += 1
+                    _FRAMES_PASSTHROUGH.inc()
+                    continue
+                if image is None:
+                    image = decode_frame(frame)
+                    if image is None:
+                        break
+                variant = self.ladder[level]
+                start = time.perf_counter()
+                jpeg = self.encode(image, variant)
+                _ENCODE_SECONDS.labels(variant.name).observe(time.perf_counter() - start)
+                if jpeg is not None:
+                    variants[level] = jpeg
+                    _FRAMES_ENCODED.labels(variant.name).inc()
+            if not variants:
+                continue
+            self.frames_encoded += 1
+            self.publish_variants(variants, captured_at)
+
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+
+    def publish(self, jpeg, timestamp=None):
+        """Make jpeg the current full-quality frame and wake every waiting reader."""
+        self.publish_variants({0: jpeg}, timestamp)
+
+    def publish_variants(self, variants, timestamp=None):
+        """Publish {ladder level: jpeg bytes} for one frame."""
+        with self._cond:
+            self._seq += 1
+            self._variants = variants
+            self._timestamp = time.time() if timestamp is None else timestamp
+            self._cond.notify_all()
+
+    def latest(self):
+        """Return (sequence, jpeg_bytes, capture_timestamp) of the newest frame."""
+        with self._cond:
+            jpeg = self._variants[min(self._variants)] if self._variants else None
+            return self._seq, jpeg, self._timestamp
+
+    def snapshot(self, max_age=1.0, timeout=2.0):
+        """Return (jpeg, capture timestamp) of a recent full-quality frame.
+
+        Served from the cached frame when it is fresh; otherwise the capture
+        thread is asked to encode the next frame even with no viewers.
+        """
+        with self._cond:
+            jpeg = self._variants.get(0)
+            if jpeg is not None and time.time() - self._timestamp <= max_age:
+                return jpeg, self._timestamp
+            seq = self._seq
+            self._snapshot_pending = True
+            self._cond.wait_for(lambda: (self._seq != seq and 0 in self._variants)
+                                or not self.running, timeout)
+            jpeg = self._variants.get(0)
+            return (jpeg, self._timestamp) if jpeg is not None else (None, None)
+
+    def attach(self, address=None):
+        with self._cond:
+            rate = AdaptiveRateController(self.ladder, self.source_fps, enabled=self.adaptive)
+            stats = ClientStats(self._next_client_id, address, rate)
+            self._next_client_id += 1
+            self._clients[stats.client_id] = stats
+            _SUBSCRIBERS.set(len(self._clients))
+            return stats
+
+    def detach(self, stats):
+        with self._cond:
+            self._clients.pop(stats.client_id, None)
+            _SUBSCRIBERS.set(len(self._clients))
+
+    def client_stats(self):
+        with self._cond:
+            clients = list(self._clients.values())
+        return [c.as_dict() for c in clients]
+
+    def frames(self, address=None, timeout=2.0, with_timestamp=False):
+        """Generator yielding the newest JPEG each time one is published.
+
+        Never queues: if several frames were published since the last yield,
+        the reader skips straight to the latest and counts the rest as dropped.
+        With with_timestamp=True yields (jpeg, capture wall-clock time) pairs.
+        """
+        stats = self.attach(address)
+        last_seq = self._seq
+        try:
+            while True:
+                with self._cond:
+                    if not self._cond.wait_for(lambda: self._seq != last_seq or not self.running, timeout):
+                        continue
+                    if not self.running:
+                        return
+                    seq, variants, captured_at = self._seq, self._variants, self._timestamp
+                # A level switched this frame is encoded from the next frame on
+                jpeg = variants.get(stats.level) or variants[min(variants)]
+                skipped = seq - last_seq - 1 if last_seq else 0
+                if skipped > 0:
+                    stats.frames_dropped += skipped
+                    _FRAMES_DROPPED.inc(skipped)
+                last_seq = seq
+                stats.frames_sent += 1
+                stats.bytes_sent += len(jpeg)
+
+                # The WSGI server writes the chunk before resuming us, so the
+                # gap measures socket backpressure for this client
+                sent_at = time.perf_counter()
+                yield (jpeg, captured_at) if with_timestamp else jpeg
+                stats.rate.record(len(jpeg), time.perf_counter() - sent_at, max(0, skipped))
+        finally:
+            self.detach(stats)
+
+def run_load_trial(broadcaster, n_clients, slow_clients=0, duration=10.0, slow_delay=0.2):
+    """Read a started broadcaster with n_clients in-process readers for duration seconds.
+
+    The last slow_clients readers sleep slow_delay after every frame. Returns
+    (process CPU seconds, client_stats() taken before the readers stop).
+    """
+    stop = threading.Event()
+
+    def reader(index):
+        delay = slow_delay if index >= n_clients - slow_clients else 0.0
+        for _ in broadcaster.frames(address=f"load-{index}"):
+            if delay:
+                time.sleep(delay)
+            if stop.is_set():
+                break
+
+    threads = [threading.Thread(target=reader, args=(i,), daemon=True) for i in range(n_clients)]
+    cpu_start = time.process_time()
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    cpu = time.process_time() - cpu_start
+    stats = broadcaster.client_stats()
+    broadcaster.stop()
+    for t in threads:
+        t.join(timeout=2.0)
+    return cpu, stats
+
+def load_test(clients=8, duration=10.0, slow_clients=2, width=640, height=480, fps=30):
+    """Attach many in-process readers to a synthetic broadcaster and report costs."""
+    from video_source import SyntheticSource
+
+    print("=" * 60)
+    print("MJPEG BROADCASTER LOAD TEST (synthetic source)")
+    print("=" * 60)
+    print(f"Source: {width}x{height} @ {fps} FPS, {duration:.0f}s per trial, "
+          f"up to {slow_clients} slow readers")
+    for n in sorted({1, clients}):
+        # The single-client baseline is a fast reader; slow ones join alongside fast ones
+        slow = min(slow_clients, n - 1)
+        broadcaster = FrameBroadcaster(SyntheticSource(width, height, fps))
+        broadcaster.start()
+        cpu, stats = run_load_trial(broadcaster, n, slow, duration)
+        fps_values = [c['avg_fps'] for c in stats]
+        dropped = sum(c['frames_dropped'] for c in stats)
+        levels = collections.Counter(c['level'] for c in stats)
+        print(f"  {n:3d} clients ({slow} slow): encoded {broadcaster.frames_encoded:5d} frames | "
+              f"process CPU {cpu:6.2f}s ({cpu / duration * 100:5.1f}% of one core) | client FPS "
+              f"min {min(fps_values):5.1f} max {max(fps_values):5.1f} | dropped {dropped} "
+              f"| levels {dict(levels)}")
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='MJPEG broadcaster load test')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--slow-clients', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+    load_test(clients=args.clients, duration=args.duration, slow_clients=args.slow_clients)
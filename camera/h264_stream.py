@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+h264_stream.py - Low-Latency H.264 Stream as Fragmented MP4
+Optional alternative to MJPEG: frames from the broadcaster's capture thread
+are encoded once with libx264 (ultrafast, zerolatency, no B-frames) through
+PyAV and muxed to fragmented MP4 with one fragment per frame. Browsers play
+/video_h264 through Media Source Extensions; see camera_view.html?mode=h264.
+
+The MP4 muxer closes a fragment when the next frame arrives (it needs the
+next timestamp for the sample duration), so fragments trail capture by one
+frame interval. New viewers get the init segment and then start at a forced
+keyframe, so joining does not wait for the next periodic keyframe.
+"""
+import collections
+import io
+import os
+import sys
+import threading
+import time
+
+import cv2
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+import metrics
+from video_source import decode_frame
+
+try:
+    import av
+    H264_AVAILABLE = True
+except ImportError:
+    H264_AVAILABLE = False
+
+# Codec string for MSE (Constrained Baseline, level 3.0)
+MIME_TYPE = 'video/mp4; codecs="avc1.42E01E"'
+
+_ENCODE_SECONDS = metrics.histogram(
+    'smartcar_camera_h264_encode_seconds', 'H.264 encode and mux latency per frame')
+_BYTES_OUT = metrics.counter(
+    'smartcar_camera_h264_bytes_total', 'Fragmented MP4 bytes produced by the H.264 encoder')
+_KEYFRAMES = metrics.counter(
+    'smartcar_camera_h264_keyframes_total', 'H.264 keyframes encoded')
+
+class _BoxSink(io.RawIOBase):
+    """File-like muxer output split into top-level MP4 boxes."""
+    def __init__(self, on_box):
+        self.on_box = on_box
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= 8:
+            size = int.from_bytes(self._buffer[:4], 'big')
+            if size < 8 or len(self._buffer) < size:
+                break
+            box = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            self.on_box(box[4:8].decode('ascii', 'replace'), box)
+        return len(data)
+
+class H264Stream:
+    """Encodes submitted frames once and fans fMP4 fragments out to viewers."""
+    def __init__(self, width, height, fps=30, keyframe_interval=2.0, crf=28, bitrate=None):
+        if not H264_AVAILABLE:
+            raise RuntimeError("H.264 mode needs PyAV: pip install av")
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.keyframe_interval = keyframe_interval
+        self.crf = crf
+        self.bitrate = bitrate
+        self.running = False
+        self.frames_encoded = 0
+        self.bytes_out = 0
+        self._cond = threading.Condition()
+        self._pending = None
+        self._init_segment = b''
+        self._pending_moof = None
+        self._fragments = collections.deque(maxlen=max(4, int(fps)))
+        self._fragment_meta = collections.deque()
+        self._seq = 0
+        self._clients = 0
+        self._force_keyframe = False
+        self._thread = None
+        self._container = None
+
+    @property
+    def has_clients(self):
+        return self._clients > 0
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name='h264-encoder', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2.0)
+
+    def submit(self, frame, captured_at=None):
+        """Hand over the newest captured frame; cheap no-op while nobody watches."""
+        if not self._clients:
+            return
+        with self._cond:
+            # Latest frame wins: if the encoder is behind, the older frame is skipped
+            self._pending = (frame, captured_at or time.time())
+            self._cond.notify_all()
+
+    def _open(self):
+        self._sink = _BoxSink(self._on_box)
+        self._container = av.open(self._sink, mode='w', format='mp4', options={
+            'movflags': 'frag_keyframe+empty_moov+default_base_moof+frag_every_frame'})
+        stream = self._container.add_stream('libx264', rate=self.fps)
+        stream.width = self.width
+        stream.height = self.height
+        stream.pix_fmt = 'yuv420p'
+        options = {
+            'preset': 'ultrafast',
+            'tune': 'zerolatency',
+            'profile': 'baseline',
+            'bf': '0',
+            'g': str(max(1, int(round(self.keyframe_interval * self.fps)))),
+            'forced-idr': '1'
+        }
+        if self.bitrate:
+            options.update({'b': str(self.bitrate), 'maxrate': str(self.bitrate),
+                            'bufsize': str(self.bitrate // 2)})
+        else:
+            options['crf'] = str(self.crf)
+        stream.options = options
+        self._stream = stream
+        self._pts = 0
+        self._start_time = None
+
+    def _on_box(self, kind, box):
+        if kind in ('ftyp', 'moov'):
+            self._init_segment += box
+        elif kind == 'moof':
+            self._pending_moof = box
+        elif kind == 'mdat' and self._pending_moof is not None:
+            keyframe, captured_at = self._fragment_meta.popleft() if self._fragment_meta else (False, None)
+            fragment = self._pending_moof + box
+            self._pending_moof = None
+            self.bytes_out += len(fragment)
+            _BYTES_OUT.inc(len(fragment))
+            with self._cond:
+                self._seq += 1
+                self._fragments.append((self._seq, keyframe, captured_at, fragment))
+                self._cond.notify_all()
+
+    def _encode(self, frame, captured_at):
+        image = decode_frame(frame)
+        if image is None:
+            return
+        if image.shape[1] != self.width or image.shape[0] != self.height:
+            image = cv2.resize(image, (self.width, self.height), interpolation=cv2.INTER_AREA)
+        video_frame = av.VideoFrame.from_ndarray(image, format='bgr24')
+        # Timestamps follow capture time so frames skipped by a busy encoder keep playback speed
+        if self._start_time is None:
+            self._start_time = captured_at
+        video_frame.pts = max(self._pts, int(round((captured_at - self._start_time) * self.fps)))
+        self._pts = video_frame.pts + 1
+        if self._force_keyframe:
+            video_frame.pict_type = av.video.frame.PictureType.I
+            self._force_keyframe = False
+        for packet in self._stream.encode(video_frame):
+            if packet.is_keyframe:
+                _KEYFRAMES.inc()
+            self._fragment_meta.append((packet.is_keyframe, captured_at))
+            self._container.mux(packet)
+        self.frames_encoded += 1
+
+    def _run(self):
+        self._open()
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._pending is not None or not self.running)
+                    if not self.running:
+                        return
+                    frame, captured_at = self._pending
+                    self._pending = None
+                start = time.perf_counter()
+                self._encode(frame, captured_at)
+                _ENCODE_SECONDS.observe(time.perf_counter() - start)
+        finally:
+            self._container.close()
+            with self._cond:
+                self.running = False
+                self._cond.notify_all()
+
+    def fragments(self, timeout=2.0, with_timestamp=False):
+        """Generator yielding the init segment, then fragments from a keyframe on.
+
+        A viewer that falls behind the small fragment backlog cannot skip
+        inter frames, so it waits for the next keyframe and forces one.
+        """
+        with self._cond:
+            self._clients += 1
+            self._force_keyframe = True
+        last_seq = None
+        seen_seq = 0
+        try:
+            with self._cond:
+                self._cond.wait_for(lambda: self._init_segment or not self.running, timeout)
+                init = self._init_segment
+            if not init:
+                return
+            yield (init, None) if with_timestamp else init
+            while True:
+                with self._cond:
+                    ready = self._cond.wait_for(
+                        lambda: not self.running or (self._fragments and self._fragments[-1][0] > seen_seq),
+                        timeout)
+                    if not self.running:
+                        return
+                    if not ready:
+                        continue
+                    backlog = [f for f in self._fragments if f[0] > seen_seq]
+                seen_seq = backlog[-1][0]
+                if last_seq is None or backlog[0][0] != last_seq + 1:
+                    # Joining, or lost continuity: restart at the newest keyframe
+                    keyframes = [i for i, f in enumerate(backlog) if f[1]]
+                    if not keyframes:
+                        with self._cond:
+                            self._force_keyframe = True
+                        last_seq = None
+                        continue
+                    backlog = backlog[keyframes[-1]:]
+                for seq, _, captured_at, fragment in backlog:
+                    last_seq = seq
+                    yield (fragment, captured_at) if with_timestamp else fragment
+        finally:
+            with self._cond:
+                self._clients -= 1
+
+    def wait_fragment(self, seq, timeout=2.0):
+        """Fragment seq as (keyframe, captured_at, data), waiting up to timeout for it.
+
+        None if it has already left the backlog, or the encoder stops first.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: not self.running or self._seq >= seq, timeout)
+            for fragment_seq, keyframe, captured_at, fragment in self._fragments:
+                if fragment_seq == seq:
+                    return keyframe, captured_at, fragment
+        return None
+
+    def as_dict(self):
+        return {
+            'available': H264_AVAILABLE,
+            'running': self.running,
+            'clients': self._clients,
+            'keyframe_interval_s': self.keyframe_interval,
+            'frames_encoded': self.frames_encoded,
+            'bytes_out': self.bytes_out,
+            'mime_type': MIME_TYPE
+        }
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+motion_gate.py - Frame-Difference Motion Gate for the Encoder
+Compares a tiny grayscale copy of each captured frame with the last frame that
+was encoded. While the scene is static (car parked) the broadcaster only
+encodes at IDLE_FPS; any motion restores the full camera rate at once and
+keeps it for HOLD_SECONDS. Camera MJPEG buffers are decoded straight to 1/8
+scale grayscale, so gating a passthrough stream stays cheap.
+"""
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+from video_source import raw_jpeg
+
+# Width of the grayscale copy used for differencing
+ANALYSIS_WIDTH = 80
+# Per-pixel change (0-255) that counts as different, above sensor noise
+PIXEL_THRESHOLD = 25
+# Share of changed pixels that counts as motion
+MOTION_FRACTION = 0.01
+# Encode rate while static, and how long full rate is kept after motion
+IDLE_FPS = 2.0
+HOLD_SECONDS = 1.0
+
+class MotionGate:
+    """Decides per captured frame whether it is worth encoding."""
+    def __init__(self, idle_fps=IDLE_FPS, hold_seconds=HOLD_SECONDS,
+                 pixel_threshold=PIXEL_THRESHOLD, motion_fraction=MOTION_FRACTION, enabled=True):
+        self.idle_interval = 1.0 / idle_fps if idle_fps > 0 else float('inf')
+        self.hold_seconds = hold_seconds
+        self.pixel_threshold = pixel_threshold
+        self.motion_fraction = motion_fraction
+        self.enabled = enabled
+        self.score = 0.0
+        self.frames_passed = 0
+        self.frames_gated = 0
+        self._reference = None
+        self._last_motion = 0.0
+        self._last_pass = 0.0
+
+    def _small_gray(self, frame):
+        jpeg = raw_jpeg(frame)
+        if jpeg is not None:
+            return cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        height, width = frame.shape[:2]
+        size = (ANALYSIS_WIDTH, max(1, height * ANALYSIS_WIDTH // width))
+        return cv2.cvtColor(cv2.resize(frame, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+
+    @property
+    def active(self):
+        return time.monotonic() - self._last_motion < self.hold_seconds
+
+    def check(self, frame, now=None):
+        """Return True if this frame should be encoded and published."""
+        if not self.enabled:
+            return True
+        now = time.monotonic() if now is None else now
+        small = self._small_gray(frame)
+        if self._reference is None or small is None or small.shape != self._reference.shape:
+            self.score = 1.0
+        else:
+            changed = cv2.absdiff(small, self._reference) > self.pixel_threshold
+            self.score = float(np.count_nonzero(changed)) / changed.size
+        if self.score >= self.motion_fraction:
+            self._last_motion = now
+
+        if now - self._last_motion < self.hold_seconds or now - self._last_pass >= self.idle_interval:
+            # Compare against what viewers last saw so slow drift still adds up
+            self._reference = small
+            self._last_pass = now
+            self.frames_passed += 1
+            return True
+        self.frames_gated += 1
+        return False
+
+    def as_dict(self):
+        return {
+            'enabled': self.enabled,
+            'state': 'motion' if self.active else 'idle',
+            'score': round(self.score, 4),
+            'frames_passed': self.frames_passed,
+            'frames_gated': self.frames_gated
+        }
+
+def idle_benchmark(duration=5.0):
+    """Encode CPU and bandwidth for one viewer of a static scene, gate off vs on."""
+    import threading
+    from frame_broadcaster import FrameBroadcaster
+    from video_source import SyntheticSource
+
+    print("=" * 60)
+    print("MOTION GATE IDLE BENCHMARK (static synthetic scene, 1 viewer)")
+    print("=" * 60)
+    for enabled in (False, True):
+        source = SyntheticSource(static=True)
+        broadcaster = FrameBroadcaster(source, motion_gate=MotionGate(enabled=enabled))
+        broadcaster.start()
+        received = [0, 0]
+        stop = threading.Event()
+
+        def reader():
+            for jpeg in broadcaster.frames(address='bench'):
+                received[0] += 1
+                received[1] += len(jpeg)
+                if stop.is_set():
+                    break
+
+        thread = threading.Thread(target=reader, daemon=True)
+        cpu_start = time.process_time()
+        thread.start()
+        time.sleep(duration)
+        stop.set()
+        cpu = time.process_time() - cpu_start
+        broadcaster.stop()
+        thread.join(timeout=2.0)
+        print(f"  gate {'ON ' if enabled else 'OFF'}: encoded {broadcaster.frames_encoded:4d} frames | "
+              f"CPU {cpu / duration * 100:5.1f}% | {received[1] / duration / 1024:7.1f} KiB/s to viewer")
+
+if __name__ == "__main__":
+    idle_benchmark()
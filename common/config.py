@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+config.py - Shared Typed Settings (File + Environment + Command Line)
+Deployment-specific values that used to be edited in module constants:
+serial port and baud rate, server URLs and ports, camera resolution, send and
+poll rates, queue and pool sizes. Each module keeps its constant as the
+default and reads the override with config.get(). Later layers win:
+
+  1. the module default
+  2. INI file: --config PATH, $SMARTCAR_CONFIG, or smartcar.ini in the project root
+  3. environment: SMARTCAR_<SECTION>_<KEY>, e.g. SMARTCAR_SERIAL_PORT=/dev/ttyUSB0
+  4. command line: --set section.key=value (repeatable)
+
+Settings are loaded once per process on first use, so every module imported
+by run.py or the supervisor sees the same values. An unknown key or a value
+of the wrong type raises ConfigError; the command-line entry points call
+load_or_exit() first, which reports it and exits with status 2.
+
+  python common/config.py             # effective overrides and where they came from
+  python common/config.py --example   # commented smartcar.ini template
+"""
+import configparser
+import os
+import sys
+import threading
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DEFAULT_PATH = os.path.join(PROJECT_ROOT, 'smartcar.ini')
+ENV_PREFIX = 'SMARTCAR_'
+
+# section.key -> (type, description)
+SETTINGS = {
+    'serial.port': (str, "Arduino serial port, e.g. COM8 or /dev/ttyUSB0"),
+    'serial.baud_rate': (int, "Serial baud rate (must match the firmware)"),
+    'zigbee.port': (str, "Zigbee adapter serial port for the link tester"),
+    'zigbee.baud_rate': (int, "Zigbee adapter baud rate"),
+    'launcher.mode': (str, "Mode run.py starts without showing the menu"),
+    'launcher.test': (bool, "Simulate the serial link in run.py"),
+    'local_web.port': (int, "LAN web control server port"),
+    'local_web.send_interval': (float, "Seconds between repeated serial commands"),
+    'cloud_server.port': (int, "Cloud web server port"),
+    'cloud_server.send_interval': (float, "Seconds between repeated serial commands"),
+    'cloud_server.llm_timeout': (float, "Seconds before an LLM parse falls back to keywords"),
+    'cloud_server.parse_cache_size': (int, "Natural language parse cache entries"),
+    'bridge.server_url': (str, "Cloud server polled by the bridge client"),
+    'bridge.poll_interval': (float, "Seconds between cloud status polls"),
+    'gesture.camera_width': (int, "Gesture bridge capture width"),
+    'gesture.camera_height': (int, "Gesture bridge capture height"),
+    'gesture.camera_fps': (int, "Gesture bridge capture frame rate"),
+    'gesture.camera_fourcc': (str, "Gesture bridge capture pixel format"),
+    'camera.port': (int, "Camera server HTTP port"),
+    'camera.index': (int, "Camera server device index"),
+    'camera.width': (int, "Camera server capture width"),
+    'camera.height': (int, "Camera server capture height"),
+    'camera.fps': (int, "Camera server capture frame rate"),
+    'camera.jpeg_quality': (int, "Camera server JPEG quality (1-100)"),
+    'voice.recognition_workers': (int, "Parallel recognition/parse workers"),
+    'voice.utterance_queue_size': (int, "Utterances buffered before the oldest is dropped"),
+    'voice.parse_cache_size': (int, "Natural language parse cache entries"),
+    'voice.llm_timeout': (float, "Seconds before an LLM parse falls back to keywords"),
+    'drive.tick_interval': (float, "Keyboard drive loop period in seconds"),
+    'drive.keepalive_interval': (float, "Keepalive period while moving (below the 500 ms firmware timeout)"),
+    'arbiter.lease': (float, "Seconds a move command keeps control of the car"),
+    'arbiter.watchdog_tick': (float, "Seconds between watchdog lease checks"),
+    'arbiter.stop_hold': (float, "Seconds a voice/keyboard stop overrides other sources"),
+}
+
+class ConfigError(ValueError):
+    pass
+
+def _parse(key, kind, raw):
+    if isinstance(raw, kind) and not (kind is int and isinstance(raw, bool)):
+        return raw
+    text = str(raw).strip()
+    try:
+        if kind is bool:
+            return configparser.ConfigParser.BOOLEAN_STATES[text.lower()]
+        return kind(text)
+    except (KeyError, ValueError):
+        raise ConfigError(f"{key}: expected {kind.__name__}, got {raw!r}") from None
+
+def _argv_values(argv, flag):
+    """Values given as 'flag VALUE' or 'flag=VALUE'."""
+    values = []
+    for index, arg in enumerate(argv):
+        if arg == flag and index + 1 < len(argv):
+            values.append(argv[index + 1])
+        elif arg.startswith(flag + '='):
+            values.append(arg[len(flag) + 1:])
+    return values
+
+class Config:
+    """Typed overrides plus the layer each one came from."""
+    def __init__(self):
+        self.values = {}
+        self.origins = {}
+        self.path = None
+
+    def set(self, key, raw, origin):
+        if key not in SETTINGS:
+            raise ConfigError(f"Unknown setting '{key}' (from {origin})")
+        self.values[key] = _parse(key, SETTINGS[key][0], raw)
+        self.origins[key] = origin
+
+    def get(self, key, default=None):
+        if key not in SETTINGS:
+            raise KeyError(key)
+        return self.values.get(key, default)
+
+def load(argv=None, environ=None):
+    """Build a Config from the file, environment and --set layers."""
+    argv = sys.argv if argv is None else argv
+    environ = os.environ if environ is None else environ
+    config = Config()
+    paths = _argv_values(argv, '--config')
+    path = paths[-1] if paths else environ.get(ENV_PREFIX + 'CONFIG')
+    if path and not os.path.isfile(path):
+        raise ConfigError(f"Settings file not found: {path}")
+    if not path and os.path.isfile(DEFAULT_PATH):
+        path = DEFAULT_PATH
+    if path:
+        parser = configparser.ConfigParser(interpolation=None)
+        try:
+            parser.read(path, encoding='utf-8')
+        except configparser.Error as e:
+            raise ConfigError(f"{path}: {e}") from None
+        for section in parser.sections():
+            for key, raw in parser.items(section):
+                config.set(f'{section}.{key}', raw, path)
+        config.path = path
+    for key in SETTINGS:
+        name = ENV_PREFIX + key.replace('.', '_').upper()
+        if name in environ:
+            config.set(key, environ[name], '$' + name)
+    for item in _argv_values(argv, '--set'):
+        key, sep, raw = item.partition('=')
+        if not sep:
+            raise ConfigError(f"--set expects section.key=value, got {item!r}")
+        config.set(key.strip(), raw, '--set')
+    return config
+
+_settings = None
+_lock = threading.Lock()
+
+def settings():
+    """The process-wide Config, loaded on first use."""
+    global _settings
+    with _lock:
+        if _settings is None:
+            _settings = load()
+        return _settings
+
+def load_or_exit():
+    """settings() for command-line entry points: a bad configuration exits with status 2."""
+    try:
+        return settings()
+    except ConfigError as e:
+        print(f"Configuration error: {e}")
+        sys.exit(2)
+
+def get(key, default=None):
+    """Configured value for section.key, or default when no layer sets it."""
+    return settings().get(key, default)
+
+def add_arguments(parser):
+    """Declare --config/--set on an argparse parser; the values are read by load()."""
+    parser.add_argument('--config', metavar='PATH', help='Settings file (default: smartcar.ini)')
+    parser.add_argument('--set', action='append', default=[], metavar='SECTION.KEY=VALUE',
+                        help='Override one setting; repeatable')
+
+def example():
+    """Commented INI template with every setting."""
+    lines = ["# smartcar.ini - uncomment and edit what this deployment needs"]
+    section = None
+    for key, (kind, description) in SETTINGS.items():
+        name, option = key.split('.', 1)
+        if name != section:
+            lines += ['', f'[{name}]']
+            section = name
+        lines.append(f"# {description} ({kind.__name__})")
+        lines.append(f"# {option} =")
+    return '\n'.join(lines)
+
+if __name__ == "__main__":
+    if '--example' in sys.argv:
+        print(example())
+        sys.exit(0)
+    config = load_or_exit()
+    print(f"Settings file: {config.path or '(none)'}")
+    if not config.values:
+        print("No overrides; every module uses its built-in defaults.")
+    for key, value in sorted(config.values.items()):
+        print(f"  {key:<30} = {value!r:<24} ({config.origins[key]})")
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+"""
+frame_bus.py - Shared-Memory Frame Ring Between Processes
+One process (the camera server) owns the webcam and writes every captured BGR
+frame into a small ring of NumPy buffers in multiprocessing.shared_memory;
+other processes (the gesture bridge) read the newest frame without a copy.
+A second bus can carry annotated frames back for streaming.
+
+Layout of one segment:
+  header     int64[HEADER_WORDS]  magic, width, height, channels, slots, head seq,
+                                  writer pid, writer heartbeat (time.time_ns)
+  slot seq   int64[MAX_SLOTS]     -1 while a slot is being written (seqlock)
+  slot time  float64[MAX_SLOTS]   wall-clock capture time of each slot
+  consumers  int64[MAX_CONSUMERS, 4] + float64[MAX_CONSUMERS, 2] + names
+  frames     uint8[slots, height, width, channels]
+
+Each reader registers in the consumer table and publishes its last consumed
+sequence and frame age there, so the writer can report per-consumer lag.
+Zero-copy views stay valid for slots - 1 frame intervals; copy if longer.
+A second writer refuses a segment whose writer process is alive and wrote
+within WRITER_STALE_AFTER; only a segment left by a crashed writer is replaced.
+"""
+import os
+import time
+
+import cv2
+import numpy as np
+from multiprocessing import shared_memory
+
+import metrics
+
+CAMERA_BUS = 'smartcar_camera'
+ANNOTATED_BUS = 'smartcar_annotated'
+
+MAGIC = 0x5343464231  # "SCFB1"
+HEADER_WORDS = 8
+MAX_SLOTS = 16
+MAX_CONSUMERS = 8
+NAME_BYTES = 16
+POLL_INTERVAL = 0.002
+# A writer that has not published for this long is presumed dead (covers PID reuse)
+WRITER_STALE_AFTER = 2.0
+
+# Header words
+_MAGIC, _WIDTH, _HEIGHT, _CHANNELS, _SLOTS, _HEAD, _WRITER_PID, _HEARTBEAT = range(HEADER_WORDS)
+
+# Consumer table columns
+_PID, _LAST_SEQ, _FRAMES_READ, _FRAMES_SKIPPED = range(4)
+_AGE_S, _READ_AT = range(2)
+
+_CONSUMER_LAG = metrics.gauge(
+    'smartcar_frame_bus_consumer_lag_frames', 'Frames published since the consumer last read',
+    ('bus', 'consumer'))
+_CONSUMER_AGE = metrics.gauge(
+    'smartcar_frame_bus_consumer_age_seconds', 'Age of the last frame the consumer read',
+    ('bus', 'consumer'))
+_CONSUMER_SKIPPED = metrics.gauge(
+    'smartcar_frame_bus_consumer_skipped_frames', 'Frames the consumer never read',
+    ('bus', 'consumer'))
+
+class FrameBusError(Exception):
+    pass
+
+def _attach(name):
+    """Attach to an existing segment without letting this process unlink it on exit."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 registers attached segments with the resource tracker,
+        # which would destroy the writer's segment when this reader exits
+        shm = shared_memory.SharedMemory(name=name)
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+def _segment_size(width, height, channels, slots):
+    return _frames_offset() + slots * width * height * channels
+
+def _frames_offset():
+    return (8 * (HEADER_WORDS + 2 * MAX_SLOTS) + 8 * MAX_CONSUMERS * 6
+            + MAX_CONSUMERS * NAME_BYTES)
+
+class _Segment:
+    """NumPy views over one bus segment."""
+    def __init__(self, shm, width, height, channels, slots):
+        buf = shm.buf
+        offset = 0
+
+        def view(dtype, shape):
+            nonlocal offset
+            array = np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+            offset += array.nbytes
+            return array
+
+        self.header = view(np.int64, (HEADER_WORDS,))
+        self.slot_seq = view(np.int64, (MAX_SLOTS,))
+        self.slot_time = view(np.float64, (MAX_SLOTS,))
+        self.consumers = view(np.int64, (MAX_CONSUMERS, 4))
+        self.consumer_times = view(np.float64, (MAX_CONSUMERS, 2))
+        self.names = view(np.uint8, (MAX_CONSUMERS, NAME_BYTES))
+        self.frames = view(np.uint8, (slots, height, width, channels))
+
+    @property
+    def head(self):
+        return int(self.header[_HEAD])
+
+class FrameBusWriter:
+    """Single producer publishing frames into a named shared-memory ring."""
+    def __init__(self, name, width, height, channels=3, slots=4):
+        if not 2 <= slots <= MAX_SLOTS:
+            raise ValueError(f"slots must be in [2, {MAX_SLOTS}]")
+        self.name = name
+        self.shape = (height, width, channels)
+        self.slots = slots
+        size = _segment_size(width, height, channels, slots)
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            existing = _attach(name)
+            owner = _live_writer(existing)
+            if owner:
+                existing.close()
+                raise FrameBusError(f"Frame bus '{name}' is in use by writer process {owner}")
+            # Left behind by a crashed writer; readers re-attach on restart
+            existing.close()
+            existing.unlink()
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._seg = _Segment(self._shm, width, height, channels, slots)
+        self._seg.slot_seq[:] = -1
+        self._seg.consumers[:] = 0
+        self._seg.header[:] = (MAGIC, width, height, channels, slots, 0, os.getpid(), time.time_ns())
+        self._last_metrics = 0.0
+
+    @property
+    def seq(self):
+        return self._seg.head
+
+    def write(self, frame, timestamp=None):
+        """Copy one frame into the next slot and publish it. Returns its sequence."""
+        if frame.shape != self.shape:
+            raise FrameBusError(f"Frame shape {frame.shape} does not match bus {self.shape}")
+        seg = self._seg
+        seq = seg.head + 1
+        slot = seq % self.slots
+        seg.slot_seq[slot] = -1
+        np.copyto(seg.frames[slot], frame)
+        seg.slot_time[slot] = time.time() if timestamp is None else timestamp
+        seg.slot_seq[slot] = seq
+        seg.header[_HEAD] = seq
+        seg.header[_HEARTBEAT] = time.time_ns()
+
+        now = time.monotonic()
+        if now - self._last_metrics >= 1.0:
+            self._last_metrics = now
+            self.update_metrics()
+        return seq
+
+    def consumers(self):
+        """Per-consumer lag as seen from the producer."""
+        seg = self._seg
+        head = seg.head
+        now = time.time()
+        result = []
+        for index in range(MAX_CONSUMERS):
+            pid = int(seg.consumers[index, _PID])
+            if not pid:
+                continue
+            last_seq = int(seg.consumers[index, _LAST_SEQ])
+            read_at = float(seg.consumer_times[index, _READ_AT])
+            result.append({
+                'consumer': bytes(seg.names[index]).rstrip(b'\x00').decode('ascii', 'replace'),
+                'pid': pid,
+                'lag_frames': max(0, head - last_seq),
+                'frame_age_ms': round(float(seg.consumer_times[index, _AGE_S]) * 1000, 1),
+                'idle_s': round(now - read_at, 2) if read_at else None,
+                'frames_read': int(seg.consumers[index, _FRAMES_READ]),
+                'frames_skipped': int(seg.consumers[index, _FRAMES_SKIPPED])
+            })
+        return result
+
+    def update_metrics(self):
+        for consumer in self.consumers():
+            labels = (self.name, consumer['consumer'])
+            _CONSUMER_LAG.labels(*labels).set(consumer['lag_frames'])
+            _CONSUMER_AGE.labels(*labels).set(consumer['frame_age_ms'] / 1000.0)
+            _CONSUMER_SKIPPED.labels(*labels).set(consumer['frames_skipped'])
+
+    def close(self):
+        if self._shm is None:
+            return
+        self._seg.header[_MAGIC] = 0
+        self._seg = None
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+class FrameBusReader:
+    """Consumer attached to a named bus; registers itself for lag reporting."""
+    def __init__(self, name, consumer='reader'):
+        self.name = name
+        self.consumer = consumer
+        try:
+            self._shm = _attach(name)
+        except FileNotFoundError:
+            raise FrameBusError(f"Frame bus '{name}' does not exist (is the producer running?)")
+        header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=self._shm.buf)
+        if header[_MAGIC] != MAGIC:
+            self._shm.close()
+            raise FrameBusError(f"Shared memory '{name}' is not a frame bus")
+        width, height, channels, self.slots = (int(v) for v in header[_WIDTH:_HEAD])
+        self.shape = (height, width, channels)
+        self._seg = _Segment(self._shm, width, height, channels, self.slots)
+        self.last_seq = self._seg.head
+        self._index = self._register()
+
+    def _register(self):
+        seg = self._seg
+        pid = os.getpid()
+        for index in range(MAX_CONSUMERS):
+            if seg.consumers[index, _PID] in (0, pid) or not _pid_alive(int(seg.consumers[index, _PID])):
+                seg.consumers[index] = (pid, self.last_seq, 0, 0)
+                seg.consumer_times[index] = (0.0, 0.0)
+                name = self.consumer.encode('ascii', 'replace')[:NAME_BYTES]
+                seg.names[index] = 0
+                seg.names[index, :len(name)] = np.frombuffer(name, dtype=np.uint8)
+                return index
+        return None
+
+    @property
+    def alive(self):
+        return self._seg is not None and self._seg.header[_MAGIC] == MAGIC
+
+    def read(self, timeout=1.0, copy=False):
+        """Wait for a frame newer than the last one read.
+
+        Returns (seq, timestamp, frame) or None on timeout or if the producer
+        closed the bus. frame is a view into shared memory unless copy=True.
+        """
+        deadline = time.monotonic() + timeout
+        seg = self._seg
+        while self.alive:
+            seq = seg.head
+            if seq > self.last_seq:
+                slot = seq % self.slots
+                if seg.slot_seq[slot] == seq:
+                    timestamp = float(seg.slot_time[slot])
+                    frame = seg.frames[slot].copy() if copy else seg.frames[slot]
+                    # Seqlock check: the writer did not start reusing the slot meanwhile
+                    if seg.slot_seq[slot] == seq:
+                        self._record(seq, timestamp)
+                        return seq, timestamp, frame
+                    # Lapped during the copy; the next pass takes the newer frame
+                    continue
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(POLL_INTERVAL)
+        return None
+
+    def _record(self, seq, timestamp):
+        skipped = seq - self.last_seq - 1 if self.last_seq else 0
+        self.last_seq = seq
+        if self._index is None:
+            return
+        row = self._seg.consumers[self._index]
+        row[_LAST_SEQ] = seq
+        row[_FRAMES_READ] += 1
+        row[_FRAMES_SKIPPED] += max(0, skipped)
+        now = time.time()
+        self._seg.consumer_times[self._index] = (now - timestamp, now)
+
+    def close(self):
+        if self._shm is None:
+            return
+        if self._index is not None and self.alive:
+            self._seg.consumers[self._index] = 0
+        self._seg = None
+        self._shm.close()
+        self._shm = None
+
+def live_writer(name):
+    """PID of the process publishing to bus name, or None if it does not exist or is stale."""
+    try:
+        shm = _attach(name)
+    except FileNotFoundError:
+        return None
+    try:
+        return _live_writer(shm)
+    finally:
+        shm.close()
+
+def _live_writer(shm):
+    """PID of the writer still publishing to an existing segment, or None if it is stale."""
+    if shm.size < 8 * HEADER_WORDS:
+        return None
+    header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+    pid, heartbeat = int(header[_WRITER_PID]), int(header[_HEARTBEAT])
+    del header
+    if not pid or not _pid_alive(pid):
+        return None
+    if time.time_ns() - heartbeat > WRITER_STALE_AFTER * 1e9:
+        return None
+    return pid
+
+def _pid_alive(pid):
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class FrameBusSource:
+    """cv2.VideoCapture-compatible source reading a frame bus.
+
+    Lets FrameBroadcaster stream annotated frames, and the gesture bridge take
+    camera frames, with the same read() loop they use for a webcam.
+    """
+    def __init__(self, name, consumer='reader', timeout=1.0, copy=False):
+        self.reader = FrameBusReader(name, consumer)
+        self.timeout = timeout
+        self.copy = copy
+        self.last_timestamp = None
+
+    def isOpened(self):
+        return self.reader.alive
+
+    def read(self):
+        result = self.reader.read(self.timeout, copy=self.copy)
+        if result is None:
+            return False, None
+        _, self.last_timestamp, frame = result
+        return True, frame
+
+    def get(self, prop):
+        height, width, _ = self.reader.shape
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(height)
+        return 0.0
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        self.reader.close()
+
+class FrameBusTee:
+    """Wraps a capture source and publishes every frame it reads to a bus.
+
+    Raw MJPEG buffers (passthrough) are decoded once for the bus; the wrapped
+    frame is returned unchanged so streaming keeps its passthrough path.
+    """
+    def __init__(self, source, name=CAMERA_BUS, slots=4):
+        self.source = source
+        self.name = name
+        self.slots = slots
+        self.writer = None
+
+    def __getattr__(self, attr):
+        return getattr(self.source, attr)
+
+    def read(self):
+        from video_source import decode_frame
+        success, frame = self.source.read()
+        if success:
+            image = decode_frame(frame)
+            if image is not None:
+                if self.writer is None or self.writer.shape != image.shape:
+                    if self.writer:
+                        self.writer.close()
+                    height, width, channels = image.shape
+                    self.writer = FrameBusWriter(self.name, width, height, channels, self.slots)
+                self.writer.write(image, getattr(self.source, 'last_timestamp', None))
+        return success, frame
+
+    def consumers(self):
+        return self.writer.consumers() if self.writer else []
+
+    def release(self):
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+        self.source.release()
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+intent_classifier.py - Pluggable Intent Backends and a Local Intent Classifier
+Command parsing is a chain: the keyword matcher, then a remote LLM (OpenAI in
+the voice controller, Bedrock in the cloud server) for anything it misses.
+This module gives the local stage a common interface so it can be swapped:
+
+  keyword  compiled vocabulary matcher (intent_matcher), misses go to the LLM
+  local    TF-IDF character n-gram linear classifier trained on an expanded
+           phrase set with an out-of-domain class; pure Python, trained once
+           per process in a fraction of a second, scoring in microseconds.
+           Confident answers are final, so paraphrases and misheard words
+           ("hang a left", "go forwrd") no longer need a model round trip.
+
+Both return IntentResult(command, confidence, explanation) or None. Stop
+phrases anywhere in the utterance still preempt, as in the keyword matcher.
+
+Run this module with --benchmark to compare the backends on a held-out set.
+"""
+import collections
+import math
+import random
+import time
+
+import metrics
+from intent_matcher import VOCABULARY, EXPLANATIONS, STOP_COMMAND, default_matcher, build_corpus
+from parse_cache import normalize_text
+
+NGRAM_SIZES = (2, 3, 4)
+EPOCHS = 12
+# Softmax probability of the winning command below which the classifier abstains
+MIN_CONFIDENCE = 0.6
+UNKNOWN = ''
+
+_CLASSIFY_SECONDS = metrics.histogram(
+    'smartcar_intent_classify_seconds', 'Local intent backend latency', ('backend',))
+
+IntentResult = collections.namedtuple('IntentResult', ['command', 'confidence', 'explanation'])
+
+# Paraphrases outside the keyword vocabulary, the kind of input that used to need the LLM
+PARAPHRASES = {
+    'W': ['proceed', 'advance', 'head forward', 'keep going', 'full speed ahead', 'drive on',
+          'move on', 'onward', 'carry on', 'go on', 'drive', 'accelerate', 'forwards',
+          'roll forward', 'push forward', 'head straight', 'keep moving', 'move it'],
+    'S': ['back up', 'retreat', 'go in reverse', 'drive backwards', 'roll back', 'move backwards',
+          'pull back', 'step back', 'backtrack', 'head back', 'reverse the car', 'back off',
+          'put it in reverse'],
+    'A': ['take a left', 'hang a left', 'make a left', 'make a left turn', 'veer left', 'bear left',
+          'to the left', 'go to the left', 'rotate left', 'spin left', 'left turn', 'swing left',
+          'turn to the left'],
+    'D': ['take a right', 'hang a right', 'make a right', 'make a right turn', 'veer right',
+          'bear right', 'to the right', 'go to the right', 'rotate right', 'spin right',
+          'right turn', 'swing right', 'turn to the right'],
+    'X': ['freeze', 'hold on', 'hold it', 'stand still', "don't move", 'pause', 'stay', 'enough',
+          'hold up', 'whoa', 'park', 'stop moving', 'stop the car', 'kill the motors', 'stay put',
+          'cut the engine', 'that is enough', 'no more'],
+}
+
+NEGATIVES = ['what is the weather', 'hello there', 'play some music', 'how fast are we', 'nice job',
+             'the feedback was alright', 'i like this car', 'what time is it', 'turn on the lights',
+             'who are you', 'tell me a joke', 'good morning', 'thank you', 'how are you',
+             'open the camera', 'take a picture', 'what can you do', 'set a timer', 'sing a song',
+             'battery level', 'that is correct', 'you are smart', 'i lost my keys', 'call my mom',
+             'what is your name', 'show me the map', 'turn off the radio', 'is it raining',
+             'where are we', 'good night', 'never mind', 'okay', 'yes', 'no thanks',
+             'you are right', 'all right then', 'i left it at home', 'what is left to do',
+             'take a selfie', 'the right answer', 'stop the music', 'back to the menu']
+
+FILLER_PREFIXES = ['', '', 'please ', 'can you ', 'now ', 'hey car ', 'okay ', 'i want you to ',
+                   'could you ', 'car ']
+FILLER_SUFFIXES = ['', '', ' now', ' please', ' slowly', ' a little', ' for me', ' right away',
+                   ' quickly', ' a bit', ' right now']
+
+# Held out from training: paraphrases, ASR misspellings, traps for substring matching
+EVAL_SET = [
+    ('move it forward', 'W'), ('drive straight ahead please', 'W'), ('go forwrd', 'W'),
+    ('keep moving ahead', 'W'), ('forward march', 'W'), ('head onward', 'W'), ('proceed slowly', 'W'),
+    ('full steam ahead', 'W'), ('reverse please', 'S'), ('backup', 'S'), ('go backwords', 'S'),
+    ('move in reverse', 'S'), ('back it up', 'S'), ('drive back a bit', 'S'), ('retreat now', 'S'),
+    ('hang left', 'A'), ('turn to your left', 'A'), ('take the next left', 'A'), ('go lefft', 'A'),
+    ('steer to the left', 'A'), ('left please', 'A'), ('veer to the left', 'A'),
+    ('turn rigth', 'D'), ('take the next right', 'D'), ('steer to the right', 'D'),
+    ('veer to the right', 'D'), ('make a right turn now', 'D'), ('hang right', 'D'),
+    ('stop right there', 'X'), ('hold still', 'X'), ('halt now', 'X'), ('freeze right now', 'X'),
+    ('stahp', 'X'), ('stay where you are', 'X'), ('pause for a second', 'X'), ('hold it right there', 'X'),
+    ('what is the speed limit', None), ('play the radio', None), ('turn up the volume', None),
+    ('how is the battery', None), ('that is right', None), ('i left my phone in the car', None),
+    ('good job', None), ('what a nice day', None), ('who made you', None), ('take a photo', None),
+]
+
+def extract_features(text):
+    """Character n-grams of the word-padded normalized text, plus whole words."""
+    text = ' ' + normalize_text(text) + ' '
+    counts = collections.Counter()
+    for n in NGRAM_SIZES:
+        for i in range(len(text) - n + 1):
+            counts[text[i:i + n]] += 1
+    for word in text.split():
+        counts['_' + word] += 1
+    return counts
+
+def training_examples(seed=11, expansions=3):
+    """(text, command) pairs: vocabulary and paraphrases with fillers, and out-of-domain text."""
+    rng = random.Random(seed)
+    examples = []
+    for command in VOCABULARY:
+        for phrase in VOCABULARY[command] + PARAPHRASES.get(command, []):
+            examples.append((phrase, command))
+            for _ in range(expansions):
+                examples.append((rng.choice(FILLER_PREFIXES) + phrase + rng.choice(FILLER_SUFFIXES), command))
+    for phrase in NEGATIVES:
+        examples.append((phrase, UNKNOWN))
+        examples.append((rng.choice(FILLER_PREFIXES) + phrase, UNKNOWN))
+    return examples
+
+class KeywordIntentBackend:
+    """Compiled vocabulary matcher behind the intent backend interface."""
+    name = 'keyword'
+    # Substring heuristics: a remote LLM still gets the utterances this misses
+    authoritative = False
+
+    def __init__(self, matcher=None):
+        self.matcher = matcher or default_matcher()
+        self._latency = _CLASSIFY_SECONDS.labels(self.name)
+
+    def classify(self, text):
+        start = time.perf_counter()
+        match = self.matcher.match(text)
+        self._latency.observe(time.perf_counter() - start)
+        return IntentResult(match.command, 1.0, match.explanation) if match else None
+
+class LocalIntentClassifier:
+    """Averaged multi-class perceptron over TF-IDF weighted character n-grams.
+
+    Scores are sums of per-feature weight rows, so classification touches only
+    the few dozen n-grams present in the utterance. It abstains (returns None)
+    for out-of-domain text or when the winning probability is below
+    min_confidence.
+    """
+    name = 'local'
+    authoritative = True
+
+    def __init__(self, examples=None, min_confidence=MIN_CONFIDENCE, epochs=EPOCHS, matcher=None):
+        self.min_confidence = min_confidence
+        self.matcher = matcher or default_matcher()
+        self.labels = []
+        self.idf = {}
+        self.weights = {}
+        self.train_seconds = 0.0
+        self._latency = _CLASSIFY_SECONDS.labels(self.name)
+        self.fit(examples or training_examples(), epochs)
+
+    def vectorize(self, text):
+        """L2-normalized (1 + log tf) * idf vector; unseen features are dropped."""
+        vector = {}
+        for feature, count in extract_features(text).items():
+            idf = self.idf.get(feature)
+            if idf:
+                vector[feature] = (1.0 + math.log(count)) * idf
+        norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+        return {feature: v / norm for feature, v in vector.items()}
+
+    def fit(self, examples, epochs=EPOCHS, seed=5):
+        start = time.perf_counter()
+        self.labels = sorted({label for _, label in examples})
+        index = {label: i for i, label in enumerate(self.labels)}
+        document_frequency = collections.Counter()
+        for text, _ in examples:
+            document_frequency.update(extract_features(text).keys())
+        total = len(examples)
+        self.idf = {f: math.log((1.0 + total) / (1.0 + df)) + 1.0 for f, df in document_frequency.items()}
+        data = [(self.vectorize(text), index[label]) for text, label in examples]
+
+        # Averaged perceptron: keep running weights plus timestamped sums for the average
+        classes = len(self.labels)
+        weights, totals, stamps = {}, {}, {}
+        step = 1
+        rng = random.Random(seed)
+        for _ in range(epochs):
+            rng.shuffle(data)
+            for vector, target in data:
+                scores = [0.0] * classes
+                for feature, value in vector.items():
+                    row = weights.get(feature)
+                    if row:
+                        for c in range(classes):
+                            scores[c] += row[c] * value
+                guess = max(range(classes), key=scores.__getitem__)
+                if guess != target:
+                    for feature, value in vector.items():
+                        row = weights.setdefault(feature, [0.0] * classes)
+                        total_row = totals.setdefault(feature, [0.0] * classes)
+                        elapsed = step - stamps.get(feature, 0)
+                        for c in range(classes):
+                            total_row[c] += elapsed * row[c]
+                        stamps[feature] = step
+                        row[target] += value
+                        row[guess] -= value
+                step += 1
+        for feature, row in weights.items():
+            total_row = totals[feature]
+            elapsed = step - stamps[feature]
+            self.weights[feature] = tuple((total_row[c] + elapsed * row[c]) / step for c in range(classes))
+        self.train_seconds = time.perf_counter() - start
+        return self
+
+    def scores(self, text):
+        """Probability per label (UNKNOWN for out-of-domain) from a softmax over the linear scores."""
+        classes = len(self.labels)
+        scores = [0.0] * classes
+        for feature, value in self.vectorize(text).items():
+            row = self.weights.get(feature)
+            if row:
+                for c in range(classes):
+                    scores[c] += row[c] * value
+        top = max(scores)
+        exp = [math.exp((s - top) * len(scores)) for s in scores]
+        total = sum(exp)
+        return {label: e / total for label, e in zip(self.labels, exp)}
+
+    def classify(self, text):
+        if not text:
+            return None
+        start = time.perf_counter()
+        try:
+            match = self.matcher.match(text)
+            # Stop anywhere and exact vocabulary phrases need no model
+            if match and (match.command == STOP_COMMAND or match.phrase == normalize_text(text)):
+                return IntentResult(match.command, 1.0, match.explanation)
+            probabilities = self.scores(text)
+            label = max(probabilities, key=probabilities.get)
+            if label == UNKNOWN or probabilities[label] < self.min_confidence:
+                return None
+            return IntentResult(label, probabilities[label], EXPLANATIONS.get(label, ''))
+        finally:
+            self._latency.observe(time.perf_counter() - start)
+
+_default_classifier = None
+
+def default_classifier():
+    """Return the process-wide classifier, training it on first use."""
+    global _default_classifier
+    if _default_classifier is None:
+        _default_classifier = LocalIntentClassifier()
+    return _default_classifier
+
+BACKENDS = {
+    'keyword': KeywordIntentBackend,
+    'local': default_classifier,
+}
+
+def make_backend(name):
+    """Build an intent backend by name ('keyword' or 'local')."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown intent backend '{name}' (choose from {', '.join(BACKENDS)})")
+    return BACKENDS[name]()
+
+def benchmark():
+    """Accuracy on the held-out set and per-utterance latency for every backend."""
+    start = time.perf_counter()
+    backends = [KeywordIntentBackend(), default_classifier()]
+    load_s = time.perf_counter() - start
+    corpus = build_corpus(20000)
+
+    print("=" * 72)
+    print("INTENT BACKEND COMPARISON")
+    print("=" * 72)
+    print(f"Held-out set: {sum(1 for _, c in EVAL_SET if c)} commands, "
+          f"{sum(1 for _, c in EVAL_SET if not c)} out-of-domain; "
+          f"local classifier trained in {backends[1].train_seconds * 1000:.0f} ms "
+          f"({len(backends[1].weights)} features, load {load_s * 1000:.0f} ms)")
+    print(f"{'backend':<10}{'correct':>9}{'missed':>8}{'wrong cmd':>11}{'false cmd':>11}"
+          f"{'us/utt':>9}{'p99 us':>9}")
+    for backend in backends:
+        correct = missed = wrong = false = 0
+        for text, expected in EVAL_SET:
+            result = backend.classify(text)
+            command = result.command if result else None
+            if expected is None:
+                false += command is not None
+            elif command == expected:
+                correct += 1
+            elif command is None:
+                missed += 1
+            else:
+                wrong += 1
+        timings = []
+        for text in corpus:
+            t0 = time.perf_counter()
+            backend.classify(text)
+            timings.append(time.perf_counter() - t0)
+        timings.sort()
+        print(f"{backend.name:<10}{correct:>9}{missed:>8}{wrong:>11}{false:>11}"
+              f"{sum(timings) * 1e6 / len(timings):>9.1f}{timings[int(len(timings) * 0.99)] * 1e6:>9.1f}")
+    print("missed = no answer (falls through to the remote LLM), false cmd = "
+          "out-of-domain text turned into a command")
+
+if __name__ == "__main__":
+    import sys
+    if '--benchmark' in sys.argv:
+        benchmark()
+    else:
+        classifier = default_classifier()
+        for utterance in sys.argv[1:] or ['hang a left', 'go forwrd please', 'play some music', 'freeze']:
+            print(f"{utterance!r} -> {classifier.classify(utterance)}")
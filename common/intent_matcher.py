@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+intent_matcher.py - Compiled Single-Pass Keyword Intent Matcher
+Builds one word-bounded, prefix-factored regex from the command vocabulary so
+"go back" resolves to reverse instead of matching "go" as forward. Shared by
+the cloud server and the voice controller.
+
+Resolution rules:
+  - Phrases only match on word boundaries ("alright" is not "right").
+  - At any position the longest phrase wins ("turn left" over "left").
+  - Stop phrases preempt every other intent anywhere in the utterance.
+  - Otherwise the leftmost matching phrase decides the command.
+
+Run this module with --benchmark to compare it against the legacy scans. The
+legacy scans are plain C-level substring tests and are faster per utterance;
+the matcher is used for its word-bounded, ordered resolution, not for speed.
+"""
+import collections
+import re
+
+# Command code -> spoken phrases (merged cloud server and voice controller vocabulary)
+VOCABULARY = {
+    'W': ['forward', 'go forward', 'move forward', 'drive forward', 'drive ahead',
+          'go ahead', 'move ahead', 'ahead', 'straight', 'go straight', 'go'],
+    'S': ['reverse', 'back', 'go back', 'move back', 'backward', 'backwards',
+          'go backward', 'go backwards', 'move backward'],
+    'A': ['left', 'turn left', 'steer left', 'go left'],
+    'D': ['right', 'turn right', 'steer right', 'go right'],
+    'X': ['stop', 'halt', 'brake', 'wait', 'emergency stop']
+}
+
+EXPLANATIONS = {
+    'W': 'Moving forward',
+    'S': 'Moving backward',
+    'A': 'Turning left',
+    'D': 'Turning right',
+    'X': 'Stopping'
+}
+
+STOP_COMMAND = 'X'
+
+IntentMatch = collections.namedtuple('IntentMatch', ['command', 'phrase', 'explanation'])
+
+def _trie_pattern(phrases):
+    """Compile phrases into a prefix-factored regex (greedy, so longest phrase wins).
+
+    Sharing prefixes ("go", "go back", "go left") keeps the regex engine from
+    re-trying every alternative at each offset.
+    """
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for ch in phrase:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [(r'\s+' if ch == ' ' else re.escape(ch)) + build(child)
+                    for ch, child in sorted(node.items()) if ch != '']
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return '(?:' + body + ')?' if '' in node else body
+
+    return build(trie)
+
+class IntentMatcher:
+    """Single regex scan over an utterance resolving to one command code."""
+    def __init__(self, vocabulary=None, priority_command=STOP_COMMAND):
+        vocabulary = vocabulary or VOCABULARY
+        self.priority_command = priority_command
+        self._lookup = {}
+        for command, phrases in vocabulary.items():
+            for phrase in phrases:
+                key = ' '.join(phrase.lower().split())
+                if key in self._lookup and self._lookup[key] != command:
+                    raise ValueError(f"Phrase '{key}' maps to both {self._lookup[key]} and {command}")
+                self._lookup[key] = command
+
+        self._pattern = re.compile(r'\b(?:' + _trie_pattern(self._lookup) + r')\b')
+
+    def match(self, text):
+        """Return IntentMatch for text, or None if no phrase is present."""
+        if not text:
+            return None
+        first = None
+        for m in self._pattern.finditer(text.lower()):
+            phrase = m.group(0)
+            if phrase not in self._lookup:
+                phrase = ' '.join(phrase.split())
+            command = self._lookup[phrase]
+            if command == self.priority_command:
+                return IntentMatch(command, phrase, EXPLANATIONS.get(command, ''))
+            if first is None:
+                first = IntentMatch(command, phrase, EXPLANATIONS.get(command, ''))
+        return first
+
+    def command(self, text):
+        """Return only the command code for text, or None."""
+        result = self.match(text)
+        return result.command if result else None
+
+_default_matcher = None
+
+def default_matcher():
+    """Return the process-wide matcher built from VOCABULARY."""
+    global _default_matcher
+    if _default_matcher is None:
+        _default_matcher = IntentMatcher()
+    return _default_matcher
+
+def match_intent(text):
+    return default_matcher().match(text)
+
+def _legacy_match(text, vocabulary):
+    """Previous per-command substring scan, kept for benchmark comparison."""
+    text_lower = text.lower()
+    for cmd, keywords in vocabulary.items():
+        for keyword in keywords:
+            if keyword in text_lower:
+                return cmd
+    return None
+
+_LEGACY_VOICE_COMMANDS = {
+    'W': ['forward', 'go forward', 'drive ahead', 'move forward', 'ahead'],
+    'S': ['reverse', 'move back', 'go backward', 'backward', 'back'],
+    'A': ['left', 'turn left', 'steer left', 'go left'],
+    'D': ['right', 'turn right', 'steer right', 'go right'],
+    'X': ['stop', 'halt', 'brake', 'emergency stop']
+}
+
+_LEGACY_CLOUD_ORDER = [
+    ('W', ['forward', 'ahead', 'go', 'move forward', 'straight']),
+    ('S', ['back', 'backward', 'reverse']),
+    ('A', ['left', 'turn left']),
+    ('D', ['right', 'turn right']),
+    ('X', ['stop', 'halt', 'brake', 'wait'])
+]
+
+def _legacy_cloud_match(text):
+    """Previous cloud server chain of any() scans, kept for benchmark comparison."""
+    text = text.lower().strip()
+    for cmd, words in _LEGACY_CLOUD_ORDER:
+        if any(word in text for word in words):
+            return cmd
+    return None
+
+def build_corpus(size=100000, seed=7):
+    """Generate a synthetic utterance corpus from the vocabulary."""
+    import random
+    rng = random.Random(seed)
+    prefixes = ['', 'please ', 'can you ', 'now ', 'hey car ', 'okay ', 'i want you to ']
+    suffixes = ['', ' now', ' please', ' slowly', ' a little', ' for me', ' right away']
+    noise = ['what is the weather', 'hello there', 'play some music', 'how fast are we',
+             'nice job', 'the feedback was alright', 'i like this car']
+    phrases = [p for ps in VOCABULARY.values() for p in ps]
+    corpus = []
+    for _ in range(size):
+        if rng.random() < 0.15:
+            corpus.append(rng.choice(noise))
+        else:
+            corpus.append(rng.choice(prefixes) + rng.choice(phrases) + rng.choice(suffixes))
+    return corpus
+
+def _compare(compiled, legacy, rules):
+    """Split legacy disagreements into rule errors and vocabulary changes.
+
+    rules holds the compiled matcher's answers on the legacy vocabulary: where
+    the legacy scan disagrees with it, the legacy substring/order logic was
+    wrong; the remaining differences come from phrases added or removed.
+    """
+    errors = vocabulary = 0
+    for new, old, same_words in zip(compiled, legacy, rules):
+        if new == old:
+            continue
+        if old != same_words:
+            errors += 1
+        else:
+            vocabulary += 1
+    return errors, vocabulary
+
+def benchmark(size=100000):
+    """Time the compiled matcher against both legacy substring scans."""
+    import time
+    corpus = build_corpus(size)
+    matcher = IntentMatcher()
+
+    start = time.perf_counter()
+    compiled = [matcher.command(t) for t in corpus]
+    compiled_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    legacy_voice = [_legacy_match(t, _LEGACY_VOICE_COMMANDS) for t in corpus]
+    voice_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    legacy_cloud = [_legacy_cloud_match(t) for t in corpus]
+    cloud_s = time.perf_counter() - start
+
+    voice_rules = [IntentMatcher(_LEGACY_VOICE_COMMANDS).command(t) for t in corpus]
+    cloud_rules = [IntentMatcher(dict(_LEGACY_CLOUD_ORDER)).command(t) for t in corpus]
+    print("=" * 60)
+    print("INTENT MATCHER BENCHMARK")
+    print("=" * 60)
+    print(f"Utterances:              {size} (synthetic, built from the new vocabulary)")
+    print(f"Compiled matcher:        {compiled_s * 1e6 / size:6.2f} us/utterance")
+    for name, legacy, rules, seconds in (('voice nested scan', legacy_voice, voice_rules, voice_s),
+                                         ('cloud any() chain', legacy_cloud, cloud_rules, cloud_s)):
+        errors, vocabulary = _compare(compiled, legacy, rules)
+        print(f"Legacy {name}: {seconds * 1e6 / size:6.2f} us/utterance "
+              f"(compiled takes {compiled_s / seconds:.1f}x as long)")
+        print(f"  legacy rule errors:    {errors:6d} ({errors * 100.0 / size:.1f}%)")
+        print(f"  vocabulary changes:    {vocabulary:6d} ({vocabulary * 100.0 / size:.1f}%)")
+    print("Rule errors are substring and check-order mistakes the legacy scan makes with its own")
+    print("phrases ('go back' -> W, 'alright' -> D). Vocabulary changes come from phrases only one")
+    print("list has, e.g. 'straight' and 'wait' now resolve where the voice scan gave None.")
+
+if __name__ == "__main__":
+    import sys
+    if '--benchmark' in sys.argv:
+        benchmark()
+    else:
+        for utterance in sys.argv[1:] or ['go back', 'please turn left now', 'go forward then stop']:
+            print(f"{utterance!r} -> {match_intent(utterance)}")
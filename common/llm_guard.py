@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+llm_guard.py - Deadline, Concurrency Limit and Circuit Breaker for LLM Calls
+Runs remote intent classification on a bounded worker pool so a slow or failing
+model returns control to the caller by a hard deadline and the caller can fall
+back to keyword matching instead of stalling motor commands.
+"""
+import collections
+import concurrent.futures
+import math
+import threading
+import time
+
+import metrics
+
+# Outcome codes returned by GuardedExecutor.call()
+OK = 'ok'
+TIMEOUT = 'timeout'
+REJECTED = 'rejected'
+CIRCUIT_OPEN = 'circuit_open'
+ERROR = 'error'
+
+_GUARD_OUTCOMES = metrics.counter(
+    'smartcar_llm_guard_outcomes_total', 'Guarded LLM call outcomes', ('component', 'outcome'))
+_GUARD_INFLIGHT = metrics.gauge(
+    'smartcar_llm_guard_inflight', 'LLM calls currently running on the guard pool', ('component',))
+_BREAKER_OPEN = metrics.gauge(
+    'smartcar_llm_circuit_open', 'Circuit breaker state (1 = open)', ('component',))
+
+class CircuitBreaker:
+    """Open after consecutive failures, allow one probe call after a cool-down.
+
+    clock returns seconds; tests pass a fake one to step through the cool-down.
+    """
+    def __init__(self, failure_threshold=3, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if self.clock() - self.opened_at >= self.reset_timeout:
+                return 'half_open'
+            return 'open'
+
+    def allow(self):
+        """Return True if a call may proceed."""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+
+class LatencyTracker:
+    """Rolling latency window per parse method with percentile summaries."""
+    def __init__(self, window=500):
+        self.window = window
+        self._samples = collections.defaultdict(lambda: collections.deque(maxlen=self.window))
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def record(self, method, seconds):
+        with self._lock:
+            self._samples[method].append(seconds)
+            self._counts[method] += 1
+
+    def percentiles(self):
+        """Return {method: {'count', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms'}}."""
+        with self._lock:
+            snapshot = {m: sorted(s) for m, s in self._samples.items()}
+            counts = dict(self._counts)
+        report = {}
+        for method, samples in snapshot.items():
+            if not samples:
+                continue
+            report[method] = {
+                'count': counts.get(method, 0),
+                'p50_ms': round(_percentile(samples, 50) * 1000, 3),
+                'p90_ms': round(_percentile(samples, 90) * 1000, 3),
+                'p99_ms': round(_percentile(samples, 99) * 1000, 3),
+                'max_ms': round(samples[-1] * 1000, 3)
+            }
+        return report
+
+def _percentile(sorted_samples, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, min(len(sorted_samples) - 1, math.ceil(pct / 100.0 * len(sorted_samples)) - 1))
+    return sorted_samples[index]
+
+class GuardedExecutor:
+    """Bounded thread pool enforcing a per-call deadline and a circuit breaker.
+
+    At most max_concurrent calls run at once. A call that misses its deadline
+    keeps its worker slot until the underlying request returns, so a hung model
+    exhausts the slots and later calls are rejected immediately instead of
+    queueing behind it.
+    """
+    def __init__(self, component, max_concurrent=2, timeout=2.0,
+                 failure_threshold=3, reset_timeout=30.0, clock=time.monotonic):
+        self.component = component
+        self.timeout = timeout
+        self.max_concurrent = max_concurrent
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout, clock)
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrent, thread_name_prefix=f"{component}-llm")
+        self._inflight = _GUARD_INFLIGHT.labels(component)
+        self._breaker_gauge = _BREAKER_OPEN.labels(component)
+
+    def call(self, fn, *args, timeout=None, **kwargs):
+        """Run fn with a deadline. Returns (outcome, value_or_exception)."""
+        if not self._slots.acquire(blocking=False):
+            return self._outcome(REJECTED, None)
+        if not self.breaker.allow():
+            self._slots.release()
+            return self._outcome(CIRCUIT_OPEN, None)
+
+        self._inflight.inc()
+        try:
+            future = self._pool.submit(fn, *args, **kwargs)
+        except RuntimeError as e:
+            self._release(None)
+            return self._outcome(ERROR, e)
+        future.add_done_callback(self._release)
+
+        try:
+            value = future.result(timeout=self.timeout if timeout is None else timeout)
+        except concurrent.futures.TimeoutError:
+            self.breaker.record_failure()
+            return self._outcome(TIMEOUT, None)
+        except Exception as e:
+            self.breaker.record_failure()
+            return self._outcome(ERROR, e)
+
+        self.breaker.record_success()
+        return self._outcome(OK, value)
+
+    def _release(self, _future):
+        self._inflight.dec()
+        self._slots.release()
+
+    def _outcome(self, outcome, value):
+        _GUARD_OUTCOMES.labels(self.component, outcome).inc()
+        self._breaker_gauge.set(1 if self.breaker.state == 'open' else 0)
+        return outcome, value
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
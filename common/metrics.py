@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+metrics.py - Shared In-Process Metrics Registry (Prometheus Text Format)
+Counters, gauges and fixed-bucket latency histograms shared by the web, camera,
+serial and voice modules. Label children are cached so hot-path updates are a
+dictionary lookup plus a locked add.
+"""
+import bisect
+import threading
+import time
+
+# Default latency buckets in seconds (1 ms .. 10 s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def _format_value(value):
+    """Format a sample value the way Prometheus expects."""
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _format_labels(names, values, extra=None):
+    """Render a label set as {a="1",b="2"}."""
+    pairs = [(n, v) for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    body = ','.join(
+        '%s="%s"' % (n, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for n, v in pairs
+    )
+    return '{' + body + '}'
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """Increase counter by a non-negative amount."""
+        with self._lock:
+            self._value += amount
+
+    def get(self):
+        return self._value
+
+class _GaugeChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self._value = float(value)
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    def get(self):
+        return self._value
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._upper_bounds = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Record one observation into its fixed bucket."""
+        index = bisect.bisect_left(self._upper_bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def time(self):
+        """Context manager observing the elapsed wall time of a block."""
+        return _Timer(self)
+
+    def snapshot(self):
+        """Return (cumulative bucket counts, sum, count)."""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = []
+        running = 0
+        for c in counts:
+            running += c
+            cumulative.append(running)
+        return cumulative, total, running
+
+class _Timer:
+    def __init__(self, child):
+        self._child = child
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._child.observe(time.perf_counter() - self._start)
+        return False
+
+class _Metric:
+    """Base class holding label children keyed by label values."""
+    metric_type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self._new_child()
+            self._children[()] = self._default
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        """Return (and cache) the child for a label value set."""
+        if kwargs:
+            values = tuple(kwargs[n] for n in self.labelnames)
+        else:
+            values = tuple(values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}")
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._new_child()
+                    self._children[values] = child
+        return child
+
+    def _items(self):
+        with self._lock:
+            return sorted(self._children.items(), key=lambda kv: tuple(str(v) for v in kv[0]))
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def get(self):
+        return self._default.get()
+
+    def render(self):
+        lines = []
+        for values, child in self._items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}")
+        return lines
+
+class Gauge(_Metric):
+    metric_type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default.set(value)
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+    def get(self):
+        return self._default.get()
+
+    def render(self):
+        lines = []
+        for values, child in self._items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}")
+        return lines
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def render(self):
+        lines = []
+        bounds = list(self.buckets) + [float('inf')]
+        for values, child in self._items():
+            cumulative, total, count = child.snapshot()
+            for bound, c in zip(bounds, cumulative):
+                labels = _format_labels(self.labelnames, values, ('le', _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {c}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class MetricsRegistry:
+    """Process-wide collection of named metrics."""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, documentation, labelnames, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} already registered with a different type or labels")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        """Render all metrics in Prometheus text exposition format."""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+# Default shared registry
+REGISTRY = MetricsRegistry()
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.counter(name, documentation, labelnames)
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.gauge(name, documentation, labelnames)
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.histogram(name, documentation, labelnames, buckets)
+
+def render():
+    return REGISTRY.render()
+
+# Common metrics shared across control modules
+SERIAL_WRITES = counter(
+    'smartcar_serial_writes_total', 'Command bytes written to the serial link', ('source',))
+SERIAL_WRITE_ERRORS = counter(
+    'smartcar_serial_write_errors_total', 'Failed serial write attempts', ('source',))
+SERIAL_WRITE_SECONDS = histogram(
+    'smartcar_serial_write_seconds', 'Serial write call latency', ('source',))
+HTTP_REQUESTS = counter(
+    'smartcar_http_requests_total', 'HTTP requests handled', ('server', 'method', 'route', 'status'))
+HTTP_REQUEST_SECONDS = histogram(
+    'smartcar_http_request_seconds', 'HTTP request handling latency', ('server', 'route'))
+LLM_PARSE_CALLS = counter(
+    'smartcar_llm_parse_total', 'Natural language parse calls by resolution method', ('component', 'method'))
+LLM_PARSE_SECONDS = histogram(
+    'smartcar_llm_parse_seconds', 'Natural language parse latency', ('component', 'method'))
+GESTURE_STAGE_SECONDS = histogram(
+    'smartcar_gesture_stage_seconds', 'Gesture pipeline stage latency', ('stage',))
+
+# Paths the web servers report as their own route label; anything else is 'other'
+HTTP_ROUTES = ('/', '/status', '/metrics', '/llm/parse', '/tts', '/sequence', '/sequence/cancel')
+
+def route_label(path, routes=HTTP_ROUTES):
+    """Collapse request paths into a bounded set of metric route labels."""
+    path = path.split('?', 1)[0]
+    if path.startswith('/cmd/'):
+        return '/cmd'
+    if path in routes:
+        return path
+    return 'other'
+
+class RequestMetricsMixin:
+    """Records latency and status of every request for a BaseHTTPRequestHandler.
+
+    List it before the handler base class and set metrics_server to the
+    server label, e.g. class Handler(RequestMetricsMixin, BaseHTTPRequestHandler).
+    """
+    metrics_server = 'http'
+
+    def handle_one_request(self):
+        """Dispatch one request and record its latency and status metrics."""
+        self._status = 0
+        start = time.perf_counter()
+        super().handle_one_request()
+        method = getattr(self, 'command', None)
+        if method:
+            route = route_label(self.path)
+            HTTP_REQUEST_SECONDS.labels(self.metrics_server, route).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(self.metrics_server, method, route, str(self._status)).inc()
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
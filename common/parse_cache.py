@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+parse_cache.py - Normalized-Text LRU Cache for Natural Language Parse Results
+Sits in front of the LLM parsers so repeated phrases ("go forward", "turn left")
+resolve from memory instead of a model round trip. Entries expire after a TTL,
+the cache is size bounded, and it can optionally persist to a JSON file.
+"""
+import collections
+import json
+import os
+import re
+import threading
+import time
+
+import metrics
+
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_TTL = 6 * 3600.0
+
+_PUNCTUATION = re.compile(r"[^\w\s']+")
+_WHITESPACE = re.compile(r"\s+")
+
+_CACHE_LOOKUPS = metrics.counter(
+    'smartcar_parse_cache_lookups_total', 'Parse cache lookups by result', ('component', 'result'))
+_CACHE_SIZE = metrics.gauge(
+    'smartcar_parse_cache_entries', 'Entries currently held in the parse cache', ('component',))
+
+def normalize_text(text):
+    """Lowercase, drop punctuation and collapse whitespace."""
+    text = _PUNCTUATION.sub(' ', text.lower())
+    return _WHITESPACE.sub(' ', text).strip()
+
+def _valid_row(row):
+    """A persisted entry is [normalized text, stored_at seconds, value]."""
+    return (isinstance(row, list) and len(row) == 3 and isinstance(row[0], str)
+            and isinstance(row[1], (int, float)) and not isinstance(row[1], bool))
+
+class ParseCache:
+    """Thread-safe LRU mapping normalized utterance -> JSON-serializable parse result."""
+    def __init__(self, component, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, path=None):
+        self.component = component
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._hit_counter = _CACHE_LOOKUPS.labels(component, 'hit')
+        self._miss_counter = _CACHE_LOOKUPS.labels(component, 'miss')
+        self._size_gauge = _CACHE_SIZE.labels(component)
+
+        if path:
+            self.load()
+
+    def get(self, text):
+        """Return the cached value for text, or None on miss or expiry."""
+        key = normalize_text(text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self._hit_counter.inc()
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+                self._dirty = True
+            self.misses += 1
+            self._miss_counter.inc()
+            return None
+
+    def put(self, text, value):
+        """Store value for text, evicting the least recently used entry if full."""
+        key = normalize_text(text)
+        if not key:
+            return
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+            self._size_gauge.set(len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
+            self._size_gauge.set(0)
+
+    def stats(self):
+        """Return hit/miss counters and hit rate."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def load(self):
+        """Load unexpired entries from the persistence file, if present."""
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Ignoring unreadable parse cache {self.path}: {e}")
+            return 0
+
+        rows = data.get('entries', []) if isinstance(data, dict) else None
+        if not isinstance(rows, list):
+            print(f"Warning: Ignoring parse cache {self.path}: expected an object with an 'entries' list")
+            return 0
+
+        now = time.time()
+        skipped = 0
+        with self._lock:
+            for row in rows:
+                if not _valid_row(row):
+                    skipped += 1
+                    continue
+                key, stored_at, value = row
+                if now - stored_at <= self.ttl:
+                    self._entries[key] = (stored_at, value)
+            if skipped:
+                print(f"Warning: Skipped {skipped} malformed entries in parse cache {self.path}")
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._size_gauge.set(len(self._entries))
+            return len(self._entries)
+
+    def save(self):
+        """Atomically write entries to the persistence file if anything changed."""
+        if not self.path:
+            return False
+        with self._lock:
+            if not self._dirty:
+                return False
+            entries = [[key, stored_at, value] for key, (stored_at, value) in self._entries.items()]
+            self._dirty = False
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': 1, 'entries': entries}, f)
+            os.replace(tmp_path, self.path)
+            return True
+        except OSError as e:
+            print(f"Warning: Failed to persist parse cache {self.path}: {e}")
+            return False
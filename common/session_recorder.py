@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+session_recorder.py - Segmented Session Recording with a Memory-Mapped Index
+Records timestamped encoded camera frames and command/gesture events of a
+driving session so it can be replayed for performance debugging.
+
+A recording is a directory:
+  seg_00000.dat ...  append-only record payloads, rotated every SEGMENT_BYTES
+  index.bin          fixed-size INDEX_DTYPE rows, one per record, in time order
+  meta.json          start time, source and per-kind counts (written on close)
+
+The index is opened as a numpy.memmap, so finding the record at a timestamp is
+a binary search over the file without reading the payloads; segments are
+mmap'ed too and records are sliced out without copying.
+"""
+import json
+import mmap
+import os
+import threading
+import time
+
+import numpy as np
+
+FRAME = 1
+COMMAND = 2
+GESTURE = 3
+EVENT = 4
+KIND_NAMES = {FRAME: 'frame', COMMAND: 'command', GESTURE: 'gesture', EVENT: 'event'}
+
+INDEX_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('segment', '<u4'),
+    ('offset', '<u8'),
+    ('length', '<u4'),
+    ('kind', 'u1'),
+    ('flags', 'u1'),
+    ('reserved', '<u2')
+])
+
+SEGMENT_BYTES = 64 * 1024 * 1024
+DEFAULT_ROOT = 'recordings'
+
+def cli_record_path(argv, root=DEFAULT_ROOT):
+    """Return the directory given after --record (or a timestamped default), else None."""
+    if '--record' not in argv:
+        return None
+    index = argv.index('--record')
+    if index + 1 < len(argv) and not argv[index + 1].startswith('-'):
+        return argv[index + 1]
+    return os.path.join(root, time.strftime('session_%Y%m%d_%H%M%S'))
+
+class SessionRecorder:
+    """Thread-safe appender of frames and events to a recording directory."""
+    def __init__(self, path, source='session', segment_bytes=SEGMENT_BYTES):
+        self.path = path
+        self.source = source
+        self.segment_bytes = segment_bytes
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, 'index.bin')):
+            raise FileExistsError(f"Recording already exists at {path}")
+        self.started_at = time.time()
+        self.counts = {name: 0 for name in KIND_NAMES.values()}
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+        self._segment = -1
+        self._segment_file = None
+        self._segment_size = 0
+        self._index_file = open(os.path.join(path, 'index.bin'), 'ab')
+        self._last_timestamp = 0.0
+        self._rotate()
+
+    def _rotate(self):
+        if self._segment_file:
+            self._segment_file.close()
+        self._segment += 1
+        self._segment_file = open(os.path.join(self.path, f'seg_{self._segment:05d}.dat'), 'ab')
+        self._segment_size = 0
+
+    def _append(self, kind, payload, timestamp, flags=0):
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            if self._segment_file is None:
+                return
+            if self._segment_size and self._segment_size + len(payload) > self.segment_bytes:
+                self._rotate()
+            # Producers run on different threads; keep the index monotonic for binary search
+            timestamp = max(timestamp, self._last_timestamp)
+            self._last_timestamp = timestamp
+            row = np.array([(timestamp, self._segment, self._segment_size, len(payload), kind, flags, 0)],
+                           dtype=INDEX_DTYPE)
+            self._segment_file.write(payload)
+            self._index_file.write(row.tobytes())
+            self._segment_size += len(payload)
+            self.bytes_written += len(payload)
+            self.counts[KIND_NAMES[kind]] += 1
+
+    def record_frame(self, jpeg, timestamp=None, keyframe=True):
+        self._append(FRAME, bytes(jpeg), timestamp, flags=1 if keyframe else 0)
+
+    def record_command(self, command, source, timestamp=None, **extra):
+        self._append(COMMAND, json.dumps(dict(command=command, source=source, **extra)).encode(), timestamp)
+
+    def record_gesture(self, gesture, description='', timestamp=None, **extra):
+        self._append(GESTURE, json.dumps(dict(gesture=gesture, description=description, **extra)).encode(),
+                     timestamp)
+
+    def record_event(self, name, timestamp=None, **fields):
+        self._append(EVENT, json.dumps(dict(event=name, **fields)).encode(), timestamp)
+
+    def flush(self):
+        with self._lock:
+            if self._segment_file:
+                self._segment_file.flush()
+                self._index_file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._segment_file is None:
+                return
+            self._segment_file.close()
+            self._index_file.close()
+            self._segment_file = None
+        meta = {
+            'source': self.source,
+            'started_at': self.started_at,
+            'ended_at': time.time(),
+            'segments': self._segment + 1,
+            'bytes': self.bytes_written,
+            'counts': self.counts
+        }
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        print(f"Session recording saved to {self.path} ({sum(self.counts.values())} records, "
+              f"{self.bytes_written / 1e6:.1f} MB)")
+
+class FrameRecorderSink:
+    """FrameBroadcaster sink recording every captured frame as JPEG.
+
+    Camera MJPEG buffers are stored as-is; decoded frames are encoded once here.
+    """
+    def __init__(self, recorder, jpeg_quality=85):
+        self.recorder = recorder
+        self.jpeg_quality = jpeg_quality
+
+    def submit(self, frame, captured_at=None):
+        import cv2
+        from video_source import raw_jpeg
+        jpeg = raw_jpeg(frame)
+        if jpeg is None:
+            ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            if not ok:
+                return
+            jpeg = buffer.tobytes()
+        self.recorder.record_frame(jpeg, captured_at)
+
+class Record:
+    __slots__ = ('index', 'timestamp', 'kind', 'flags', 'data')
+
+    def __init__(self, index, timestamp, kind, flags, data):
+        self.index = index
+        self.timestamp = timestamp
+        self.kind = kind
+        self.flags = flags
+        self.data = data
+
+    @property
+    def kind_name(self):
+        return KIND_NAMES.get(self.kind, 'unknown')
+
+    def json(self):
+        return json.loads(bytes(self.data))
+
+    def __repr__(self):
+        return f"Record({self.index}, {self.timestamp:.3f}, {self.kind_name}, {len(self.data)} bytes)"
+
+class SessionReader:
+    """Random-access reader over a recording directory."""
+    def __init__(self, path):
+        self.path = path
+        index_path = os.path.join(path, 'index.bin')
+        if not os.path.exists(index_path):
+            raise FileNotFoundError(f"No recording at {path}")
+        rows = os.path.getsize(index_path) // INDEX_DTYPE.itemsize
+        # A recorder killed mid-write may leave a partial last row; it is ignored
+        self.index = (np.memmap(index_path, dtype=INDEX_DTYPE, mode='r', shape=(rows,))
+                      if rows else np.zeros(0, dtype=INDEX_DTYPE))
+        meta_path = os.path.join(path, 'meta.json')
+        self.meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+        self._segments = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def start_time(self):
+        return float(self.index['timestamp'][0]) if len(self.index) else 0.0
+
+    @property
+    def end_time(self):
+        return float(self.index['timestamp'][-1]) if len(self.index) else 0.0
+
+    def _segment(self, number):
+        if number not in self._segments:
+            with open(os.path.join(self.path, f'seg_{number:05d}.dat'), 'rb') as f:
+                self._segments[number] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._segments[number]
+
+    def __getitem__(self, i):
+        row = self.index[i]
+        segment = self._segment(int(row['segment']))
+        offset, length = int(row['offset']), int(row['length'])
+        data = memoryview(segment)[offset:offset + length]
+        return Record(int(i), float(row['timestamp']), int(row['kind']), int(row['flags']), data)
+
+    def seek(self, timestamp):
+        """Index of the first record at or after timestamp (binary search on the mmap)."""
+        return int(np.searchsorted(self.index['timestamp'], timestamp, side='left'))
+
+    def records(self, start=None, end=None, kinds=None):
+        """Iterate records between wall-clock timestamps, optionally filtered by kind."""
+        first = self.seek(start) if start is not None else 0
+        last = self.seek(end) if end is not None else len(self.index)
+        if kinds is None:
+            positions = range(first, last)
+        else:
+            mask = np.isin(self.index['kind'][first:last], list(kinds))
+            positions = (first + np.flatnonzero(mask)).tolist()
+        for i in positions:
+            yield self[i]
+
+    def summary(self):
+        kinds = self.index['kind'] if len(self.index) else np.zeros(0, dtype=np.uint8)
+        return {
+            'path': self.path,
+            'records': len(self.index),
+            'duration_s': round(self.end_time - self.start_time, 3),
+            'counts': {name: int(np.count_nonzero(kinds == kind)) for kind, name in KIND_NAMES.items()},
+            'bytes': int(self.index['length'].sum()) if len(self.index) else 0,
+            'source': self.meta.get('source')
+        }
+
+    def close(self):
+        for segment in self._segments.values():
+            try:
+                segment.close()
+            except BufferError:
+                # A caller still holds a record payload view; the map closes with it
+                pass
+        self._segments = {}
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 2:
+        print("Usage: python session_recorder.py <recording_dir>")
+        sys.exit(1)
+    reader = SessionReader(sys.argv[1])
+    print(json.dumps(reader.summary(), indent=2))
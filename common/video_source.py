@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+video_source.py - Camera Capture Sources for the Streaming and Gesture Pipelines
+Wraps cv2.VideoCapture with latency-oriented capture options and provides a
+synthetic test-pattern source with the same read()/get()/set()/release()
+interface, so the streaming server, the gesture bridge and their benchmarks
+run on machines without a webcam.
+
+Capture options:
+  - buffer_size: V4L2 keeps several frames queued by default; a slow reader
+    then always gets a frame that is several intervals old. 1 keeps it fresh.
+  - fourcc: request a pixel format, e.g. 'MJPG' (lets USB webcams deliver
+    full frame rate at higher resolutions) or 'YUYV'.
+  - passthrough: with MJPG and CAP_PROP_CONVERT_RGB=0 the V4L2 backend
+    returns the camera's compressed JPEG bytes instead of a decoded BGR frame,
+    so the streaming server can forward them without decode/re-encode.
+"""
+import collections
+import time
+
+import cv2
+import numpy as np
+
+# Frames a V4L2 driver typically keeps queued when left at its default
+DEFAULT_DRIVER_BUFFERS = 4
+
+def fourcc_code(name):
+    return cv2.VideoWriter_fourcc(*name)
+
+def fourcc_name(code):
+    """Decode a CAP_PROP_FOURCC value back to its four characters."""
+    code = int(code)
+    return ''.join(chr((code >> (8 * i)) & 0xFF) for i in range(4)).strip('\x00')
+
+def raw_jpeg(frame):
+    """Return JPEG bytes if frame is an undecoded MJPEG buffer, else None."""
+    if frame is None or frame.dtype != np.uint8:
+        return None
+    if frame.ndim == 2 and frame.shape[0] == 1:
+        frame = frame[0]
+    elif frame.ndim != 1:
+        return None
+    if frame.size < 4 or frame[0] != 0xFF or frame[1] != 0xD8:
+        return None
+    return frame.tobytes()
+
+def decode_frame(frame):
+    """Return a BGR image for either a decoded frame or a raw MJPEG buffer."""
+    jpeg = raw_jpeg(frame)
+    if jpeg is None:
+        return frame
+    return cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+def configure_capture(capture, width=None, height=None, fps=None, buffer_size=1,
+                      fourcc=None, passthrough=False):
+    """Apply capture options to a VideoCapture-compatible source.
+
+    FOURCC is set before the geometry because V4L2 picks the frame size list
+    from the pixel format. Passthrough is only enabled when the driver really
+    negotiated MJPG; with YUYV the unconverted buffer is not a JPEG.
+    Returns True if passthrough is active.
+    """
+    if fourcc or passthrough:
+        capture.set(cv2.CAP_PROP_FOURCC, fourcc_code(fourcc or 'MJPG'))
+    if width:
+        capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    if height:
+        capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    if fps:
+        capture.set(cv2.CAP_PROP_FPS, fps)
+    if buffer_size:
+        capture.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+
+    if passthrough and fourcc_name(capture.get(cv2.CAP_PROP_FOURCC)) == 'MJPG':
+        return bool(capture.set(cv2.CAP_PROP_CONVERT_RGB, 0))
+    return False
+
+def open_camera(index, width, height, fps, buffer_size=1, fourcc=None, passthrough=False):
+    """Open a webcam with the requested geometry and options. Returns None if unavailable."""
+    capture = cv2.VideoCapture(index)
+    if not capture.isOpened():
+        capture.release()
+        return None
+    configure_capture(capture, width, height, fps, buffer_size, fourcc, passthrough)
+    return capture
+
+def describe_capture(capture):
+    """Report the negotiated capture settings (drivers may ignore requests)."""
+    return {
+        'width': int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        'height': int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        'fps': int(capture.get(cv2.CAP_PROP_FPS)),
+        'fourcc': fourcc_name(capture.get(cv2.CAP_PROP_FOURCC)),
+        'buffer_size': int(capture.get(cv2.CAP_PROP_BUFFERSIZE)),
+        'convert_rgb': bool(capture.get(cv2.CAP_PROP_CONVERT_RGB))
+    }
+
+class SyntheticSource:
+    """Moving test pattern paced at a fixed frame rate (cv2.VideoCapture-compatible).
+
+    Emulates the driver queue: frames are exposed on the frame clock and held
+    in up to buffer_size slots (new frames are dropped while all slots are
+    full), so a reader slower than the camera sees the same stale-frame
+    latency as with a real V4L2 device. With FOURCC MJPG each frame is
+    JPEG-encoded "in the camera" and decoded on read unless CONVERT_RGB is 0.
+    last_timestamp is the wall-clock exposure time of the last frame read.
+    static=True freezes the moving box (only the frame counter changes), like
+    a parked car's view.
+    """
+    def __init__(self, width=640, height=480, fps=30, buffer_size=DEFAULT_DRIVER_BUFFERS,
+                 camera_jpeg_quality=85, static=False):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.buffer_size = buffer_size
+        self.camera_jpeg_quality = camera_jpeg_quality
+        self.static = static
+        self.fourcc = 'BGR3'
+        self.convert_rgb = True
+        self.frame_index = 0
+        self.last_timestamp = None
+        self._interval = 1.0 / fps
+        self._next_frame = time.monotonic()
+        self._queue = collections.deque()
+        self._opened = True
+
+        # Static gradient background generated once; only an overlay moves per frame
+        x = np.linspace(0, 255, width, dtype=np.uint8)
+        y = np.linspace(0, 255, height, dtype=np.uint8)
+        self._background = np.dstack([
+            np.tile(x, (height, 1)),
+            np.tile(y[:, None], (1, width)),
+            np.full((height, width), 96, dtype=np.uint8)
+        ])
+
+    def isOpened(self):
+        return self._opened
+
+    def _expose(self, now):
+        while self._next_frame <= now:
+            if len(self._queue) < self.buffer_size:
+                self._queue.append((self.frame_index, self._next_frame))
+            self.frame_index += 1
+            self._next_frame += self._interval
+
+    def _render(self, index):
+        frame = self._background.copy()
+        box = max(20, self.width // 8)
+        position = 0 if self.static else index
+        x = (position * 7) % max(1, self.width - box)
+        y = (position * 3) % max(1, self.height - box)
+        cv2.rectangle(frame, (x, y), (x + box, y + box), (0, 0, 255), -1)
+        cv2.putText(frame, f"SYNTHETIC {index:06d}", (10, self.height - 15),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+        return frame
+
+    def read(self):
+        if not self._opened:
+            return False, None
+        self._expose(time.monotonic())
+        if not self._queue:
+            time.sleep(max(0.0, self._next_frame - time.monotonic()))
+            self._expose(time.monotonic())
+
+        index, exposed_at = self._queue.popleft()
+        self.last_timestamp = time.time() - (time.monotonic() - exposed_at)
+        frame = self._render(index)
+        if self.fourcc == 'MJPG':
+            ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.camera_jpeg_quality])
+            frame = cv2.imdecode(buffer, cv2.IMREAD_COLOR) if self.convert_rgb else buffer.reshape(1, -1)
+        return True, frame
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.fps)
+        if prop == cv2.CAP_PROP_BUFFERSIZE:
+            return float(self.buffer_size)
+        if prop == cv2.CAP_PROP_FOURCC:
+            return float(fourcc_code(self.fourcc))
+        if prop == cv2.CAP_PROP_CONVERT_RGB:
+            return 1.0 if self.convert_rgb else 0.0
+        return 0.0
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_BUFFERSIZE:
+            self.buffer_size = max(1, int(value))
+            while len(self._queue) > self.buffer_size:
+                self._queue.popleft()
+            return True
+        if prop == cv2.CAP_PROP_FOURCC:
+            self.fourcc = 'MJPG' if fourcc_name(value) == 'MJPG' else 'BGR3'
+            return True
+        if prop == cv2.CAP_PROP_CONVERT_RGB:
+            self.convert_rgb = bool(value)
+            return True
+        return False
+
+    def release(self):
+        self._opened = False
+
+def capture_latency_benchmark(duration=5.0, processing_ms=40.0, fps=30):
+    """Frame age seen by a processing loop (like the gesture bridge) per buffer size."""
+    print("=" * 60)
+    print("CAPTURE BUFFER LATENCY (synthetic camera)")
+    print("=" * 60)
+    print(f"{fps} FPS camera, {processing_ms:.0f} ms processing per frame, {duration:.0f}s per trial")
+    for buffer_size in (DEFAULT_DRIVER_BUFFERS, 1):
+        source = SyntheticSource(fps=fps, buffer_size=buffer_size)
+        ages = []
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            ok, frame = source.read()
+            time.sleep(processing_ms / 1000.0)
+            ages.append((time.time() - source.last_timestamp) * 1000)
+        ages = sorted(ages[len(ages) // 5:])
+        print(f"  buffer_size={buffer_size}: frame age at decision "
+              f"p50 {ages[len(ages) // 2]:6.1f} ms | max {ages[-1]:6.1f} ms | {len(ages)} frames")
+
+if __name__ == "__main__":
+    capture_latency_benchmark()
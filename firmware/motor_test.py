@@ -1,81 +1,399 @@
 # -*- coding: utf-8 -*-
 """
-motor_test.py - Smart Car Serial Motor Driver Test Script
+motor_test.py - Smart Car Serial Motor Test Sequence Runner
+Loads a sequence of timed steps, sends each command on a monotonic schedule
+and timestamps every line the firmware prints. The report shows the drift of
+every send from its schedule and the latency from a command to its
+acknowledgement. Sequences use the JSON format of the web servers' /sequence
+endpoint, e.g. {"steps": [["2", 0.2], ["W", 2.0], ["X", 1.0]]}. Without a
+file the built-in forward/reverse/left/right/stop test runs.
+
+  python firmware/motor_test.py                                  # hardware, manual mode (acknowledged)
+  python firmware/motor_test.py firmware/motor_test_sequence.json --simulate
+  python firmware/motor_test.py --simulate --mode 3              # Python mode with keepalives
+
+Only manual mode (2) acknowledges commands ("Executed Command: W", "Speed set
+to ..."), so latency is measured there. Modes 1 and 3 stop the motors after
+2 s / 500 ms without a byte, so the runner repeats the current motion command
+during long steps. --simulate replaces the Arduino with a firmware model on
+a fake serial link (POSIX) and adds the resulting motor timeline.
 """
-import serial
+import json
+import os
+import sys
+import threading
 import time
 
-COM_PORT = ''
-BAUD_RATE = 9600
+import serial
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'serial_bridge'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'web'))
+import config
+if __name__ == "__main__":
+    config.load_or_exit()
+from command_sequencer import SPIN_THRESHOLD, parse_steps
+
+COM_PORT = config.get('serial.port', '')
+BAUD_RATE = config.get('serial.baud_rate', 9600)
+
+DEFAULT_SEQUENCE = [('W', 2.0), ('S', 2.0), ('A', 1.5), ('D', 1.5), ('X', 1.0)]
+# mode: (accepted commands, auto-stop timeout in seconds, acknowledges commands)
+FIRMWARE_MODES = {
+    '1': ('WASDX', 2.0, False),
+    '2': ('WASDX123', None, True),
+    '3': ('WASDXQEZC123', 0.5, False),
+}
+MODE_NAMES = {'1': 'OpenCV Hand Gesture Control', '2': 'Manual Keyboard Control',
+              '3': 'Python Controller Mode'}
+SPEEDS = {'1': ('SLOW', 120), '2': ('NORMAL', 180), '3': ('FAST', 250)}
+DEFAULT_SPEED = 180
+# Keepalive period as a fraction of the firmware timeout
+KEEPALIVE_FRACTION = 0.6
+# Time allowed for trailing acknowledgements after the last step
+SETTLE_TIME = 0.5
 
 def auto_detect_port():
     """Auto-detect connected USB serial COM ports."""
     import serial.tools.list_ports
     ports = list(serial.tools.list_ports.comports())
-    
+
     if not ports:
         return None
-    
+
     usb_ports = [p for p in ports if 'Bluetooth' not in p.description]
     if usb_ports:
         return usb_ports[0].device
     return ports[0].device if ports else None
 
-def test_car():
-    print("=" * 50)
-    print("  SMART CAR SERIAL MOTOR DRIVER TEST")
-    print("=" * 50)
-    
+def sleep_until(deadline):
+    """Sleep to a monotonic deadline, spinning for the last SPIN_THRESHOLD."""
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(remaining - SPIN_THRESHOLD if remaining > SPIN_THRESHOLD else 0)
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+def acknowledged(text):
+    """Command a manual-mode response line acknowledges, or None."""
+    if text.startswith('Executed Command: '):
+        return text[-1:]
+    for key, (name, _) in SPEEDS.items():
+        if text.startswith(f'Speed set to {name}'):
+            return key
+    return None
+
+def load_sequence(path, mode):
+    with open(path, encoding='utf-8') as f:
+        return parse_steps(json.load(f), commands=tuple(FIRMWARE_MODES[mode][0]))
+
+class SimulatedArduino:
+    """Firmware model answering on a FakeSerialLink: mode menu, commands, speeds, auto-stop.
+
+    Every change of the motor output is logged in `motors` as
+    (monotonic time, command, speed, reason).
+    """
+    def __init__(self, baud_rate=None):
+        self.baud_rate = baud_rate
+        self.mode = None
+        self.command = 'X'
+        self.speed = DEFAULT_SPEED
+        self.last_command = None
+        self.motors = []
+
+    def boot(self, link):
+        self._print(link, "SELECT OPERATIONAL MODE:")
+        for mode, name in MODE_NAMES.items():
+            self._print(link, f"  [{mode}] {name}")
+
+    def __call__(self, data, link):
+        now = time.monotonic()
+        for byte in data:
+            self._handle(chr(byte), now, link)
+
+    def expire(self, now):
+        """Apply the firmware's auto-stop if it fell due before now."""
+        if self.mode is None or not self.motors or self.motors[-1][1] == 'X':
+            return
+        timeout = FIRMWARE_MODES[self.mode][1]
+        if timeout and now - self.last_command > timeout:
+            self._drive('X', self.last_command + timeout, 'timeout')
+            self.command = 'X'
+
+    def _handle(self, char, now, link):
+        self.expire(now)
+        if self.mode is None:
+            if char in FIRMWARE_MODES:
+                self.mode = char
+                self._print(link, f">>> SELECTED MODE {char}: {MODE_NAMES[char]}")
+            return
+        accepted, _, acknowledges = FIRMWARE_MODES[self.mode]
+        if self.mode == '2':
+            char = char.upper()
+        if char not in accepted:
+            return
+        if char in SPEEDS:
+            name, self.speed = SPEEDS[char]
+            if acknowledges:
+                # Manual mode keeps the running PWM until the next command
+                self._print(link, f"Speed set to {name} ({self.speed})")
+            else:
+                self.last_command = now
+                self._drive(self.command, now, 'speed')
+            return
+        self.command = char
+        self.last_command = now
+        self._drive(char, now, 'command')
+        if acknowledges:
+            self._print(link, f"Executed Command: {char}")
+
+    def _drive(self, command, at, reason):
+        speed = 0 if command == 'X' else self.speed
+        if self.motors and self.motors[-1][1:3] == (command, speed):
+            return
+        self.motors.append((at, command, speed, reason))
+
+    def _print(self, link, text):
+        line = (text + '\r\n').encode()
+        if self.baud_rate:
+            time.sleep(len(line) * 10.0 / self.baud_rate)
+        link.reply(line)
+
+class SequenceRunner:
+    """Sends timed steps on a monotonic schedule and timestamps every firmware line."""
+    def __init__(self, ser, mode='2', final_command='X'):
+        self.ser = ser
+        self.mode = mode
+        self.final_command = final_command
+        timeout = FIRMWARE_MODES[mode][1]
+        self.keepalive = timeout * KEEPALIVE_FRACTION if timeout else None
+        self.lines = []
+        self.sent = []
+        self.steps = []
+        self.start = None
+        self.elapsed = None
+        self.running = False
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start_reader(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._read, name='firmware-reader', daemon=True)
+        self._thread.start()
+
+    def stop_reader(self):
+        self.running = False
+        if self._thread:
+            self._thread.join(timeout=1.0)
+
+    def _read(self):
+        buffer = b''
+        while self.running:
+            data = self.ser.read(max(1, self.ser.in_waiting))
+            if not data:
+                continue
+            now = time.monotonic()
+            buffer += data
+            *lines, buffer = buffer.split(b'\n')
+            with self._lock:
+                for line in lines:
+                    text = line.decode('utf-8', errors='ignore').strip()
+                    if text:
+                        self.lines.append((now, text))
+
+    def wait_for_line(self, fragment, timeout):
+        """Wait for a firmware line containing fragment; returns it or None."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                for _, text in self.lines:
+                    if fragment in text:
+                        return text
+            time.sleep(0.01)
+        return None
+
+    def select_mode(self, timeout=3.0):
+        self._send(self.mode, 'mode')
+        return self.wait_for_line(f'SELECTED MODE {self.mode}', timeout)
+
+    def _send(self, char, kind):
+        at = time.monotonic()
+        self.ser.write(char.encode())
+        self.sent.append((at, char, kind))
+        return at
+
+    def run(self, steps):
+        """Run the steps; step deadlines are absolute offsets from the start, so jitter does not accumulate."""
+        self.start = deadline = time.monotonic()
+        try:
+            self._run(steps, deadline)
+        except KeyboardInterrupt:
+            self._send('X', 'final')
+            raise
+        time.sleep(SETTLE_TIME)
+
+    def _run(self, steps, deadline):
+        motion = 'X'
+        for command, duration in steps:
+            sleep_until(deadline)
+            actual = self._send(command, 'step')
+            self.steps.append({'command': command, 'scheduled': deadline - self.start,
+                               'actual': actual - self.start, 'sent_at': actual})
+            if command not in SPEEDS:
+                motion = command
+            end = deadline + duration
+            if self.keepalive and motion != 'X':
+                next_keepalive = actual + self.keepalive
+                while next_keepalive < end:
+                    sleep_until(next_keepalive)
+                    self._send(motion, 'keepalive')
+                    next_keepalive += self.keepalive
+            deadline = end
+        sleep_until(deadline)
+        if self.final_command:
+            self._send(self.final_command, 'final')
+        self.elapsed = time.monotonic() - self.start
+
+    def match_acknowledgements(self):
+        """Pair every step and final command with the next acknowledgement for it."""
+        with self._lock:
+            acks = [(at, acknowledged(text)) for at, text in self.lines if at >= self.start]
+        latencies = {}
+        position = 0
+        for at, char, kind in self.sent:
+            if kind not in ('step', 'final'):
+                continue
+            for index in range(position, len(acks)):
+                ack_at, ack = acks[index]
+                if ack == char.upper() and ack_at >= at:
+                    latencies[at] = ack_at - at
+                    position = index + 1
+                    break
+        return latencies
+
+    def report(self, planned):
+        acknowledges = FIRMWARE_MODES[self.mode][2]
+        latencies = self.match_acknowledgements() if acknowledges else {}
+        print("\nSTEP  CMD   scheduled     actual       drift   ack latency")
+        drifts = []
+        for index, step in enumerate(self.steps, 1):
+            drift = step['actual'] - step['scheduled']
+            drifts.append(drift)
+            latency = latencies.get(step['sent_at'])
+            shown = f"{latency * 1000:8.1f} ms" if latency is not None else ('  no ack' if acknowledges else '       -')
+            print(f"{index:4d}   {step['command']}   {step['scheduled']:8.3f}s  {step['actual']:8.3f}s  "
+                  f"{drift * 1000:+8.3f} ms  {shown}")
+
+        print("\nFirmware output:")
+        with self._lock:
+            lines = [(at, text) for at, text in self.lines if at >= self.start]
+        for at, text in lines:
+            print(f"  +{at - self.start:7.3f}s  {text}")
+        if not lines:
+            print("  (none)")
+
+        keepalives = sum(1 for _, _, kind in self.sent if kind == 'keepalive')
+        expected = [at for at, _, kind in self.sent if kind in ('step', 'final')]
+        missing = len(expected) - len(latencies) if acknowledges else 0
+        print("-" * 64)
+        print(f"  schedule drift: max {max(abs(d) for d in drifts) * 1000:.3f} ms, "
+              f"mean {sum(abs(d) for d in drifts) / len(drifts) * 1000:.3f} ms; "
+              f"final stop at {self.elapsed:.3f}s (planned {planned:.3f}s)")
+        if acknowledges:
+            values = list(latencies.values())
+            print(f"  ack latency: p50 {percentile(values, 0.5) * 1000:.1f} ms, "
+                  f"p95 {percentile(values, 0.95) * 1000:.1f} ms, max {max(values, default=0.0) * 1000:.1f} ms; "
+                  f"{missing} of {len(expected)} commands unacknowledged")
+        else:
+            print(f"  mode {self.mode} sends no acknowledgements; "
+                  f"{keepalives} keepalives every {self.keepalive:.2f}s kept the motors running")
+        return missing
+
+def print_motor_timeline(arduino, start):
+    arduino.expire(time.monotonic())
+    print("\nSimulated motor output:")
+    for at, command, speed, reason in arduino.motors:
+        print(f"  +{at - start:7.3f}s  {command}  speed {speed:3d}  ({reason})")
+    stops = sum(1 for motor in arduino.motors if motor[3] == 'timeout')
+    if stops:
+        print(f"  {stops} auto-stop(s): the firmware timed out between commands")
+    return stops
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Smart Car motor test sequence runner')
+    parser.add_argument('sequence', nargs='?', help='JSON sequence file (default: built-in drive test)')
+    parser.add_argument('--mode', choices=sorted(FIRMWARE_MODES), default='2',
+                        help='Firmware mode to select (default 2, the only one that acknowledges)')
+    parser.add_argument('--port', default=COM_PORT, help='Serial port (default: auto-detect)')
+    parser.add_argument('--baud', type=int, default=BAUD_RATE, help=f'Baud rate (default {BAUD_RATE})')
+    parser.add_argument('--simulate', action='store_true', help='Run against a simulated Arduino')
+    config.add_arguments(parser)
+    args = parser.parse_args()
+
+    print("=" * 64)
+    print("  SMART CAR SERIAL MOTOR TEST SEQUENCE")
+    print("=" * 64)
     try:
-        port = COM_PORT if COM_PORT else auto_detect_port()
+        steps = load_sequence(args.sequence, args.mode) if args.sequence else DEFAULT_SEQUENCE
+    except (OSError, ValueError) as e:
+        print(f"\nInvalid sequence: {e}")
+        sys.exit(2)
+
+    link = arduino = None
+    port = args.port
+    if args.simulate:
+        from fake_serial import FakeSerialLink
+        arduino = SimulatedArduino(args.baud)
+        link = FakeSerialLink(baud_rate=args.baud, responder=arduino, keep_bytes=False).start()
+        port = link.port
+    elif not port:
+        port = auto_detect_port()
         if not port:
             print("\nError: Serial COM port not found.")
-            return
-        
-        print(f"\nConnecting to {port} at {BAUD_RATE} baud...")
-        ser = serial.Serial(port, BAUD_RATE, timeout=1)
-        time.sleep(2)
-        print("Connected successfully!\n")
-        
-        print("Arduino initial boot telemetry:")
-        for _ in range(15):
-            if ser.in_waiting > 0:
-                line = ser.readline().decode('utf-8', errors='ignore').strip()
-                if line:
-                    print(f"  {line}")
-            time.sleep(0.1)
-        
-        print("\nSending command '1' - Selecting OpenCV Mode...")
-        ser.write(b'1')
-        time.sleep(1)
-        
-        test_sequence = [
-            ('W', "FORWARD", 2),
-            ('S', "REVERSE", 2),
-            ('A', "LEFT", 1.5),
-            ('D', "RIGHT", 1.5),
-            ('X', "STOP", 1)
-        ]
-        
-        print("\nExecuting test sequence:")
-        for cmd, name, duration in test_sequence:
-            print(f"  Command: {cmd} ({name}) - Duration: {duration}s")
-            ser.write(cmd.encode())
-            
-            start_time = time.time()
-            while time.time() - start_time < duration:
-                if ser.in_waiting > 0:
-                    line = ser.readline().decode('utf-8', errors='ignore').strip()
-                    if line:
-                        print(f"    Arduino response: {line}")
-                time.sleep(0.1)
-        
-        print("\nTest sequence complete! Closing serial port...")
-        ser.close()
-        print("Serial port closed cleanly.")
-        
-    except Exception as e:
+            sys.exit(1)
+
+    failures = 0
+    try:
+        print(f"\nConnecting to {port} at {args.baud} baud{' (simulated Arduino)' if arduino else ''}...")
+        with serial.Serial(port, args.baud, timeout=0.1) as ser:
+            runner = SequenceRunner(ser, args.mode)
+            runner.start_reader()
+            if arduino:
+                arduino.boot(link)
+            else:
+                # Opening the port resets the Arduino
+                time.sleep(2)
+            print(f"Connected. Selecting mode {args.mode} ({MODE_NAMES[args.mode]})...")
+            selected = runner.select_mode()
+            print(f"  {selected}" if selected else
+                  "  No confirmation (the firmware keeps its mode until reset); continuing")
+
+            planned = sum(duration for _, duration in steps)
+            print(f"\nRunning {len(steps)} steps ({planned:.1f}s)...")
+            runner.run(steps)
+            runner.stop_reader()
+            failures += runner.report(planned)
+            if arduino:
+                failures += print_motor_timeline(arduino, runner.start)
+        print("\nTest sequence complete." if not failures else f"\nTest sequence finished with {failures} problem(s).")
+    except serial.SerialException as e:
         print(f"\nSerial test failed: {e}")
+        failures += 1
+    except KeyboardInterrupt:
+        print("\nInterrupted.")
+        failures += 1
+    finally:
+        if link:
+            link.close()
+    sys.exit(1 if failures else 0)
 
 if __name__ == "__main__":
-    test_car()
+    main()
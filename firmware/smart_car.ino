@@ -11,6 +11,8 @@
  *
  * MODE 3: Python Controller Mode
  *   - Receives high-speed command codes (W/A/S/D/X) from Python scripts
+ *   - Arc turns Q/E (forward left/right) and Z/C (reverse left/right)
+ *   - Speed levels 1/2/3 apply to the running command immediately
  *   - Real-time continuous execution with safety auto-stop timeout
  */
 
@@ -26,6 +28,8 @@
 #define SLOW_SPEED 120
 #define DEFAULT_SPEED 180
 #define FAST_SPEED 250
+// Inner wheel speed during arc turns, as a fraction of currentSpeed (percent)
+#define ARC_INNER_PERCENT 40
 
 // Global state variables
 int operationMode = 0; // 0=Not selected, 1=OpenCV, 2=Manual, 3=Python Controller
@@ -199,16 +203,25 @@ void loopPythonKeyboardMode()
     char command = Serial.read();
 
     if (command == 'X' || command == 'W' || command == 'S' ||
-        command == 'A' || command == 'D')
+        command == 'A' || command == 'D' || command == 'Q' ||
+        command == 'E' || command == 'Z' || command == 'C')
     {
       currentCommand = command;
       lastCommandTime = millis();
       executeCommand(command);
     }
+    else if (command == '1' || command == '2' || command == '3')
+    {
+      currentSpeed = command == '1' ? SLOW_SPEED : command == '2' ? DEFAULT_SPEED : FAST_SPEED;
+      lastCommandTime = millis();
+      executeCommand(currentCommand);
+    }
   }
 
   if (millis() - lastCommandTime > 500)
   {
+    // Forget the move too, so a lone speed byte cannot restart it
+    currentCommand = 'X';
     stopMotors();
   }
 }
@@ -223,6 +236,10 @@ void executeCommand(char cmd)
     case 'A': turnLeft(); break;
     case 'D': turnRight(); break;
     case 'X': stopMotors(); break;
+    case 'Q': moveArc(true, true); break;
+    case 'E': moveArc(true, false); break;
+    case 'Z': moveArc(false, true); break;
+    case 'C': moveArc(false, false); break;
     default: stopMotors(); break;
   }
 }
@@ -267,6 +284,18 @@ void turnRight()
   analogWrite(ENB, currentSpeed);
 }
 
+void moveArc(bool forward, bool left)
+{
+  // Both sides drive the same way; the inner side runs slower
+  int inner = (long)currentSpeed * ARC_INNER_PERCENT / 100;
+  digitalWrite(IN1, forward ? HIGH : LOW);
+  digitalWrite(IN2, forward ? LOW : HIGH);
+  digitalWrite(IN3, forward ? HIGH : LOW);
+  digitalWrite(IN4, forward ? LOW : HIGH);
+  analogWrite(ENA, left ? inner : currentSpeed);
+  analogWrite(ENB, left ? currentSpeed : inner);
+}
+
 void stopMotors()
 {
   digitalWrite(IN1, LOW);
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+drive_control.py - Press-and-Hold Drive State and Change-Driven Serial Link
+Turns held keys (or analog axes) into throttle/steer values that ramp toward
+their targets, quantizes them to the firmware's Python-mode protocol and
+writes to the serial link only when the result changes:
+
+  W / S          forward / reverse          Q / E   forward arc left / right
+  A / D          spin left / right          Z / C   reverse arc left / right
+  X              stop                       1/2/3   speed level (slow/normal/fast)
+
+Releasing every key ramps down to a stop. X/space stops at once. The firmware
+stops the motors after 500 ms without a byte, so a moving command is repeated
+every KEEPALIVE_INTERVAL; a stopped car sends nothing.
+
+Run this module with --benchmark to compare serial traffic and response times
+with the legacy 20 Hz command stream on a scripted drive.
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+import config
+if __name__ == "__main__":
+    config.load_or_exit()
+
+TICK_INTERVAL = config.get('drive.tick_interval', 0.02)
+# Firmware mode 3 auto-stops after 500 ms of silence
+KEEPALIVE_INTERVAL = config.get('drive.keepalive_interval', 0.3)
+LEGACY_SEND_INTERVAL = 0.05
+
+# Ramps in units per second (throttle and steer run from -1 to 1)
+ACCELERATION = 2.0
+DECELERATION = 6.0
+STEER_RATE = 8.0
+# A press from rest starts here, so the first byte goes out on the next tick
+START_THROTTLE = 0.35
+DEADZONE = 0.15
+# Steer beyond this while moving turns straight driving into an arc
+ARC_THRESHOLD = 0.35
+# Upper bound of |throttle| for each firmware speed level
+SPEED_LEVELS = ((0.6, '1'), (0.9, '2'), (1.0, '3'))
+
+KEY_AXES = {'W': (1.0, 0.0), 'S': (-1.0, 0.0), 'A': (0.0, -1.0), 'D': (0.0, 1.0)}
+ARC_COMMANDS = {(1, -1): 'Q', (1, 1): 'E', (-1, -1): 'Z', (-1, 1): 'C'}
+STOP_OUTPUT = ('X', None)
+
+def open_python_mode(port, baud_rate, settle_time=2.0):
+    """Open the serial port and select the firmware's Python controller mode."""
+    import serial
+    ser = serial.Serial(port, baud_rate, timeout=1)
+    # Opening the port resets the Arduino
+    time.sleep(settle_time)
+    ser.write(b'3')
+    time.sleep(1)
+    while ser.in_waiting > 0:
+        ser.readline()
+    return ser
+
+def _approach(value, target, rate, dt):
+    step = rate * dt
+    if abs(target - value) <= step:
+        return target
+    return value + step if target > value else value - step
+
+def _sign(value):
+    return (value > 0) - (value < 0)
+
+def speed_level(magnitude):
+    for bound, level in SPEED_LEVELS:
+        if magnitude <= bound:
+            return level
+    return SPEED_LEVELS[-1][1]
+
+def quantize(throttle, steer):
+    """(command, speed level) for throttle/steer in [-1, 1]; level is None for stop."""
+    moving = abs(throttle) >= DEADZONE
+    turning = abs(steer) >= DEADZONE
+    if not moving and not turning:
+        return STOP_OUTPUT
+    if not moving:
+        return ('A' if steer < 0 else 'D'), speed_level(abs(steer))
+    level = speed_level(abs(throttle))
+    if abs(steer) >= ARC_THRESHOLD:
+        return ARC_COMMANDS[(_sign(throttle), _sign(steer))], level
+    return ('W' if throttle > 0 else 'S'), level
+
+class DriveState:
+    """Held keys or analog axes -> ramped throttle/steer -> quantized output.
+
+    press()/release()/set_axes() may be called from any input thread;
+    update() runs on the link thread.
+    """
+    def __init__(self, acceleration=ACCELERATION, deceleration=DECELERATION, steer_rate=STEER_RATE):
+        self.acceleration = acceleration
+        self.deceleration = deceleration
+        self.steer_rate = steer_rate
+        self.throttle = 0.0
+        self.steer = 0.0
+        self.held = set()
+        self._axes = None
+        self._lock = threading.Lock()
+
+    def press(self, key):
+        """Returns False for a key that is already held (auto-repeat)."""
+        with self._lock:
+            if key in self.held or key not in KEY_AXES:
+                return False
+            self.held.add(key)
+            return True
+
+    def release(self, key):
+        with self._lock:
+            self.held.discard(key)
+
+    def set_axes(self, throttle, steer):
+        """Analog input target (stick position); None hands control back to the keys."""
+        with self._lock:
+            self._axes = None if throttle is None else (throttle, steer)
+
+    def stop(self):
+        """Emergency stop: forget every held key and zero the outputs immediately."""
+        with self._lock:
+            self.held.clear()
+            self._axes = None
+            self.throttle = self.steer = 0.0
+
+    def targets(self):
+        with self._lock:
+            if self._axes is not None:
+                return self._axes
+            throttle = sum(KEY_AXES[key][0] for key in self.held)
+            steer = sum(KEY_AXES[key][1] for key in self.held)
+        return throttle, steer
+
+    def settled(self):
+        """True once throttle and steer have reached their targets (no ramp in progress)."""
+        target_throttle, target_steer = self.targets()
+        with self._lock:
+            return self.throttle == target_throttle and self.steer == target_steer
+
+    def update(self, dt):
+        """Ramp throttle and steer toward the targets by dt seconds; returns the output."""
+        target_throttle, target_steer = self.targets()
+        with self._lock:
+            throttle = self.throttle
+            if target_throttle and abs(throttle) < START_THROTTLE and _sign(throttle) in (0, _sign(target_throttle)):
+                throttle = _sign(target_throttle) * min(START_THROTTLE, abs(target_throttle))
+            elif _sign(target_throttle) and _sign(throttle) == -_sign(target_throttle):
+                throttle = 0.0  # reversing direction: stop first, then start from rest
+            rate = self.acceleration if abs(target_throttle) > abs(throttle) else self.deceleration
+            self.throttle = _approach(throttle, target_throttle, rate, dt)
+            self.steer = _approach(self.steer, target_steer, self.steer_rate, dt)
+            return quantize(self.throttle, self.steer)
+
+class DriveLink:
+    """Change-driven sender for a DriveState.
+
+    write(data) does the actual serial write (or simulation log) and runs on
+    the link thread only. idle(now), if given, also runs there after a step
+    that writes nothing with the ramps settled, i.e. the last input changed
+    nothing. Counters are plain attributes for UI polling.
+    """
+    def __init__(self, state, write, tick=TICK_INTERVAL, keepalive=KEEPALIVE_INTERVAL, idle=None):
+        self.state = state
+        self.write = write
+        self.idle = idle
+        self.tick = tick
+        self.keepalive = keepalive
+        self.running = False
+        self.output = STOP_OUTPUT
+        self.writes = 0
+        self.bytes_sent = 0
+        self.changes = 0
+        self._level = None
+        self._last_step = None
+        self._last_write = 0.0
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name='drive-link', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self._wake.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+
+    def poke(self):
+        """Run the next step now instead of waiting for the tick (key pressed or released)."""
+        self._wake.set()
+
+    def step(self, now):
+        """Advance the ramps to now and write if the output changed or keepalive is due."""
+        dt = 0.0 if self._last_step is None else now - self._last_step
+        self._last_step = now
+        output = self.state.update(dt)
+        command, level = output
+        due = command != 'X' and now - self._last_write >= self.keepalive
+        if output == self.output and not due:
+            if self.idle and self.state.settled():
+                self.idle(now)
+            return b''
+        data = b''
+        if level is not None and level != self._level:
+            data += level.encode()
+            self._level = level
+        data += command.encode()
+        if output != self.output:
+            self.changes += 1
+        self.output = output
+        self.write(data)
+        self._last_write = now
+        self.writes += 1
+        self.bytes_sent += len(data)
+        return data
+
+    def _run(self):
+        while self.running:
+            self.step(time.monotonic())
+            self._wake.wait(self.tick)
+            self._wake.clear()
+
+def benchmark():
+    """Scripted drive: legacy 20 Hz stream of the last pressed key vs the change-driven link."""
+    # (time, action, key) - includes a diagonal, hands-off releases and an emergency stop
+    script = [(0.5, 'press', 'W'), (2.5, 'press', 'A'), (3.5, 'release', 'A'), (6.0, 'release', 'W'),
+              (8.0, 'press', 'D'), (8.6, 'release', 'D'), (10.0, 'press', 'S'), (11.5, 'release', 'S'),
+              (13.0, 'press', 'W'), (15.0, 'stop', 'X')]
+    duration = 18.0
+    ticks = int(duration / TICK_INTERVAL)
+
+    # Legacy: the last key pressed streams every 50 ms until another key; releases are ignored
+    legacy_bytes = 0
+    legacy_unattended = 0.0
+    command, held, events = 'X', set(), list(script)
+    for i in range(ticks):
+        t = i * TICK_INTERVAL
+        while events and events[0][0] <= t:
+            _, action, key = events.pop(0)
+            if action == 'press':
+                command = key
+                held.add(key)
+            elif action == 'release':
+                held.discard(key)
+            else:
+                command = 'X'
+                held.clear()
+        if i % round(LEGACY_SEND_INTERVAL / TICK_INTERVAL) == 0:
+            legacy_bytes += 1
+        if command != 'X' and not held:
+            legacy_unattended += TICK_INTERVAL
+
+    state = DriveState()
+    sent = []
+    link = DriveLink(state, sent.append)
+    unattended = 0.0
+    press_latency, stop_latency = [], []
+    waiting_press = waiting_stop = None
+    events = list(script)
+    for i in range(ticks):
+        t = i * TICK_INTERVAL
+        while events and events[0][0] <= t:
+            event_time, action, key = events.pop(0)
+            if action == 'press':
+                state.press(key)
+                waiting_press = (event_time, len(sent))
+            elif action == 'release':
+                state.release(key)
+            else:
+                state.stop()
+            if not state.held:
+                waiting_stop = event_time
+        link.step(t)
+        if waiting_press and len(sent) > waiting_press[1]:
+            press_latency.append(t - waiting_press[0])
+            waiting_press = None
+        if waiting_stop is not None and link.output == STOP_OUTPUT:
+            stop_latency.append(t - waiting_stop)
+            waiting_stop = None
+        if link.output != STOP_OUTPUT and not state.held:
+            unattended += TICK_INTERVAL
+
+    print("=" * 64)
+    print(f"KEYBOARD DRIVE BENCHMARK ({duration:.0f}s scripted session)")
+    print("=" * 64)
+    print(f"  legacy stream: {legacy_bytes:4d} bytes, moving with no key held for {legacy_unattended:.1f} s")
+    print(f"  change-driven: {link.bytes_sent:4d} bytes in {link.writes} writes ({link.changes} changes, "
+          f"rest keepalive), {1 - link.bytes_sent / legacy_bytes:.0%} less traffic, "
+          f"moving with no key held for {unattended:.2f} s (ramp down)")
+    print(f"  press -> first byte: max {max(press_latency) * 1000:.0f} ms (tick {TICK_INTERVAL * 1000:.0f} ms, "
+          f"keys also wake the link); release/stop -> X: "
+          f"{', '.join(f'{l * 1000:.0f}' for l in stop_latency)} ms")
+    print(f"  bytes sent: {b''.join(sent).decode()}")
+
+if __name__ == "__main__":
+    if '--benchmark' in sys.argv:
+        benchmark()
@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+"""
+headless_controller.py - Headless Keyboard / Gamepad Controller
+Drives the car without a Tk window, so it works over SSH on the car's own
+computer. Input comes straight from the device instead of a GUI event loop
+and goes through the same DriveState/DriveLink as the keyboard GUI (held
+keys, ramps, change-driven serial writes):
+
+  evdev    Linux input devices: a gamepad (left stick = analog throttle and
+           steer, d-pad = keys, A/B = stop, Start = quit) or a keyboard
+           (W/A/S/D held, X/space stop, Esc quit). Needs read access to
+           /dev/input (e.g. the 'input' group).
+  pynput   Keyboard press/release through pynput (X session or uinput).
+  tty      Raw terminal input, works in any SSH session. Terminals report no
+           key releases, so a key counts as held while its auto-repeat keeps
+           arriving; one key at a time.
+
+On exit it prints input-to-serial latency (evdev uses kernel event timestamps).
+"""
+import os
+import select
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+import config
+if __name__ == "__main__":
+    config.load_or_exit()
+import metrics
+from drive_control import DriveState, DriveLink, TICK_INTERVAL, open_python_mode
+
+try:
+    import evdev
+    from evdev import ecodes
+    EVDEV_AVAILABLE = True
+except ImportError:
+    EVDEV_AVAILABLE = False
+
+try:
+    from pynput import keyboard as pynput_keyboard
+    PYNPUT_AVAILABLE = True
+except ImportError:
+    PYNPUT_AVAILABLE = False
+
+# No default port: connect() auto-detects unless serial.port is configured
+COM_PORT = config.get('serial.port')
+BAUD_RATE = config.get('serial.baud_rate', 9600)
+STICK_DEADZONE = 0.12
+# Terminal auto-repeat: first repeat arrives after the keyboard delay, then at the repeat rate
+TTY_HOLD_INITIAL = 0.6
+TTY_HOLD_REPEAT = 0.15
+
+_WRITES = metrics.SERIAL_WRITES.labels(source='keyboard_headless')
+_WRITE_ERRORS = metrics.SERIAL_WRITE_ERRORS.labels(source='keyboard_headless')
+_WRITE_SECONDS = metrics.SERIAL_WRITE_SECONDS.labels(source='keyboard_headless')
+_INPUT_LATENCY = metrics.histogram(
+    'smartcar_headless_input_latency_seconds', 'Input event to serial write latency', ('input',))
+
+def auto_detect_port():
+    """Auto-detect connected USB serial COM ports."""
+    import serial.tools.list_ports
+    ports = list(serial.tools.list_ports.comports())
+
+    if not ports:
+        return None
+
+    usb_ports = [p for p in ports if 'Bluetooth' not in p.description]
+    if usb_ports:
+        return usb_ports[0].device
+    return ports[0].device if ports else None
+
+class HeadlessController:
+    """Input callbacks -> DriveState; DriveLink thread -> serial (or printed in test mode)."""
+    def __init__(self, input_name, test_mode=False, rate=1 / TICK_INTERVAL, ser=None):
+        """ser is an already-open link (e.g. a supervisor port) used instead of connect()."""
+        self.input_name = input_name
+        self.test_mode = test_mode
+        self.ser = ser
+        self.running = True
+        self.drive = DriveState()
+        self.link = DriveLink(self.drive, self.write_serial, tick=1.0 / rate, idle=self._idle)
+        self.latencies = []
+        self._input_time = None
+        self._input_at = None
+        self._latency = _INPUT_LATENCY.labels(input_name)
+        self.quit_event = threading.Event()
+
+    def connect(self, port=None):
+        if self.test_mode:
+            print("TEST MODE - commands are printed, no serial hardware")
+            return True
+        port = port or COM_PORT or auto_detect_port()
+        if not port:
+            print("Error: No serial port found. Connect the Arduino or pass --port.")
+            return False
+        try:
+            print(f"Connecting to {port}...")
+            self.ser = open_python_mode(port, BAUD_RATE)
+            print(f"Connected on {port}")
+            return True
+        except Exception as e:
+            print(f"Serial connection error: {e}")
+            return False
+
+    # Input callbacks (input thread)
+    def press(self, key, event_time=None):
+        if self.drive.press(key):
+            self._input(event_time)
+
+    def release(self, key, event_time=None):
+        self.drive.release(key)
+        self._input(event_time)
+
+    def axes(self, throttle, steer, event_time=None):
+        if abs(throttle) < STICK_DEADZONE and abs(steer) < STICK_DEADZONE:
+            self.drive.set_axes(None, None)
+        else:
+            self.drive.set_axes(throttle, steer)
+        self._input(event_time)
+
+    def stop(self, event_time=None):
+        self.drive.stop()
+        self._input(event_time)
+
+    def quit(self):
+        self.quit_event.set()
+
+    def _input(self, event_time):
+        if self._input_time is None:
+            self._input_at = time.monotonic()
+            self._input_time = event_time or time.time()
+        self.link.poke()
+
+    def _idle(self, now):
+        """Link thread: the pending input changed nothing, so the next (keepalive) write is not its latency."""
+        if self._input_time is not None and self._input_at <= now:
+            self._input_time = None
+
+    def write_serial(self, data):
+        """Link thread: the only writer to the serial port."""
+        if self._input_time is not None:
+            latency = time.time() - self._input_time
+            self._input_time = None
+            self.latencies.append(latency)
+            self._latency.observe(latency)
+        if self.test_mode:
+            print(f"[{time.strftime('%H:%M:%S')}] Command: {data.decode()}")
+            return
+        if not self.ser or not self.ser.is_open:
+            return
+        try:
+            start = time.perf_counter()
+            self.ser.write(data)
+            _WRITE_SECONDS.observe(time.perf_counter() - start)
+            _WRITES.inc()
+        except Exception as e:
+            _WRITE_ERRORS.inc()
+            print(f"Serial transmission error: {e}")
+
+    def run(self, source):
+        self.link.start()
+        reader = threading.Thread(target=source.run, args=(self,), name='headless-input', daemon=True)
+        reader.start()
+        try:
+            while not self.quit_event.wait(0.2) and reader.is_alive():
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.cleanup(source)
+
+    def cleanup(self, source):
+        self.running = False
+        source.close()
+        self.drive.stop()
+        self.link.stop()
+        if self.ser and self.ser.is_open:
+            self.ser.write(b'X')
+            time.sleep(0.2)
+            self.ser.close()
+        print(f"\nSerial writes: {self.link.writes} ({self.link.bytes_sent} bytes, "
+              f"{self.link.changes} command changes)")
+        if self.latencies:
+            ordered = sorted(self.latencies)
+            p50 = ordered[len(ordered) // 2]
+            p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+            print(f"Input -> serial latency ({self.input_name}): n={len(ordered)} "
+                  f"p50={p50 * 1000:.1f}ms p99={p99 * 1000:.1f}ms")
+
+class EvdevInput:
+    """Reads a gamepad or keyboard from /dev/input with kernel event timestamps."""
+    name = 'evdev'
+    KEYS = {}
+    if EVDEV_AVAILABLE:
+        KEYS = {ecodes.KEY_W: 'W', ecodes.KEY_A: 'A', ecodes.KEY_S: 'S', ecodes.KEY_D: 'D',
+                ecodes.KEY_UP: 'W', ecodes.KEY_LEFT: 'A', ecodes.KEY_DOWN: 'S', ecodes.KEY_RIGHT: 'D'}
+
+    def __init__(self, path=None):
+        if not EVDEV_AVAILABLE:
+            raise RuntimeError("evdev input needs the evdev package: pip install evdev")
+        self.device = evdev.InputDevice(path) if path else self.find_device()
+        if self.device is None:
+            raise RuntimeError("No gamepad or keyboard found under /dev/input (check permissions)")
+        caps = self.device.capabilities()
+        self.gamepad = ecodes.EV_ABS in caps
+        self._ranges = {code: (info.min, info.max) for code, info in caps.get(ecodes.EV_ABS, [])}
+        self._stick = {ecodes.ABS_X: 0.0, ecodes.ABS_Y: 0.0}
+        self._hat = {}
+        print(f"Input device: {self.device.name} ({self.device.path}, "
+              f"{'gamepad' if self.gamepad else 'keyboard'})")
+
+    @staticmethod
+    def find_device():
+        """First device with an analog stick, else the first with W/A/S/D keys."""
+        keyboard = None
+        for path in evdev.list_devices():
+            device = evdev.InputDevice(path)
+            caps = device.capabilities()
+            if ecodes.EV_ABS in caps and ecodes.BTN_SOUTH in caps.get(ecodes.EV_KEY, []):
+                return device
+            if keyboard is None and ecodes.KEY_W in caps.get(ecodes.EV_KEY, []):
+                keyboard = device
+        return keyboard
+
+    def _normalize(self, code, value):
+        low, high = self._ranges.get(code, (-32768, 32767))
+        center = (low + high) / 2.0
+        return max(-1.0, min(1.0, (value - center) / ((high - low) / 2.0 or 1.0)))
+
+    def run(self, controller):
+        for event in self.device.read_loop():
+            if not controller.running:
+                return
+            when = event.timestamp()
+            if event.type == ecodes.EV_KEY:
+                if event.value == 2:
+                    continue  # auto-repeat
+                if event.code in self.KEYS:
+                    if event.value:
+                        controller.press(self.KEYS[event.code], when)
+                    else:
+                        controller.release(self.KEYS[event.code], when)
+                elif event.value and event.code in (ecodes.KEY_X, ecodes.KEY_SPACE,
+                                                    ecodes.BTN_SOUTH, ecodes.BTN_EAST):
+                    controller.stop(when)
+                elif event.value and event.code in (ecodes.KEY_ESC, ecodes.BTN_START):
+                    controller.quit()
+                    return
+            elif event.type == ecodes.EV_ABS:
+                if event.code in self._stick:
+                    self._stick[event.code] = self._normalize(event.code, event.value)
+                    # Stick up is negative on evdev
+                    controller.axes(-self._stick[ecodes.ABS_Y], self._stick[ecodes.ABS_X], when)
+                elif event.code in (ecodes.ABS_HAT0X, ecodes.ABS_HAT0Y):
+                    self._hat_event(controller, event.code, event.value, when)
+
+    def _hat_event(self, controller, code, value, when):
+        # Hat left/up report -1
+        negative, positive = ('A', 'D') if code == ecodes.ABS_HAT0X else ('W', 'S')
+        previous = self._hat.get(code)
+        current = None if value == 0 else (negative if value < 0 else positive)
+        if previous and previous != current:
+            controller.release(previous, when)
+        if current and current != previous:
+            controller.press(current, when)
+        self._hat[code] = current
+
+    def close(self):
+        try:
+            self.device.close()
+        except Exception:
+            pass
+
+class PynputInput:
+    """Keyboard press/release events through pynput."""
+    name = 'pynput'
+    def __init__(self):
+        if not PYNPUT_AVAILABLE:
+            raise RuntimeError("pynput input needs the pynput package: pip install pynput")
+        self.listener = None
+
+    @staticmethod
+    def _char(key):
+        char = getattr(key, 'char', None)
+        if char:
+            return char.upper()
+        return {pynput_keyboard.Key.space: 'X', pynput_keyboard.Key.esc: 'ESC'}.get(key)
+
+    def run(self, controller):
+        def on_press(key):
+            char = self._char(key)
+            if char in ('W', 'A', 'S', 'D'):
+                controller.press(char)
+            elif char == 'X':
+                controller.stop()
+            elif char == 'ESC':
+                controller.quit()
+                return False
+
+        def on_release(key):
+            char = self._char(key)
+            if char in ('W', 'A', 'S', 'D'):
+                controller.release(char)
+
+        with pynput_keyboard.Listener(on_press=on_press, on_release=on_release, suppress=False) as listener:
+            self.listener = listener
+            listener.join()
+
+    def close(self):
+        if self.listener:
+            self.listener.stop()
+
+class TerminalInput:
+    """Raw-mode stdin; a key stays held while its auto-repeat keeps arriving."""
+    name = 'tty'
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdin
+        self.fd = self.stream.fileno()
+        if not os.isatty(self.fd):
+            raise RuntimeError("tty input needs an interactive terminal")
+        self._saved = None
+        self._deadlines = {}
+
+    def run(self, controller):
+        import termios
+        import tty
+        self._saved = termios.tcgetattr(self.fd)
+        tty.setcbreak(self.fd)
+        try:
+            while controller.running:
+                ready, _, _ = select.select([self.fd], [], [], TICK_INTERVAL)
+                now = time.monotonic()
+                if ready:
+                    char = os.read(self.fd, 1).decode(errors='ignore').upper()
+                    if char in ('W', 'A', 'S', 'D'):
+                        if char in self._deadlines:
+                            self._deadlines[char] = now + TTY_HOLD_REPEAT
+                        else:
+                            # Terminals repeat one key only: a new key replaces the held one
+                            for key in list(self._deadlines):
+                                controller.release(key)
+                            self._deadlines = {char: now + TTY_HOLD_INITIAL}
+                            controller.press(char)
+                    elif char in ('X', ' '):
+                        self._deadlines.clear()
+                        controller.stop()
+                    elif char in ('Q', '\x1b'):
+                        controller.quit()
+                        return
+                for key, deadline in list(self._deadlines.items()):
+                    if now >= deadline:
+                        del self._deadlines[key]
+                        controller.release(key)
+        finally:
+            self.close()
+
+    def close(self):
+        if self._saved is not None:
+            import termios
+            termios.tcsetattr(self.fd, termios.TCSADRAIN, self._saved)
+            self._saved = None
+
+def make_input(name, device=None, allow_tty=True):
+    """Input source by name; 'auto' prefers evdev, then pynput, then the terminal."""
+    if name == 'evdev':
+        return EvdevInput(device)
+    if name == 'pynput':
+        return PynputInput()
+    if name == 'tty':
+        if not allow_tty:
+            raise RuntimeError("the terminal is already in use")
+        return TerminalInput()
+    errors = []
+    for candidate in ('evdev', 'pynput', 'tty') if allow_tty else ('evdev', 'pynput'):
+        if candidate == 'pynput' and not os.environ.get('DISPLAY'):
+            continue
+        try:
+            return make_input(candidate, device)
+        except Exception as e:
+            errors.append(f"{candidate}: {e}")
+    raise RuntimeError("No input source available (" + "; ".join(errors) + ")")
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Smart Car headless keyboard / gamepad controller')
+    parser.add_argument('--input', choices=['auto', 'evdev', 'pynput', 'tty'], default='auto',
+                        help='Input source (default: evdev device, pynput, then the terminal)')
+    parser.add_argument('--device', help='evdev device path, e.g. /dev/input/event3')
+    parser.add_argument('--rate', type=float, default=1 / TICK_INTERVAL,
+                        help='Control loop rate in Hz for ramps and analog sampling')
+    parser.add_argument('--port', help=f"Serial port (default {COM_PORT or 'auto-detect'})")
+    parser.add_argument('--test', '-t', action='store_true', help='Print commands instead of sending them')
+    config.add_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        source = make_input(args.input, args.device)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    input_name = source.name
+
+    print("=" * 60)
+    print("SMART CAR HEADLESS CONTROLLER")
+    print("=" * 60)
+    print(f"Input: {input_name}  |  control loop {args.rate:.0f} Hz")
+    print("Hold W/A/S/D to drive (stick/d-pad on a gamepad), X/space/A stops, Esc/Start quits")
+    print("=" * 60)
+
+    controller = HeadlessController(input_name, test_mode=args.test, rate=args.rate)
+    if not controller.connect(args.port):
+        source.close()
+        sys.exit(1)
+    controller.run(source)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,19 @@
 # -*- coding: utf-8 -*-
 """
 keyboard_controller.py - Smart Car Graphical Desktop Keyboard Controller
+
+Press and hold: W/A/S/D drive only while held (W+A arcs left), speed ramps up
+the longer a key is held, and releasing every key ramps down to a stop. X or
+space stops at once. Key state becomes serial bytes in drive_control, which
+writes only when the command or speed level changes.
+
+The serial link runs on its own thread and never touches Tk: it publishes
+its counters as plain attributes (single writer, no lock), and the Tk thread
+picks them up every UI_REFRESH_MS. Held-key auto-repeat is coalesced.
+
+Run with --benchmark to compare Tk-thread CPU with the previous behaviour. It
+needs a display (a virtual one such as Xvfb will do); the reduction has not
+been measured yet, so no figure is claimed for it.
 """
 import serial
 import time
@@ -10,8 +23,36 @@ import tkinter as tk
 from tkinter import ttk
 import threading
 
-COM_PORT = 'COM8'
-BAUD_RATE = 9600
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+import config
+if __name__ == "__main__":
+    config.load_or_exit()
+import metrics
+from drive_control import DriveState, DriveLink, STOP_OUTPUT, LEGACY_SEND_INTERVAL, open_python_mode
+
+COM_PORT = config.get('serial.port', 'COM8')
+BAUD_RATE = config.get('serial.baud_rate', 9600)
+# Display and counter refresh period on the Tk thread
+UI_REFRESH_MS = 100
+# X11 auto-repeat sends release+press pairs for a held key; a release only
+# counts if no press follows within this window
+RELEASE_DEBOUNCE_MS = 40
+
+COMMAND_NAMES = {
+    'W': ('FORWARD', '#4CAF50'),
+    'S': ('REVERSE', '#f44336'),
+    'A': ('LEFT', '#2196F3'),
+    'D': ('RIGHT', '#FF9800'),
+    'Q': ('FORWARD LEFT', '#4CAF50'),
+    'E': ('FORWARD RIGHT', '#4CAF50'),
+    'Z': ('REVERSE LEFT', '#f44336'),
+    'C': ('REVERSE RIGHT', '#f44336'),
+    'X': ('STOP', '#9E9E9E')
+}
+
+_WRITES = metrics.SERIAL_WRITES.labels(source='keyboard')
+_WRITE_ERRORS = metrics.SERIAL_WRITE_ERRORS.labels(source='keyboard')
+_WRITE_SECONDS = metrics.SERIAL_WRITE_SECONDS.labels(source='keyboard')
 
 def auto_detect_port():
     """Auto-detect connected USB serial COM ports."""
@@ -27,23 +68,33 @@ def auto_detect_port():
     return ports[0].device if ports else None
 
 class KeyboardControlGUI:
-    def __init__(self, test_mode=False):
+    def __init__(self, test_mode=False, ser=None):
+        """ser is an already-open link (e.g. a supervisor port) used instead of connecting."""
         self.root = tk.Tk()
         self.root.title("Smart Car - Keyboard Controller" + (" [SIMULATION MODE]" if test_mode else ""))
         self.root.geometry("420x570")
         self.root.resizable(False, False)
         
         self.test_mode = test_mode
-        self.ser = None
-        self.current_command = 'X'
+        self.ser = ser
         self.is_running = False
+        self.drive = DriveState()
+        # Counters are written by the link thread only and read by refresh_ui()
+        self.link = DriveLink(self.drive, self.write_serial)
         self.command_count = 0
+        self.coalesced_count = 0
         self.test_log = []
+        self._shown = None
+        self._release_jobs = {}
+        self._refresh_job = None
         
         self.setup_ui()
         self.setup_keyboard()
+        self.refresh_ui()
         
-        if not test_mode:
+        if ser is not None:
+            self.root.after(0, self.use_link)
+        elif not test_mode:
             self.root.after(0, self.connect_arduino)
         
     def setup_ui(self):
@@ -63,6 +114,10 @@ class KeyboardControlGUI:
                                       font=("Arial", 10))
         self.counter_label.pack(pady=5)
         
+        self.drive_label = tk.Label(self.root, text="Throttle +0.00 | Steer +0.00",
+                                    font=("Courier", 10))
+        self.drive_label.pack(pady=2)
+        
         control_frame = tk.Frame(self.root)
         control_frame.pack(pady=15)
         
@@ -104,7 +159,7 @@ class KeyboardControlGUI:
         self.command_display.pack(pady=15)
         
         instructions = tk.Label(self.root, 
-                                text="Press keys W / A / S / D / X or click buttons\nPress ESC to exit",
+                                text="Hold W / A / S / D (combine for arcs), X or SPACE stops\nPress ESC to exit",
                                 font=("Arial", 10), fg="gray")
         instructions.pack(pady=5)
         
@@ -121,25 +176,21 @@ class KeyboardControlGUI:
                                   font=("Arial", 10, "bold"), fg="blue")
             test_label.pack(pady=10)
             
-            self.send_thread = threading.Thread(target=self.continuous_send, daemon=True)
-            self.send_thread.start()
+            self.start_sending()
         
     def setup_keyboard(self):
-        self.root.bind('<KeyPress-w>', lambda e: self.send_command('W'))
-        self.root.bind('<KeyPress-W>', lambda e: self.send_command('W'))
-        self.root.bind('<KeyPress-s>', lambda e: self.send_command('S'))
-        self.root.bind('<KeyPress-S>', lambda e: self.send_command('S'))
-        self.root.bind('<KeyPress-a>', lambda e: self.send_command('A'))
-        self.root.bind('<KeyPress-A>', lambda e: self.send_command('A'))
-        self.root.bind('<KeyPress-d>', lambda e: self.send_command('D'))
-        self.root.bind('<KeyPress-D>', lambda e: self.send_command('D'))
-        self.root.bind('<KeyPress-x>', lambda e: self.send_command('X'))
-        self.root.bind('<KeyPress-X>', lambda e: self.send_command('X'))
-        self.root.bind('<space>', lambda e: self.send_command('X'))
+        for key in 'WASD':
+            for keysym in (key.lower(), key):
+                self.root.bind(f'<KeyPress-{keysym}>', lambda e, k=key: self.key_pressed(k))
+                self.root.bind(f'<KeyRelease-{keysym}>', lambda e, k=key: self.key_released(k))
+            # Buttons drive while the mouse button is held down
+            self.buttons[key].bind('<ButtonPress-1>', lambda e, k=key: self.key_pressed(k))
+            self.buttons[key].bind('<ButtonRelease-1>', lambda e, k=key: self.key_released(k, debounce=False))
+        self.root.bind('<KeyPress-x>', lambda e: self.stop_now())
+        self.root.bind('<KeyPress-X>', lambda e: self.stop_now())
+        self.root.bind('<space>', lambda e: self.stop_now())
         self.root.bind('<Escape>', lambda e: self.quit_app())
-        
-        for key, btn in self.buttons.items():
-            btn.config(command=lambda k=key: self.send_command(k))
+        self.buttons['X'].config(command=self.stop_now)
     
     def connect_arduino(self):
         try:
@@ -151,72 +202,108 @@ class KeyboardControlGUI:
             self.status_label.config(text=f"Connecting to {port}...", fg="orange")
             self.root.update()
             
-            self.ser = serial.Serial(port, BAUD_RATE, timeout=1)
-            time.sleep(2)
-            
-            self.ser.write(b'3')
-            time.sleep(1)
-            
-            while self.ser.in_waiting > 0:
-                self.ser.readline()
-            
+            self.ser = open_python_mode(port, BAUD_RATE)
             self.is_running = True
             self.status_label.config(text=f"Connected on {port}", fg="green")
             self.connect_btn.config(state='disabled', bg='gray')
             
-            self.send_thread = threading.Thread(target=self.continuous_send, daemon=True)
-            self.send_thread.start()
+            self.start_sending()
             
         except Exception as e:
             self.status_label.config(text=f"Error: {str(e)[:30]}", fg="red")
     
-    def send_command(self, command):
+    def use_link(self):
+        self.is_running = True
+        self.status_label.config(text=f"Connected via {self.ser.port}", fg="green")
+        self.connect_btn.config(state='disabled', bg='gray')
+        self.start_sending()
+    
+    def start_sending(self):
+        self.link.start()
+    
+    def key_pressed(self, key):
         if not self.is_running:
             return
-        
-        self.current_command = command
-        self.update_display(command)
-        
+        pending = self._release_jobs.pop(key, None)
+        if pending:
+            self.root.after_cancel(pending)
+        # Auto-repeat of a held key changes nothing
+        if not self.drive.press(key):
+            self.coalesced_count += 1
+            return
+        self.link.poke()
+    
+    def key_released(self, key, debounce=True):
+        if not debounce:
+            self._finish_release(key)
+            return
+        pending = self._release_jobs.pop(key, None)
+        if pending:
+            self.root.after_cancel(pending)
+        self._release_jobs[key] = self.root.after(RELEASE_DEBOUNCE_MS, self._finish_release, key)
+    
+    def _finish_release(self, key):
+        self._release_jobs.pop(key, None)
+        self.drive.release(key)
+        self.link.poke()
+    
+    def stop_now(self):
+        for job in self._release_jobs.values():
+            self.root.after_cancel(job)
+        self._release_jobs.clear()
+        self.drive.stop()
+        self.link.poke()
+    
+    def write_serial(self, data):
+        """Link thread: the only writer to the serial port; never calls into Tk."""
         if self.test_mode:
-            timestamp = time.strftime("%H:%M:%S")
-            log_msg = f"[{timestamp}] Command: {command}"
+            log_msg = f"[{time.strftime('%H:%M:%S')}] Command: {data.decode()}"
             self.test_log.append(log_msg)
             print(log_msg)
-    
-    def continuous_send(self):
-        while self.is_running:
+        elif self.ser and self.ser.is_open:
             try:
-                if self.test_mode:
-                    self.command_count += 1
-                    self.counter_label.config(text=f"Commands Dispatched: {self.command_count}")
-                elif self.ser and self.ser.is_open:
-                    self.ser.write(self.current_command.encode())
-                    self.command_count += 1
-                    self.counter_label.config(text=f"Commands Dispatched: {self.command_count}")
-                time.sleep(0.05)
+                start = time.perf_counter()
+                self.ser.write(data)
+                _WRITE_SECONDS.observe(time.perf_counter() - start)
+                _WRITES.inc()
             except Exception:
-                break
+                _WRITE_ERRORS.inc()
+                return
+        else:
+            return
+        self.command_count += 1
     
-    def update_display(self, command):
-        command_names = {
-            'W': ('FORWARD', '#4CAF50'),
-            'S': ('REVERSE', '#f44336'),
-            'A': ('LEFT', '#2196F3'),
-            'D': ('RIGHT', '#FF9800'),
-            'X': ('STOP', '#9E9E9E')
-        }
-        
-        name, color = command_names.get(command, ('UNKNOWN', 'gray'))
-        self.command_display.config(text=f"Active Command: {name} ({command})", bg=color)
+    def refresh_ui(self):
+        """Tk thread: show the link's state, redrawing only what changed."""
+        shown = (self.command_count, self.link.output, frozenset(self.drive.held),
+                 round(self.drive.throttle, 2), round(self.drive.steer, 2))
+        if shown != self._shown:
+            count, output, held, throttle, steer = shown
+            if not self._shown or count != self._shown[0]:
+                self.counter_label.config(text=f"Commands Dispatched: {count}")
+            if not self._shown or output != self._shown[1] or held != self._shown[2]:
+                self.update_display(output, held)
+            self.drive_label.config(text=f"Throttle {throttle:+.2f} | Steer {steer:+.2f}")
+            self._shown = shown
+        self._refresh_job = self.root.after(UI_REFRESH_MS, self.refresh_ui)
+    
+    def update_display(self, output, held=()):
+        command, level = output
+        name, color = COMMAND_NAMES.get(command, ('UNKNOWN', 'gray'))
+        speed = f" x{level}" if level else ""
+        self.command_display.config(text=f"Active Command: {name} ({command}){speed}", bg=color)
         
         for key, btn in self.buttons.items():
-            if key == command:
+            if key in held or (key == 'X' and output == STOP_OUTPUT):
                 btn.config(relief='sunken')
             else:
                 btn.config(relief='raised')
     
     def quit_app(self):
         self.is_running = False
+        self.link.stop()
+        if self._refresh_job:
+            self.root.after_cancel(self._refresh_job)
         if self.ser and self.ser.is_open:
             self.ser.write(b'X')
             time.sleep(0.2)
@@ -227,7 +314,86 @@ class KeyboardControlGUI:
         self.root.protocol("WM_DELETE_WINDOW", self.quit_app)
         self.root.mainloop()
 
+class _LegacyKeyboardGUI(KeyboardControlGUI):
+    """Previous behaviour, kept for benchmark comparison: a 20 Hz sender thread
+    updates the counter label on every write and every key repeat redraws."""
+    def start_sending(self):
+        threading.Thread(target=self.continuous_send, daemon=True).start()
+    
+    def key_pressed(self, key):
+        if not self.is_running:
+            return
+        self.update_display((key, None), {key})
+    
+    def key_released(self, key, debounce=True):
+        pass
+    
+    def stop_now(self):
+        self.key_pressed('X')
+    
+    def continuous_send(self):
+        while self.is_running:
+            try:
+                self.command_count += 1
+                self.counter_label.config(text=f"Commands Dispatched: {self.command_count}")
+                time.sleep(LEGACY_SEND_INTERVAL)
+            except Exception:
+                break
+    
+    def refresh_ui(self):
+        pass
+
+def ui_benchmark(seconds=5.0, repeat_hz=30):
+    """Held-key auto-repeat in simulation mode: CPU spent on Tk work, legacy vs current."""
+    import contextlib
+    import io
+    keys = 'WWWAAADDDSSX'
+    print("=" * 60)
+    print(f"KEYBOARD UI BENCHMARK ({seconds:.0f}s per run, {repeat_hz} Hz key repeat)")
+    print("=" * 60)
+    results = {}
+    for name, cls in (('legacy', _LegacyKeyboardGUI), ('current', KeyboardControlGUI)):
+        try:
+            app = cls(test_mode=True)
+        except tk.TclError as e:
+            print(f"Error: the benchmark needs a display ({e}).")
+            print(f"On a headless machine run: xvfb-run python3 {sys.argv[0]} --benchmark")
+            return None
+        started = time.perf_counter()
+        held = []
+        
+        def repeat():
+            key = keys[int(time.perf_counter() - started) % len(keys)]
+            if held and held[-1] != key:
+                app.key_released(held.pop(), debounce=False)
+            if key == 'X':
+                app.stop_now()
+            else:
+                app.key_pressed(key)
+                held[:] = [key]
+            app.root.after(int(1000 / repeat_hz), repeat)
+        
+        app.root.after(0, repeat)
+        app.root.after(int(seconds * 1000), app.root.quit)
+        thread_start, process_start = time.thread_time(), time.process_time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            app.root.mainloop()
+        tk_cpu = time.thread_time() - thread_start
+        total_cpu = time.process_time() - process_start
+        app.is_running = False
+        app.link.stop()
+        app.root.destroy()
+        results[name] = tk_cpu
+        print(f"  {name:<8} Tk thread CPU {tk_cpu * 1000:7.1f} ms ({tk_cpu / seconds:5.1%}), "
+              f"process CPU {total_cpu * 1000:7.1f} ms, {app.coalesced_count} repeats coalesced")
+    if results['current']:
+        print(f"  Tk thread CPU reduced {results['legacy'] / results['current']:.1f}x")
+    return results
+
 if __name__ == "__main__":
+    if '--benchmark' in sys.argv:
+        sys.exit(0 if ui_benchmark() else 1)
+    
     test_mode = '--test' in sys.argv or '-t' in sys.argv
     
     if test_mode:
@@ -235,7 +401,7 @@ if __name__ == "__main__":
         print("SMART CAR KEYBOARD CONTROL - SIMULATION MODE")
         print("=" * 50)
         print("Running in simulation mode without active serial hardware.")
-        print("Press keys W/A/S/D/X or click buttons to test UI.")
+        print("Hold keys W/A/S/D (combine for arcs), X/SPACE to stop, or hold buttons.")
         print("Press ESC to exit.")
         print("=" * 50)
     
@@ -1,21 +1,80 @@
 # -*- coding: utf-8 -*-
 """
 run.py - Smart Car Control System Main Launcher
+Modes that drive the car run as sources of one supervisor process (see
+supervisor.py): the serial link is opened once and further sources can be
+attached from the supervisor prompt without restarting. The other tools run
+in this interpreter as well.
+
+Without a terminal (systemd, scripts) name the mode instead of using the menu:
+
+  python run.py web --yes                 # or: python run.py 4 -y
+  python run.py bridge --test --set bridge.poll_interval=0.2
+
+Settings come from smartcar.ini / SMARTCAR_* / --set (see common/config.py);
+[launcher] mode and test give the defaults for the mode and --test.
 """
 import os
+import runpy
 import sys
 
 # Store root project directory
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(PROJECT_ROOT, 'common'))
+import config
+if __name__ == "__main__":
+    config.load_or_exit()
 
-def run_script(script_path, args=""):
-    """Helper to run a Python script relative to project root."""
+MODES = {'camera-test': '1', 'gesture': '2', 'keyboard': '3', 'web': '4',
+         'cloud-server': '5', 'bridge': '6', 'voice': '7', 'supervisor': '8'}
+
+def run_script(script_path, args=()):
+    """Run a Python script relative to project root in this interpreter."""
     os.chdir(PROJECT_ROOT)
     full_path = os.path.join(PROJECT_ROOT, script_path)
-    cmd = f'"{sys.executable}" "{full_path}" {args}'.strip()
-    return os.system(cmd)
+    saved_argv, saved_path = sys.argv, list(sys.path)
+    sys.argv = [full_path, *args]
+    sys.path.insert(0, os.path.dirname(full_path))
+    try:
+        runpy.run_path(full_path, run_name='__main__')
+    except SystemExit:
+        pass
+    finally:
+        sys.argv, sys.path[:] = saved_argv, saved_path
 
-def main():
+def run_supervised(source=None, test_mode=False, **options):
+    """Open the serial link once, attach a source, then hand over to the supervisor prompt.
+
+    Without a terminal there is no prompt: the source runs until it ends or
+    the process is stopped, and a serial failure exits so the service restarts.
+    """
+    from supervisor import Supervisor
+    interactive = sys.stdin.isatty()
+    supervisor = Supervisor(test_mode=test_mode, console=interactive)
+    if not supervisor.start():
+        if not interactive:
+            sys.exit(1)
+        print("Defaulting to SIMULATION MODE...")
+        supervisor = Supervisor(test_mode=True)
+        supervisor.start()
+    if source:
+        supervisor.attach(source, **options)
+    if interactive:
+        if source:
+            print("Attach more sources (e.g. 'attach voice') or detach this one at the prompt.")
+        supervisor.console()
+    else:
+        supervisor.serve()
+
+def ask(prompt, answer=None):
+    """input() unless the answer was given on the command line (--yes, --test)."""
+    if answer is not None:
+        print(f"{prompt}{answer}")
+        return answer
+    return input(prompt).strip().lower()
+
+def main(choice=None, assume_yes=False, test_mode=False):
+    yes = 'y' if assume_yes else None
     os.chdir(PROJECT_ROOT)
     print("=" * 70)
     print("  SMART CAR - CONTROL SYSTEM LAUNCHER")
@@ -33,10 +92,14 @@ def main():
     print("  [6] Bridge Client      - Connect remote AWS Cloud server with Arduino")
     print("  [7] Voice Control      - AI Voice control with LangChain + OpenAI")
     print()
+    print("  [8] Supervisor         - Empty supervisor prompt (attach sources at runtime)")
     print("  [0] Exit")
     print()
     
-    choice = input("Enter choice (0-7): ").strip()
+    if choice is None:
+        choice = input("Enter choice (0-8): ").strip()
+    else:
+        print(f"Enter choice (0-8): {choice}")
     
     if choice == '1':
         print("\nMODE 1: Test Camera")
@@ -45,34 +108,34 @@ def main():
         
     elif choice == '2':
         print("\nMODE 2: OpenCV Mode")
-        print("Arduino: Upload firmware/smart_car.ino, select Mode [1]")
-        print("Press 'q' in camera window to exit\n")
+        print("Arduino: Upload firmware/smart_car.ino (Mode [3] is selected automatically)")
+        print("Type 'detach gesture' at the prompt to exit\n")
         
-        confirm = input("Is Arduino connected and ready? (y/n): ").strip().lower()
+        confirm = ask("Is Arduino connected and ready? (y/n): ", yes)
         if confirm == 'y':
-            run_script("serial_bridge/gesture_serial_bridge.py")
+            run_supervised('gesture', test_mode=test_mode)
         else:
             print("Cancelled!")
     
     elif choice == '3':
         print("\nMODE 3: Keyboard Mode")
-        print("Arduino: Upload firmware/smart_car.ino, select Mode [3]")
-        print("Press ESC to exit GUI\n")
+        print("Arduino: Upload firmware/smart_car.ino (Mode [3] is selected automatically)")
+        print("Press ESC to close the GUI\n")
         
-        confirm = input("Is Arduino connected and ready? (y/n): ").strip().lower()
+        confirm = ask("Is Arduino connected and ready? (y/n): ", yes)
         if confirm == 'y':
-            run_script("keyboard/keyboard_controller.py")
+            run_supervised('keyboard', test_mode=test_mode)
         else:
             print("Cancelled!")
     
     elif choice == '4':
         print("\nMODE 4: Web Control (LAN)")
-        print("Arduino: Upload firmware/smart_car.ino, select Mode [3]")
-        print("Press Ctrl+C to exit\n")
+        print("Arduino: Upload firmware/smart_car.ino (Mode [3] is selected automatically)")
+        print("Type 'quit' at the prompt to exit\n")
         
-        confirm = input("Is Arduino connected and ready? (y/n): ").strip().lower()
+        confirm = ask("Is Arduino connected and ready? (y/n): ", yes)
         if confirm == 'y':
-            run_script("web/local_server.py")
+            run_supervised('web', test_mode=test_mode)
         else:
             print("Cancelled!")
     
@@ -80,11 +143,12 @@ def main():
         print("\nMODE 5: AWS Server Local (Development)")
         print("Run local server instance for development and testing\n")
         
-        confirm = input("Run local AWS server? (y/n): ").strip().lower()
+        confirm = ask("Run local AWS server? (y/n): ", yes)
         if confirm == 'y':
-            test_mode = input("Run in simulation mode without Arduino? (y/n): ").strip().lower()
-            if test_mode == 'y':
-                run_script("web/cloud_server.py", "--test")
+            simulate = ask("Run in simulation mode without Arduino? (y/n): ",
+                           ('y' if test_mode else 'n') if assume_yes else None)
+            if simulate == 'y':
+                run_script("web/cloud_server.py", ["--test"])
             else:
                 run_script("web/cloud_server.py")
         else:
@@ -96,15 +160,15 @@ def main():
         print("Select operational mode:")
         print("  [1] Simulation Mode (Log viewer only - no Arduino required)")
         print("  [2] Hardware Mode   (Active Arduino serial connection)")
-        mode = input("Enter choice (1-2): ").strip()
+        mode = ask("Enter choice (1-2): ", ('1' if test_mode else '2') if assume_yes else None)
         
         if mode == '1':
             print("\nSimulation Mode started. Monitoring command events from cloud server...")
-            run_script("web/cloud_bridge_client.py", "--test")
+            run_supervised('cloud', test_mode=True)
         elif mode == '2':
-            confirm = input("\nIs Arduino connected and ready? (y/n): ").strip().lower()
+            confirm = ask("\nIs Arduino connected and ready? (y/n): ", yes)
             if confirm == 'y':
-                run_script("web/cloud_bridge_client.py")
+                run_supervised('cloud')
             else:
                 print("Cancelled!")
         else:
@@ -113,19 +177,44 @@ def main():
     elif choice == '7':
         print("\nMODE 7: Voice Control (LangChain + OpenAI)")
         print("Recognizes spoken commands and processes natural language intent\n")
-        run_script("voice/voice_controller.py")
+        run_supervised('voice', test_mode=test_mode)
+        
+    elif choice == '8':
+        print("\nMODE 8: Supervisor")
+        print("One serial session; attach and detach control sources at runtime\n")
+        run_supervised(test_mode=test_mode)
         
     elif choice == '0':
         print("\nExiting Smart Car Launcher. Goodbye!")
         sys.exit(0)
         
     else:
-        print("\nInvalid selection! Please enter a number between 0 and 7.")
-        return main()
+        print("\nInvalid selection! Please enter a number between 0 and 8.")
+        if not sys.stdin.isatty():
+            sys.exit(2)
+        return main(assume_yes=assume_yes, test_mode=test_mode)
+
+def parse_args():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Smart Car control system launcher')
+    parser.add_argument('mode', nargs='?', default=config.get('launcher.mode'),
+                        help=f"Start this mode without the menu: 0-8 or {', '.join(MODES)}")
+    parser.add_argument('--yes', '-y', action='store_true', help='Answer yes to every confirmation')
+    parser.add_argument('--test', '-t', action='store_true', default=config.get('launcher.test', False),
+                        help='Simulate the serial link')
+    config.add_arguments(parser)
+    args = parser.parse_args()
+    if args.mode is not None:
+        args.mode = MODES.get(args.mode.lower(), args.mode)
+    elif not sys.stdin.isatty():
+        parser.error("no terminal for the menu: give a mode (or set [launcher] mode)")
+    return args
 
 if __name__ == "__main__":
+    args = parse_args()
     try:
-        main()
+        main(args.mode, assume_yes=args.yes, test_mode=args.test)
     except KeyboardInterrupt:
         print("\n\nProgram terminated by user.")
     except Exception as e:
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+command_arbiter.py - Priority and Lease Arbitration for Serial Commands
+Control sources write through one CommandArbiter instead of their own serial
+handle, so the car follows a defined source rather than whichever thread
+wrote last:
+
+  lease     a move command gives its source control for `lease` seconds and
+            every new command renews it; a source that goes silent expires
+  priority  the highest-priority source holding a lease wins, ties go to the
+            most recent command; writes from other sources are dropped
+  stop      X gives up the source's lease. From a source registered with
+            preempt_stop (voice, keyboard) it instead takes control above
+            every priority for stop_hold seconds, so a streaming remote
+            source cannot drive off again right after "stop"
+  watchdog  a thread re-evaluates the leases every tick and writes X as soon
+            as none is left, ahead of the firmware's own 500 ms timeout
+
+Decisions and the resulting write happen under one lock, so bytes reach the
+link in decision order. Run this module for a walk through the rules;
+tests/test_command_arbiter.py checks them and the decision latency.
+"""
+import itertools
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+import config
+if __name__ == "__main__":
+    config.load_or_exit()
+import metrics
+
+WATCHDOG_TICK = config.get('arbiter.watchdog_tick', 0.05)
+DEFAULT_LEASE = config.get('arbiter.lease', 0.5)
+STOP_HOLD = config.get('arbiter.stop_hold', 1.0)
+STOP = b'X'
+# Rank of a preempting stop: above every registered priority
+_STOP_RANK = float('inf')
+
+DECISIONS = metrics.counter(
+    'smartcar_arbiter_decisions_total', 'Commands forwarded or dropped by the command arbiter',
+    ['arbiter', 'source', 'result'])
+DECISION_SECONDS = metrics.histogram(
+    'smartcar_arbiter_decision_seconds', 'Command arbiter decision time including the write', ['arbiter'])
+WATCHDOG_STOPS = metrics.counter(
+    'smartcar_arbiter_watchdog_stops_total', 'Stops written after every lease expired', ['arbiter'])
+
+class _Source:
+    __slots__ = ('priority', 'lease', 'preempt_stop', 'rank', 'data', 'expires', 'granted',
+                 'forwarded', 'dropped', '_forwarded', '_dropped')
+
+    def __init__(self, arbiter, name, priority, lease, preempt_stop):
+        self.priority = priority
+        self.lease = lease
+        self.preempt_stop = preempt_stop
+        self.rank = priority
+        self.data = None
+        self.expires = None
+        self.granted = 0
+        self.forwarded = 0
+        self.dropped = 0
+        self._forwarded = DECISIONS.labels(arbiter, name, 'forwarded')
+        self._dropped = DECISIONS.labels(arbiter, name, 'dropped')
+
+class CommandArbiter:
+    """Single writer for a serial link shared by prioritized, leased sources.
+
+    write(data, source) performs the actual write; it is called with the
+    arbiter lock held, from the submitting thread or the watchdog thread.
+    """
+    def __init__(self, write, name='serial', tick=WATCHDOG_TICK, stop_hold=STOP_HOLD):
+        self.write = write
+        self.name = name
+        self.tick = tick
+        self.stop_hold = stop_hold
+        self.sources = {}
+        self.owner = None
+        self.output = STOP
+        self.watchdog_stops = 0
+        self.running = False
+        self._order = itertools.count(1)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._decision_seconds = DECISION_SECONDS.labels(name)
+        self._watchdog_stops = WATCHDOG_STOPS.labels(name)
+
+    def register(self, source, priority=0, lease=DEFAULT_LEASE, preempt_stop=False):
+        with self._lock:
+            self.sources[source] = _Source(self.name, source, priority, lease, preempt_stop)
+        return self
+
+    def unregister(self, source):
+        with self._lock:
+            if self.sources.pop(source, None) is not None:
+                self._decide(time.monotonic(), None)
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name=f'arbiter-{self.name}', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self._wake.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+
+    def submit(self, source, data, now=None):
+        """Offer a command (bytes or str; the last byte is the command). Returns True if written."""
+        start = time.perf_counter()
+        if isinstance(data, str):
+            data = data.encode()
+        with self._lock:
+            entry = self.sources.get(source)
+            if entry is None or not data:
+                return False
+            now = time.monotonic() if now is None else now
+            entry.data = data
+            entry.granted = next(self._order)
+            if data[-1:] != STOP:
+                entry.rank = entry.priority
+                entry.expires = now + entry.lease
+            elif entry.preempt_stop:
+                entry.rank = _STOP_RANK
+                entry.expires = now + self.stop_hold
+            else:
+                entry.expires = None
+            forwarded = self._decide(now, source)
+        self._decision_seconds.observe(time.perf_counter() - start)
+        return forwarded
+
+    def evaluate(self, now=None):
+        """Re-check lease expiry (the watchdog does this every tick)."""
+        with self._lock:
+            self._decide(time.monotonic() if now is None else now, None)
+
+    def _winner(self, now):
+        best, best_key = None, None
+        for name, entry in self.sources.items():
+            if entry.expires is not None and entry.expires > now:
+                key = (entry.rank, entry.granted)
+                if best_key is None or key > best_key:
+                    best, best_key = name, key
+        return best
+
+    def _decide(self, now, submitter):
+        owner = self._winner(now)
+        changed = owner != self.owner
+        self.owner = owner
+        entry = self.sources.get(submitter)
+        if owner is None:
+            if entry is not None:
+                # Nobody holds the car, so the submitter's own stop goes through
+                self._emit(entry.data, submitter)
+                entry.forwarded += 1
+                entry._forwarded.inc()
+                return True
+            if self.output != STOP:
+                self._emit(STOP, 'watchdog')
+                self.watchdog_stops += 1
+                self._watchdog_stops.inc()
+            return False
+        if owner == submitter:
+            self._emit(entry.data, submitter)
+            entry.forwarded += 1
+            entry._forwarded.inc()
+            return True
+        if changed:
+            # Control moved (release, expiry or preemption): apply the new owner's command now
+            self._emit(self.sources[owner].data, owner)
+        if entry is not None:
+            entry.dropped += 1
+            entry._dropped.inc()
+        return False
+
+    def _emit(self, data, source):
+        self.write(data, source)
+        self.output = data[-1:]
+
+    def _run(self):
+        while self.running:
+            self._wake.wait(self.tick)
+            if self.running:
+                self.evaluate()
+
+    def snapshot(self):
+        """Per-source state for status displays, highest priority first."""
+        now = time.monotonic()
+        with self._lock:
+            owner = self._winner(now)
+            rows = []
+            for name, entry in self.sources.items():
+                rows.append({
+                    'source': name,
+                    'priority': entry.priority,
+                    'owner': name == owner,
+                    'command': entry.data[-1:].decode() if entry.data else None,
+                    'lease_left': max(0.0, entry.expires - now) if entry.expires else 0.0,
+                    'forwarded': entry.forwarded,
+                    'dropped': entry.dropped
+                })
+        return sorted(rows, key=lambda row: -row['priority'])
+
+# (virtual time, source, command, what the rules should do)
+SCENARIO = [(0.00, 'cloud', 'W', "cloud streams forward"),
+            (0.10, 'web', 'A', "web outranks cloud"),
+            (0.20, 'cloud', 'W', "cloud is dropped while web holds a lease"),
+            (0.30, 'voice', 'X', "voice stop preempts everything"),
+            (0.40, 'web', 'D', "web is held off during the stop hold"),
+            (1.35, 'cloud', 'W', "stop hold over: web's lease has expired, cloud wins again"),
+            (1.40, 'web', 'X', "web stop only releases web")]
+
+def scenario_arbiter(written):
+    """Arbiter with the voice/web/cloud sources of the supervisor, appending (command, source) to written."""
+    arbiter = CommandArbiter(lambda data, source: written.append((data.decode(), source)), name='scenario')
+    arbiter.register('voice', 40, preempt_stop=True)
+    arbiter.register('web', 20)
+    arbiter.register('cloud', 10)
+    return arbiter
+
+def scenario():
+    """Deterministic walk through the rules with a virtual clock."""
+    written = []
+    arbiter = scenario_arbiter(written)
+    print("SCENARIO (virtual clock)")
+    for at, source, command, note in SCENARIO:
+        before = len(written)
+        arbiter.submit(source, command, now=at)
+        out = ', '.join(f"{d} from {s}" for d, s in written[before:]) or 'nothing written'
+        print(f"  t={at:4.2f}s {source:>5} {command}  -> {out:<22} {note}")
+    before = len(written)
+    arbiter.evaluate(now=1.35 + DEFAULT_LEASE + 0.01)
+    print(f"  t={1.35 + DEFAULT_LEASE + 0.01:4.2f}s watchdog  -> "
+          f"{', '.join(f'{d} from {s}' for d, s in written[before:])}   cloud went silent, lease expired")
+
+if __name__ == "__main__":
+    scenario()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+fake_serial.py - Pseudo-Terminal Serial Link for Hardware-Free Testing
+Opens a pty pair: controllers open the slave path (e.g. /dev/pts/7) exactly
+like a real COM port through pyserial, while a background thread plays the
+Arduino on the master side, timestamping every byte it receives. Optional
+baud-rate pacing and reply hooks let tools emulate the Zigbee link and the
+firmware's responses. POSIX only (Linux, macOS, Raspberry Pi OS).
+"""
+import os
+import select
+import threading
+import time
+import tty
+
+class FakeSerialLink:
+    """Virtual serial port whose far end records (and optionally answers) traffic.
+
+    responder(data, link) is called with each chunk received from the
+    controller and may call link.reply(bytes) to send data back.
+    """
+    def __init__(self, baud_rate=None, responder=None, keep_bytes=True):
+        if os.name != 'posix':
+            raise OSError("FakeSerialLink needs a POSIX pseudo-terminal")
+        self.baud_rate = baud_rate
+        self.responder = responder
+        self.keep_bytes = keep_bytes
+        self.received = []
+        self.bytes_received = 0
+        self.running = False
+        self._master, self._slave = os.openpty()
+        # Raw mode so command bytes are not line-buffered or echoed by the tty layer
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._lock = threading.Lock()
+        self._arrived = threading.Condition(self._lock)
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def start(self):
+        if self.running:
+            return self
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name='fake-serial', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while self.running:
+            ready, _, _ = select.select([self._master], [], [], 0.1)
+            if not ready:
+                continue
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                break
+            if not data:
+                continue
+            now = time.monotonic()
+            if self.baud_rate:
+                # 10 bits per byte on the wire (start + 8 data + stop); bytes that
+                # reached the pty together arrive one character time apart
+                byte_time = 10.0 / self.baud_rate
+                time.sleep(len(data) * byte_time)
+                chunks = [(now + (i + 1) * byte_time, data[i:i + 1]) for i in range(len(data))]
+            else:
+                chunks = [(now, data)]
+            with self._arrived:
+                if self.keep_bytes:
+                    self.received.extend(chunks)
+                self.bytes_received += len(data)
+                self._arrived.notify_all()
+            if self.responder:
+                self.responder(data, self)
+
+    def reply(self, data):
+        """Send bytes from the fake Arduino back to the controller."""
+        os.write(self._master, data)
+
+    def wait_for_bytes(self, count, timeout=2.0):
+        """Block until at least count bytes have arrived in total."""
+        with self._arrived:
+            return self._arrived.wait_for(lambda: self.bytes_received >= count, timeout)
+
+    def commands(self):
+        """Received bytes as (monotonic time, single-character command) pairs."""
+        with self._lock:
+            return [(t, chr(b)) for t, chunk in self.received for b in chunk]
+
+    def clear(self):
+        with self._lock:
+            self.received = []
+            self.bytes_received = 0
+
+    def close(self):
+        self.running = False
+        if self._thread:
+            self._thread.join(timeout=1.0)
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+if __name__ == "__main__":
+    import serial
+    with FakeSerialLink() as link:
+        print(f"Fake serial port: {link.port}")
+        with serial.Serial(link.port, 9600, timeout=1) as port:
+            start = time.monotonic()
+            port.write(b'WAX')
+            link.wait_for_bytes(3)
+            for t, command in link.commands():
+                print(f"  received {command!r} after {(t - start) * 1000:.2f} ms")
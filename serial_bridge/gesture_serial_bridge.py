@@ -8,13 +8,40 @@ import sys
 import os
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'vision'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
 import hand_tracker as htm
 import serial_interface as UART
+import config
+if __name__ == "__main__":
+    config.load_or_exit()
+import metrics
+from command_arbiter import CommandArbiter
+from video_source import open_camera
+from frame_bus import FrameBusSource, FrameBusWriter, FrameBusError, CAMERA_BUS, ANNOTATED_BUS, live_writer
+from session_recorder import SessionRecorder, FrameRecorderSink, cli_record_path
+
+COM_PORT = config.get('serial.port', 'COM8')
+UART_BAUD = config.get('serial.baud_rate', 9600)
+CAMERA_WIDTH = config.get('gesture.camera_width', 1920)
+CAMERA_HEIGHT = config.get('gesture.camera_height', 1280)
+CAMERA_FPS = config.get('gesture.camera_fps', 30)
+# One driver buffer so each gesture decision uses the newest frame; MJPG keeps
+# full frame rate at this resolution over USB
+CAMERA_BUFFER_SIZE = 1
+CAMERA_FOURCC = config.get('gesture.camera_fourcc', 'MJPG')
+
+# Take frames from the camera server's frame bus instead of opening the webcam
+# (--frame-bus), and publish the annotated view back for /annotated_feed (--annotate)
+USE_FRAME_BUS = False
+PUBLISH_ANNOTATED = False
+
+# Record camera frames, gestures and sent commands for session_replay.py (--record [DIR])
+RECORD_PATH = None
 
-COM_PORT = 'COM8'
-UART_BAUD = 9600
-CAMERA_WIDTH = 1920
-CAMERA_HEIGHT = 1280
+_STAGE_CAPTURE = metrics.GESTURE_STAGE_SECONDS.labels(stage='capture')
+_STAGE_DETECT = metrics.GESTURE_STAGE_SECONDS.labels(stage='detect')
+_STAGE_CLASSIFY = metrics.GESTURE_STAGE_SECONDS.labels(stage='classify')
+_STAGE_RENDER = metrics.GESTURE_STAGE_SECONDS.labels(stage='render')
 
 gesture_to_command = {
     'X': 'X',
@@ -56,13 +83,36 @@ def auto_detect_port():
         print(f"\nSelected fallback port: {selected}")
         return selected
 
-def main():
+def classify_frame(detector, frame):
+    """Mirror, detect and classify one camera frame.
+
+    Returns (annotated frame, gesture, description, (detect_s, classify_s)).
+    Shared with session_replay.py so replays run the exact live pipeline.
+    """
+    t0 = time.perf_counter()
+    frame = cv2.flip(frame, 1)
+    frame = detector.findHands(frame)
+    t1 = time.perf_counter()
+    gesture, description = detector.detectGesture(frame)
+    t2 = time.perf_counter()
+    _STAGE_DETECT.observe(t1 - t0)
+    _STAGE_CLASSIFY.observe(t2 - t1)
+    return frame, gesture, description, (t1 - t0, t2 - t1)
+
+def main(link=None, stop_event=None, arbiter=None, source='gesture'):
+    """link: shared serial link from the supervisor (already in Python controller
+    mode, which accepts the same commands); stop_event ends the loop from outside.
+    arbiter: shared CommandArbiter with `source` registered; without one a
+    private arbiter writes to the UART."""
     print("=" * 60)
     print("SMART CAR GESTURE CONTROL SERIAL BRIDGE")
     print("=" * 60)
     print()
     
-    if not COM_PORT:
+    if link is not None:
+        port = link.port
+        print(f"Using shared serial link: {port}")
+    elif not COM_PORT:
         print("Auto-detecting serial COM port...")
         port = auto_detect_port()
         if not port:
@@ -75,52 +125,90 @@ def main():
     print(f"Baud rate: {UART_BAUD} baud")
     print()
     
-    cap = cv2.VideoCapture(0)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, CAMERA_WIDTH)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, CAMERA_HEIGHT)
-    
-    if not cap.isOpened():
-        print("Error: Unable to open camera device.")
+    owner = live_writer(ANNOTATED_BUS) if PUBLISH_ANNOTATED else None
+    if owner:
+        print(f"Error: frame bus '{ANNOTATED_BUS}' is already published by process {owner}")
         return
     
-    print("Camera initialized successfully.")
+    if USE_FRAME_BUS:
+        try:
+            cap = FrameBusSource(CAMERA_BUS, consumer='gesture_bridge')
+        except FrameBusError as e:
+            print(f"Error: {e}")
+            print("Start the camera server with --frame-bus first.")
+            return
+        print(f"Reading frames from frame bus '{CAMERA_BUS}'.")
+    else:
+        cap = open_camera(0, CAMERA_WIDTH, CAMERA_HEIGHT, CAMERA_FPS,
+                          buffer_size=CAMERA_BUFFER_SIZE, fourcc=CAMERA_FOURCC)
+        
+        if cap is None:
+            print("Error: Unable to open camera device.")
+            return
+        
+        print("Camera initialized successfully.")
+    annotated_bus = None
     detector = htm.handDetector(detectionCon=0.7, maxHands=2)
     
-    with UART.UARTController(port=port, baud_rate=UART_BAUD) as uart:
+    with UART.UARTController(port=port, baud_rate=UART_BAUD, link=link) as uart:
         if not uart.is_connected:
             print("UART serial connection failed. Exiting...")
             cap.release()
             return
         
-        print("Selecting OpenCV control mode on Arduino firmware...")
-        uart.send_command('1')
-        time.sleep(1)
+        if link is None:
+            print("Selecting OpenCV control mode on Arduino firmware...")
+            uart.send_command('1')
+            time.sleep(1)
+        
+        # Every processed frame renews the lease; if capture or detection stalls the watchdog stops the car
+        owns_arbiter = arbiter is None
+        if owns_arbiter:
+            arbiter = CommandArbiter(lambda data, _: uart.send_command(data.decode()),
+                                     name='gesture').register(source)
+            arbiter.start()
+        
+        recorder = None
+        if RECORD_PATH:
+            recorder = SessionRecorder(RECORD_PATH, source='gesture_bridge')
+            frame_sink = FrameRecorderSink(recorder)
+            print(f"Recording session to {RECORD_PATH}")
         
         pTime = 0
         last_gesture = 'X'
-        frame_count = 0
+        last_sent = 'X'
+        sent_count = 0
         
         print("\n===== Starting Real-Time Gesture Steering =====")
         print("Press 'q' to exit.\n")
         
         try:
-            while True:
+            while stop_event is None or not stop_event.is_set():
+                t0 = time.perf_counter()
                 ret, frame = cap.read()
                 if not ret:
                     print("Error: Unable to capture video frame.")
                     break
+                captured_at = cap.last_timestamp if USE_FRAME_BUS else time.time()
+                _STAGE_CAPTURE.observe(time.perf_counter() - t0)
+                if recorder:
+                    frame_sink.submit(frame, captured_at)
                 
-                frame = cv2.flip(frame, 1)
-                frame = detector.findHands(frame)
-                gesture, description = detector.detectGesture(frame)
+                frame, gesture, description, _ = classify_frame(detector, frame)
+                t3 = time.perf_counter()
+                if recorder:
+                    recorder.record_gesture(gesture, description, captured_at)
                 
-                if frame_count % 5 == 0 or gesture != last_gesture:
-                    command = gesture_to_command.get(gesture, 'X')
-                    if uart.send_command(command):
-                        if gesture != last_gesture:
-                            log_prefix = "STOP" if gesture == 'X' else f" {gesture} "
-                            print(f"[{uart.command_count:4d}] {log_prefix} | {description}")
-                            last_gesture = gesture
+                command = gesture_to_command.get(gesture, 'X')
+                if arbiter.submit(source, command):
+                    last_sent = command
+                    sent_count += 1
+                    if recorder:
+                        recorder.record_command(command, 'gesture')
+                    if gesture != last_gesture:
+                        log_prefix = "STOP" if gesture == 'X' else f" {gesture} "
+                        print(f"[{sent_count:4d}] {log_prefix} | {description}")
+                        last_gesture = gesture
                 
                 color = colors.get(gesture, (255, 255, 255))
                 
@@ -130,7 +218,7 @@ def main():
                 cv2.putText(frame, f"Gesture: {gesture}", (40, 80),
                            cv2.FONT_HERSHEY_SIMPLEX, 1.8, (0, 0, 0), 5)
                 
-                cv2.putText(frame, f"Command: '{uart.last_command}' | Count: {uart.command_count}", 
+                cv2.putText(frame, f"Command: '{last_sent}' | Count: {sent_count}", 
                            (40, 140), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 0), 3)
                 
                 cv2.putText(frame, description, (40, 190),
@@ -153,7 +241,15 @@ def main():
                 cv2.putText(frame, f"FPS: {int(fps)}", (frame.shape[1] - 200, 40),
                            cv2.FONT_HERSHEY_PLAIN, 2.5, (0, 255, 0), 3)
                 
+                if PUBLISH_ANNOTATED:
+                    if annotated_bus is None:
+                        height, width = frame.shape[:2]
+                        annotated_bus = FrameBusWriter(ANNOTATED_BUS, width, height)
+                        print(f"Publishing annotated frames to frame bus '{ANNOTATED_BUS}'.")
+                    annotated_bus.write(frame, captured_at)
+                
                 cv2.imshow("Smart Car Hand Gesture Steering", frame)
+                _STAGE_RENDER.observe(time.perf_counter() - t3)
                 
                 if cv2.waitKey(1) & 0xFF == ord('q'):
                     break
@@ -162,6 +258,12 @@ def main():
             print("\nTerminated by user.")
         
         finally:
+            if owns_arbiter:
+                arbiter.stop()
+            if annotated_bus:
+                annotated_bus.close()
+            if recorder:
+                recorder.close()
             cap.release()
             cv2.destroyAllWindows()
             print("\nCamera released.")
@@ -170,4 +272,7 @@ def main():
     print("Program exited cleanly.")
 
 if __name__ == "__main__":
+    USE_FRAME_BUS = '--frame-bus' in sys.argv
+    PUBLISH_ANNOTATED = '--annotate' in sys.argv
+    RECORD_PATH = cli_record_path(sys.argv)
     main()
@@ -4,13 +4,29 @@ serial_interface.py - Serial UART Hardware Controller Wrapper for Smart Car
 """
 import serial
 import time
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+import metrics
+
+_WRITES = metrics.SERIAL_WRITES.labels(source='uart')
+_WRITE_ERRORS = metrics.SERIAL_WRITE_ERRORS.labels(source='uart')
+_WRITE_SECONDS = metrics.SERIAL_WRITE_SECONDS.labels(source='uart')
 
 class UARTController:
-    def __init__(self, port='COM3', baud_rate=9600, timeout=1):
-        """Initialize serial connection parameters."""
+    def __init__(self, port='COM3', baud_rate=9600, timeout=1, settle_time=2.0, link=None):
+        """Initialize serial connection parameters.
+
+        settle_time waits out the Arduino's reset-on-open; fake links use 0.
+        link is an already-open serial-like object (e.g. a supervisor port)
+        used instead of opening port.
+        """
+        self.link = link
         self.port = port
         self.baud_rate = baud_rate
         self.timeout = timeout
+        self.settle_time = settle_time
         self.serial = None
         self.is_connected = False
         self.command_count = 0
@@ -31,9 +47,13 @@ class UARTController:
     
     def connect(self):
         """Connect to target serial port."""
+        if self.link is not None:
+            self.serial = self.link
+            self.is_connected = True
+            return True
         try:
             self.serial = serial.Serial(self.port, self.baud_rate, timeout=self.timeout)
-            time.sleep(2)
+            time.sleep(self.settle_time)
             self.is_connected = True
             print(f"Connected to serial port {self.port} at {self.baud_rate} baud rate.")
             return True
@@ -55,11 +75,15 @@ class UARTController:
             return False
         
         try:
+            start = time.perf_counter()
             self.serial.write(command.encode())
+            _WRITE_SECONDS.observe(time.perf_counter() - start)
+            _WRITES.inc()
             self.command_count += 1
             self.last_command = command
             return True
         except Exception as e:
+            _WRITE_ERRORS.inc()
             print(f"Error transmitting command over serial line: {e}")
             return False
 
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+session_replay.py - Deterministic Replay of Recorded Driving Sessions
+Feeds a recording made with --record (camera server, gesture bridge or web
+servers) back through the control pipeline into a pty fake Arduino, so
+gesture and serial performance can be compared run to run without hardware.
+
+Modes:
+  gesture   decode recorded frames and run the live gesture pipeline
+            (classify_frame) on them, sending the resulting commands
+  commands  re-send the recorded command events as they were issued
+
+Usage:
+  python session_replay.py <recording_dir> [--mode gesture|commands]
+                           [--speed 1|2|max] [--from SECONDS] [--duration SECONDS]
+                           [--paced]
+
+--speed max replays as fast as the pipeline allows, which is the
+deterministic benchmark; 1 reproduces the original timing. --paced makes
+the fake link deliver bytes at the real 9600 baud wire rate.
+"""
+import hashlib
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+import serial_interface as UART
+from fake_serial import FakeSerialLink
+from session_recorder import SessionReader, FRAME, COMMAND, GESTURE
+
+UART_BAUD = 9600
+
+def _arg_value(argv, flag, default=None):
+    if flag in argv:
+        index = argv.index(flag)
+        if index + 1 < len(argv):
+            return argv[index + 1]
+    return default
+
+def _percentiles(values):
+    if not values:
+        return "n/a"
+    p50, p90, p99 = np.percentile(np.array(values) * 1000, [50, 90, 99])
+    return f"p50 {p50:7.2f} ms | p90 {p90:7.2f} ms | p99 {p99:7.2f} ms"
+
+class ReplayClock:
+    """Maps recorded wall-clock timestamps to monotonic deadlines.
+
+    speed=None replays as fast as possible; wait() then returns immediately.
+    """
+    def __init__(self, start_time, speed=1.0):
+        self.start_time = start_time
+        self.speed = speed
+        self.origin = time.monotonic()
+
+    def wait(self, timestamp):
+        """Sleep until the record is due; return how late it was handed over (seconds)."""
+        if self.speed is None:
+            return 0.0
+        deadline = self.origin + (timestamp - self.start_time) / self.speed
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        return max(0.0, time.monotonic() - deadline)
+
+def replay_gestures(records, uart, clock, stats):
+    """Run recorded frames through the live gesture pipeline. Needs MediaPipe."""
+    from gesture_serial_bridge import classify_frame, gesture_to_command
+    import hand_tracker as htm
+
+    detector = htm.handDetector(detectionCon=0.7, maxHands=2)
+    replayed = None
+    for record in records:
+        if record.kind == GESTURE:
+            # The bridge records each frame's gesture right after the frame itself
+            if replayed is not None:
+                stats['compared'] += 1
+                stats['matched'] += record.json()['gesture'] == replayed
+                replayed = None
+            continue
+        stats['lag'].append(clock.wait(record.timestamp))
+        t0 = time.perf_counter()
+        frame = cv2.imdecode(np.frombuffer(record.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        stats['decode'].append(time.perf_counter() - t0)
+        if frame is None:
+            continue
+        _, replayed, _, (detect_s, classify_s) = classify_frame(detector, frame)
+        stats['detect'].append(detect_s)
+        stats['classify'].append(classify_s)
+        # Like the live bridge, every classified frame drives a UART write
+        _send(uart, gesture_to_command.get(replayed, 'X'), stats)
+        stats['frames'] += 1
+
+def replay_commands(records, uart, clock, stats):
+    """Re-send recorded command events with their original spacing."""
+    for record in records:
+        stats['lag'].append(clock.wait(record.timestamp))
+        _send(uart, record.json()['command'], stats)
+
+def _send(uart, command, stats):
+    issued = time.monotonic()
+    start = time.perf_counter()
+    if uart.send_command(command):
+        stats['sent'].append((issued, command))
+    stats['send'].append(time.perf_counter() - start)
+
+def replay(path, mode=None, speed=1.0, start_offset=0.0, duration=None, paced=False):
+    reader = SessionReader(path)
+    summary = reader.summary()
+    if mode is None:
+        mode = 'gesture' if summary['counts']['frame'] else 'commands'
+    kinds = (FRAME, GESTURE) if mode == 'gesture' else (COMMAND,)
+    start = reader.start_time + start_offset
+    end = start + duration if duration else None
+    # Random access through the memory-mapped index: no payload is read before start
+    records = reader.records(start, end, kinds)
+
+    print("=" * 60)
+    print("SESSION REPLAY")
+    print("=" * 60)
+    print(f"Recording: {path} ({summary['source'] or 'unknown source'}, {summary['duration_s']:.1f}s, "
+          f"{summary['records']} records)")
+    print(f"Mode: {mode} | Speed: {'max' if speed is None else f'{speed:g}x'} | "
+          f"Window: +{start_offset:g}s{f' for {duration:g}s' if duration else ''}")
+
+    stats = {'lag': [], 'decode': [], 'detect': [], 'classify': [], 'send': [], 'sent': [],
+             'frames': 0, 'compared': 0, 'matched': 0}
+    with FakeSerialLink(baud_rate=UART_BAUD if paced else None) as link:
+        with UART.UARTController(port=link.port, baud_rate=UART_BAUD, settle_time=0) as uart:
+            if not uart.is_connected:
+                reader.close()
+                return None
+            clock = ReplayClock(start, speed)
+            wall_start = time.monotonic()
+            try:
+                if mode == 'gesture':
+                    replay_gestures(records, uart, clock, stats)
+                else:
+                    replay_commands(records, uart, clock, stats)
+            except ImportError as e:
+                print(f"Error: gesture replay needs the vision pipeline ({e}). Try --mode commands.")
+                reader.close()
+                return None
+            wall = time.monotonic() - wall_start
+            link.wait_for_bytes(len(stats['sent']), timeout=5.0)
+            received = link.commands()
+    reader.close()
+
+    # Commands are single bytes, so the n-th byte received is the n-th command sent
+    link_latency = [r[0] - s[0] for s, r in zip(stats['sent'], received)]
+    digest = hashlib.sha1(''.join(c for _, c in received).encode()).hexdigest()[:12]
+    replayed = stats['frames'] if mode == 'gesture' else len(stats['sent'])
+    print(f"\nReplayed {replayed} {'frames' if mode == 'gesture' else 'commands'} in {wall:.2f}s "
+          f"({replayed / wall if wall > 0 else 0:.1f}/s)")
+    for stage in ('decode', 'detect', 'classify', 'send'):
+        if stats[stage]:
+            print(f"  {stage:10s} {_percentiles(stats[stage])}")
+    print(f"  {'link':10s} {_percentiles(link_latency)}")
+    if speed is not None:
+        print(f"  {'sched lag':10s} {_percentiles(stats['lag'])}")
+    if mode == 'gesture':
+        if stats['compared']:
+            print(f"Gesture agreement with recording: {stats['matched']}/{stats['compared']} "
+                  f"({stats['matched'] / stats['compared'] * 100:.1f}%)")
+        else:
+            print("Gesture agreement with recording: n/a (no gestures recorded)")
+    print(f"Fake Arduino received {len(received)}/{len(stats['sent'])} commands, digest {digest}")
+    return {'mode': mode, 'replayed': replayed, 'wall_s': wall, 'sent': len(stats['sent']),
+            'received': len(received), 'digest': digest,
+            'matched': stats['matched'], 'compared': stats['compared']}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1].startswith('-'):
+        print(__doc__)
+        sys.exit(1)
+    speed_arg = _arg_value(sys.argv, '--speed', '1')
+    duration_arg = _arg_value(sys.argv, '--duration')
+    result = replay(sys.argv[1],
+                    mode=_arg_value(sys.argv, '--mode'),
+                    speed=None if speed_arg == 'max' else float(speed_arg.rstrip('x')),
+                    start_offset=float(_arg_value(sys.argv, '--from', '0')),
+                    duration=float(duration_arg) if duration_arg else None,
+                    paced='--paced' in sys.argv)
+    sys.exit(0 if result else 1)
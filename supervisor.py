@@ -0,0 +1,523 @@
+# -*- coding: utf-8 -*-
+"""
+supervisor.py - Single-Process Smart Car Supervisor
+Keeps one interpreter and one serial session alive while control sources
+attach and detach at runtime, instead of launching every mode as a new
+process that re-imports OpenCV/MediaPipe/pyserial and resets the Arduino
+(2 s reset wait + 1 s mode selection) on each switch.
+
+The Arduino is put in Python controller mode (3) once. Every source gets a
+SourcePort, a pyserial stand-in whose writes go through the supervisor:
+
+  keyboard  Tk GUI, or headless evdev/pynput input     priority 50
+  voice     speech recognition + intent parsing        priority 40
+  gesture   OpenCV/MediaPipe hand gestures             priority 30
+  web       LAN web control server                     priority 20
+  cloud     cloud bridge client polling the server     priority 10
+
+Writes are arbitrated by serial_bridge/command_arbiter.py: a move command
+leases control to its source, the highest-priority source holding a lease
+wins, and a stop from voice or keyboard preempts every other source. When
+all leases lapse the arbiter's watchdog stops the car.
+
+  python supervisor.py                           # console: attach web, status, ...
+  python supervisor.py --attach web --attach "voice simple=1"
+  python supervisor.py --test --benchmark        # mode switch cost vs a new process
+"""
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+for _folder in ('common', 'serial_bridge', 'vision', 'keyboard', 'web', 'voice'):
+    sys.path.append(os.path.join(PROJECT_ROOT, _folder))
+import config
+if __name__ == "__main__":
+    config.load_or_exit()
+import metrics
+from command_arbiter import CommandArbiter, DEFAULT_LEASE
+from drive_control import open_python_mode
+
+COM_PORT = config.get('serial.port', 'COM8')
+BAUD_RATE = config.get('serial.baud_rate', 9600)
+# What the legacy launcher paid on every mode switch besides interpreter start-up
+LEGACY_SERIAL_SETTLE = 3.0
+
+_WRITES = metrics.SERIAL_WRITES.labels(source='supervisor')
+_WRITE_ERRORS = metrics.SERIAL_WRITE_ERRORS.labels(source='supervisor')
+_WRITE_SECONDS = metrics.SERIAL_WRITE_SECONDS.labels(source='supervisor')
+ATTACH_SECONDS = metrics.histogram(
+    'smartcar_supervisor_attach_seconds', 'Source attach to first command written', ['source'])
+
+def auto_detect_port():
+    """Auto-detect connected USB serial COM ports."""
+    import serial.tools.list_ports
+    ports = list(serial.tools.list_ports.comports())
+
+    if not ports:
+        return None
+
+    usb_ports = [p for p in ports if 'Bluetooth' not in p.description]
+    if usb_ports:
+        return usb_ports[0].device
+    return ports[0].device if ports else None
+
+def _flag(value):
+    return value in (True, '1', 'true', 'yes', 'on')
+
+class SerialSession:
+    """The one serial connection, opened once in Python controller mode."""
+    def __init__(self, port=None, baud_rate=BAUD_RATE, test_mode=False, quiet=False):
+        self.port = port
+        self.baud_rate = baud_rate
+        self.test_mode = test_mode
+        self.quiet = quiet
+        self.ser = None
+        self.writes = 0
+        self.last_command = 'X'
+        self._lock = threading.Lock()
+
+    def open(self):
+        if self.test_mode:
+            self.port = 'simulation'
+            print("SIMULATION MODE ACTIVE — Running without active Arduino hardware.")
+            return True
+        port = self.port or COM_PORT or auto_detect_port()
+        if not port:
+            print("Error: Serial COM port not found.")
+            return False
+        try:
+            print(f"Connecting to serial port {port}...")
+            self.ser = open_python_mode(port, self.baud_rate)
+            self.port = port
+            print(f"Connected to Arduino on port {port} (Python controller mode).")
+            return True
+        except Exception as e:
+            print(f"Serial connection error: {e}")
+            return False
+
+    def write(self, data, source):
+        with self._lock:
+            command = data[-1:].decode()
+            if self.test_mode:
+                if command != self.last_command and not self.quiet:
+                    print(f"[{time.strftime('%H:%M:%S')}] {source} -> {data.decode()}")
+            elif self.ser and self.ser.is_open:
+                try:
+                    start = time.perf_counter()
+                    self.ser.write(data)
+                    _WRITE_SECONDS.observe(time.perf_counter() - start)
+                    _WRITES.inc()
+                except Exception as e:
+                    _WRITE_ERRORS.inc()
+                    print(f"Serial transmission error: {e}")
+                    return False
+            else:
+                return False
+            self.writes += 1
+            self.last_command = command
+            return True
+
+    def close(self):
+        self.write(b'X', 'supervisor')
+        if self.ser and self.ser.is_open:
+            time.sleep(0.2)
+            self.ser.close()
+            print("Serial connection closed.")
+
+class SourcePort:
+    """pyserial stand-in handed to a source; writes go through the supervisor's arbitration."""
+    in_waiting = 0
+
+    def __init__(self, supervisor, name):
+        self.supervisor = supervisor
+        self.name = name
+        # Sources submit straight to the supervisor's arbiter instead of building their own
+        self.arbiter = supervisor.arbiter
+        self.port = f'supervisor:{name}'
+        self.is_open = True
+
+    def write(self, data):
+        if not self.is_open:
+            return 0
+        self.supervisor.submit(self.name, data)
+        return len(data)
+
+    def readline(self):
+        return b''
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            self.supervisor.release(self.name)
+
+class SourcePlugin:
+    """A control source run on its own thread. run(port) blocks until stop() is called."""
+    name = None
+    priority = 0
+    lease = DEFAULT_LEASE
+    # Stop from this source overrides every priority for the arbiter's stop hold
+    preempt_stop = False
+
+    def __init__(self, priority=None, lease=None, **options):
+        if priority is not None:
+            self.priority = int(priority)
+        if lease is not None:
+            self.lease = float(lease)
+        self.options = options
+        self._stop = threading.Event()
+
+    def run(self, port):
+        raise NotImplementedError
+
+    def stop(self):
+        self._stop.set()
+
+class WebPlugin(SourcePlugin):
+    name = 'web'
+    priority = 20
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.controller = None
+
+    def run(self, port):
+        from http.server import HTTPServer
+        import local_server
+        http_port = int(self.options.get('http_port', local_server.SERVER_PORT))
+        server = HTTPServer(('0.0.0.0', http_port), local_server.SmartCarRequestHandler)
+        # handle_request() with a timeout instead of serve_forever(), so stop() needs no handshake
+        server.timeout = 0.2
+        self.controller = local_server.SmartCarController(
+            ser=port, arbiter=port.arbiter, source=port.name)
+        local_server.controller = self.controller
+        print(f"Web control on http://{local_server.get_local_ip()}:{server.server_address[1]}")
+        try:
+            while not self._stop.is_set():
+                server.handle_request()
+        finally:
+            self.controller.stop()
+            server.server_close()
+
+class CloudBridgePlugin(SourcePlugin):
+    name = 'cloud'
+    priority = 10
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.bridge = None
+
+    def run(self, port):
+        import cloud_bridge_client
+        self.bridge = cloud_bridge_client.LocalBridgeClient(
+            self.options.get('url', cloud_bridge_client.SERVER_URL), ser=port,
+            arbiter=port.arbiter, source=port.name)
+        if self._stop.is_set():
+            return
+        self.bridge.run()
+
+    def stop(self):
+        super().stop()
+        if self.bridge:
+            self.bridge.stop()
+
+class VoicePlugin(SourcePlugin):
+    name = 'voice'
+    priority = 40
+    preempt_stop = True
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.controller = None
+
+    def run(self, port):
+        import voice_controller
+        streaming = _flag(self.options.get('stream', False))
+        self.controller = voice_controller.VoiceController(
+            use_langchain=not _flag(self.options.get('simple', False)),
+            streaming=streaming,
+            engine=self.options.get('engine', 'vosk'),
+            intent_backend=self.options.get('intent', 'keyword'),
+            ser=port, arbiter=port.arbiter, source=port.name)
+        if self._stop.is_set():
+            return
+        self.controller.run()
+
+    def stop(self):
+        super().stop()
+        if self.controller:
+            self.controller.is_running = False
+
+class GesturePlugin(SourcePlugin):
+    name = 'gesture'
+    priority = 30
+
+    def run(self, port):
+        import gesture_serial_bridge
+        gesture_serial_bridge.USE_FRAME_BUS = _flag(self.options.get('frame_bus', False))
+        gesture_serial_bridge.main(link=port, stop_event=self._stop, arbiter=port.arbiter, source=port.name)
+
+class KeyboardPlugin(SourcePlugin):
+    name = 'keyboard'
+    priority = 50
+    preempt_stop = True
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.controller = None
+        self.allow_tty = False
+
+    def run(self, port):
+        default = 'gui' if os.environ.get('DISPLAY') or os.name == 'nt' else 'auto'
+        input_name = self.options.get('input', default)
+        if input_name == 'gui':
+            self.run_gui(port)
+            return
+        import headless_controller
+        source = headless_controller.make_input(input_name, self.options.get('device'),
+                                                allow_tty=self.allow_tty)
+        self.controller = headless_controller.HeadlessController(source.name, ser=port)
+        if self._stop.is_set():
+            source.close()
+            return
+        self.controller.run(source)
+
+    def run_gui(self, port):
+        # Tk is created, driven and destroyed on this thread only
+        import keyboard_controller
+        app = keyboard_controller.KeyboardControlGUI(ser=port)
+
+        def poll_stop():
+            if self._stop.is_set():
+                app.quit_app()
+            else:
+                app.root.after(200, poll_stop)
+
+        app.root.after(200, poll_stop)
+        app.run()
+
+    def stop(self):
+        super().stop()
+        if self.controller:
+            self.controller.quit()
+
+PLUGINS = {plugin.name: plugin for plugin in
+           (KeyboardPlugin, VoicePlugin, GesturePlugin, WebPlugin, CloudBridgePlugin)}
+
+class Supervisor:
+    def __init__(self, port=None, baud_rate=BAUD_RATE, test_mode=False, console=True, quiet=False):
+        self.session = SerialSession(port, baud_rate, test_mode, quiet)
+        self.arbiter = CommandArbiter(self._write, name='supervisor')
+        # The console reads the terminal, so terminal keyboard input is only allowed without it
+        self.console_enabled = console
+        self.plugins = {}
+        self.attached_at = {}
+        self.first_write = {}
+
+    def start(self):
+        if not self.session.open():
+            return False
+        self.arbiter.start()
+        return True
+
+    def attach(self, name, **options):
+        """Start a source plugin on its own thread; returns the plugin."""
+        if name not in PLUGINS:
+            raise ValueError(f"Unknown source '{name}' (available: {', '.join(PLUGINS)})")
+        if name in self.plugins:
+            raise ValueError(f"Source '{name}' is already attached")
+        plugin = PLUGINS[name](**options)
+        if isinstance(plugin, KeyboardPlugin):
+            plugin.allow_tty = not self.console_enabled
+        port = SourcePort(self, name)
+        self.first_write.pop(name, None)
+        self.attached_at[name] = time.perf_counter()
+        self.arbiter.register(name, plugin.priority, plugin.lease, plugin.preempt_stop)
+        thread = threading.Thread(target=self._run_plugin, args=(name, plugin, port),
+                                  name=f'source-{name}', daemon=True)
+        self.plugins[name] = (plugin, thread)
+        thread.start()
+        return plugin
+
+    def _run_plugin(self, name, plugin, port):
+        try:
+            plugin.run(port)
+        except Exception as e:
+            print(f"Source '{name}' failed: {e}")
+        finally:
+            port.close()
+            self.plugins.pop(name, None)
+            print(f"Source '{name}' detached.")
+
+    def detach(self, name, timeout=5.0):
+        entry = self.plugins.get(name)
+        if not entry:
+            return False
+        plugin, thread = entry
+        plugin.stop()
+        thread.join(timeout)
+        return True
+
+    def submit(self, name, data):
+        """Called from a source thread for every write; returns True if it reached the car."""
+        return self.arbiter.submit(name, data)
+
+    def release(self, name):
+        self.arbiter.unregister(name)
+
+    def _write(self, data, source):
+        # Runs under the arbiter lock, so serial byte order matches decision order
+        if self.session.write(data, source) and source in self.attached_at and source not in self.first_write:
+            self.first_write[source] = time.perf_counter() - self.attached_at[source]
+            ATTACH_SECONDS.labels(source).observe(self.first_write[source])
+
+    def status(self):
+        rows = []
+        for row in self.arbiter.snapshot():
+            ready = self.first_write.get(row['source'])
+            ready = f"{ready * 1000:.0f} ms" if ready is not None else '-'
+            rows.append(f"  {'*' if row['owner'] else ' '} {row['source']:<9} prio {row['priority']:3d}  "
+                        f"last {row['command'] or '-'}  lease {row['lease_left']:4.2f}s  "
+                        f"forwarded {row['forwarded']:6d}  dropped {row['dropped']:6d}  "
+                        f"attach->first write {ready}")
+        print(f"Serial: {self.session.port}  |  {self.session.writes} writes  |  last {self.session.last_command}"
+              f"  |  {self.arbiter.watchdog_stops} watchdog stops")
+        print("\n".join(rows) if rows else "  (no sources attached)")
+
+    def shutdown(self):
+        for name in list(self.plugins):
+            self.detach(name)
+        self.arbiter.stop()
+        self.session.close()
+
+    def serve(self):
+        """Run the attached sources without a prompt until they all end, Ctrl+C or SIGTERM."""
+        def terminate(signum, frame):
+            raise KeyboardInterrupt
+
+        signal.signal(signal.SIGTERM, terminate)
+        try:
+            while self.plugins:
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            print()
+        finally:
+            print("Shutting down supervisor...")
+            self.shutdown()
+
+    def console(self):
+        """Interactive prompt: attach/detach sources without restarting anything."""
+        print("\nCommands: attach <source> [key=value ...] | detach <source> | status | stop | quit")
+        print(f"Sources: {', '.join(f'{name} ({cls.priority})' for name, cls in PLUGINS.items())}\n")
+        try:
+            while True:
+                try:
+                    line = input("supervisor> ").strip()
+                except EOFError:
+                    break
+                if not line:
+                    continue
+                words = shlex.split(line)
+                action, args = words[0].lower(), words[1:]
+                if action in ('quit', 'exit'):
+                    break
+                elif action == 'status':
+                    self.status()
+                elif action == 'stop':
+                    for name in list(self.plugins):
+                        self.detach(name)
+                    self.session.write(b'X', 'supervisor')
+                elif action == 'attach' and args:
+                    try:
+                        self.attach(args[0], **dict(arg.split('=', 1) for arg in args[1:] if '=' in arg))
+                        print(f"Attaching '{args[0]}'...")
+                    except (ValueError, TypeError) as e:
+                        print(f"Error: {e}")
+                elif action == 'detach' and args:
+                    if not self.detach(args[0]):
+                        print(f"Source '{args[0]}' is not attached")
+                else:
+                    print("Commands: attach <source> [key=value ...] | detach <source> | status | stop | quit")
+        except KeyboardInterrupt:
+            print()
+        finally:
+            print("Shutting down supervisor...")
+            self.shutdown()
+
+def benchmark(cycles=5):
+    """Mode switch cost: fresh interpreter + imports + Arduino reset vs re-attaching in process."""
+    import contextlib
+    import io
+    print("=" * 64)
+    print("MODE SWITCH BENCHMARK (web source, simulated serial)")
+    print("=" * 64)
+    code = ("import sys; sys.path[:0] = %r; import local_server"
+            % [os.path.join(PROJECT_ROOT, folder) for folder in ('common', 'web')])
+    spawn = []
+    for _ in range(cycles):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True)
+        spawn.append(time.perf_counter() - start)
+    spawn.sort()
+    legacy = spawn[len(spawn) // 2] + LEGACY_SERIAL_SETTLE
+    print(f"  new process:   interpreter + imports {spawn[len(spawn) // 2] * 1000:6.0f} ms "
+          f"+ serial reset/mode select {LEGACY_SERIAL_SETTLE * 1000:.0f} ms = {legacy * 1000:6.0f} ms")
+
+    supervisor = Supervisor(test_mode=True, console=False, quiet=True)
+    ready = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        supervisor.start()
+        for _ in range(cycles):
+            supervisor.attach('web', http_port=0)
+            while 'web' not in supervisor.first_write:
+                time.sleep(0.001)
+            ready.append(supervisor.first_write['web'])
+            supervisor.detach('web')
+        supervisor.session.close()
+    print(f"  supervisor:    first attach {ready[0] * 1000:6.1f} ms (imports), "
+          f"re-attach median {sorted(ready[1:])[len(ready[1:]) // 2] * 1000:6.1f} ms")
+    print(f"  switch speed-up: {legacy / sorted(ready[1:])[len(ready[1:]) // 2]:.0f}x")
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Smart Car single-process supervisor')
+    parser.add_argument('--attach', action='append', default=[], metavar='"SOURCE [key=value ...]"',
+                        help=f"Attach a source at start ({', '.join(PLUGINS)}); repeatable")
+    parser.add_argument('--port', help=f'Serial port (default {COM_PORT} or auto-detect)')
+    parser.add_argument('--test', '-t', action='store_true', help='Simulate the serial link')
+    parser.add_argument('--no-console', action='store_true',
+                        help='Run the attached sources until Ctrl+C without the interactive prompt')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Compare mode switch cost with launching a new process')
+    config.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark()
+        return
+
+    print("=" * 60)
+    print("SMART CAR SUPERVISOR")
+    print("=" * 60)
+    supervisor = Supervisor(args.port, test_mode=args.test, console=not args.no_console)
+    if not supervisor.start():
+        sys.exit(1)
+    for spec in args.attach:
+        words = shlex.split(spec)
+        supervisor.attach(words[0], **dict(arg.split('=', 1) for arg in words[1:] if '=' in arg))
+
+    if args.no_console:
+        supervisor.serve()
+    else:
+        supervisor.console()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""Put the project's module folders on sys.path, as the scripts do for themselves."""
+import os
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+for folder in ('common', 'serial_bridge', 'web', 'camera', 'keyboard', 'voice', 'zigbee', 'firmware'):
+    path = os.path.join(PROJECT_ROOT, folder)
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""CommandArbiter rules on a virtual clock, watchdog reaction and decision latency."""
+import threading
+import time
+
+from command_arbiter import (CommandArbiter, DEFAULT_LEASE, SCENARIO, STOP_HOLD, WATCHDOG_TICK,
+                             scenario_arbiter)
+
+# Decision plus (no-op) write, per submit, single-threaded
+DECISION_P99_BOUND = 0.001
+
+def test_scenario_decisions():
+    written = []
+    arbiter = scenario_arbiter(written)
+    forwarded = [arbiter.submit(source, command, now=at) for at, source, command, _ in SCENARIO]
+    assert forwarded == [True, True, False, True, False, True, False]
+    assert written == [('W', 'cloud'), ('A', 'web'), ('X', 'voice'), ('W', 'cloud')]
+    rows = {row['source']: row for row in arbiter.snapshot()}
+    assert (rows['cloud']['forwarded'], rows['cloud']['dropped']) == (2, 1)
+    assert (rows['web']['forwarded'], rows['web']['dropped']) == (1, 2)
+    assert (rows['voice']['forwarded'], rows['voice']['dropped']) == (1, 0)
+
+    arbiter.evaluate(now=1.35 + DEFAULT_LEASE + 0.01)
+    assert written[-1] == ('X', 'watchdog')
+    assert arbiter.watchdog_stops == 1
+
+def test_stop_hold_drops_moves_then_releases():
+    written = []
+    arbiter = scenario_arbiter(written)
+    arbiter.submit('voice', 'X', now=0.0)
+    assert not arbiter.submit('cloud', 'W', now=0.1)
+    # Cloud keeps streaming; the first submit after the hold goes through
+    assert arbiter.submit('cloud', 'W', now=STOP_HOLD + 0.01)
+    assert written == [('X', 'voice'), ('W', 'cloud')]
+
+def test_watchdog_stops_within_one_tick_of_lease_expiry():
+    written = []
+    arbiter = CommandArbiter(lambda data, source: written.append((data, source)))
+    arbiter.register('web', 20)
+    start = 10.0
+    assert arbiter.submit('web', 'W', now=start)
+    expires = start + DEFAULT_LEASE
+    stopped_at = None
+    tick = 0
+    while stopped_at is None:
+        tick += 1
+        now = start + tick * WATCHDOG_TICK
+        arbiter.evaluate(now=now)
+        if arbiter.output == b'X':
+            stopped_at = now
+    assert expires <= stopped_at <= expires + WATCHDOG_TICK
+    assert written[-1] == (b'X', 'watchdog')
+
+def test_watchdog_thread_writes_stop():
+    stopped = threading.Event()
+    arbiter = CommandArbiter(lambda data, source: data == b'X' and stopped.set(), tick=0.01)
+    arbiter.register('web', 20, lease=0.05)
+    arbiter.start()
+    try:
+        arbiter.submit('web', 'W')
+        assert stopped.wait(1.0)
+        assert arbiter.watchdog_stops == 1
+    finally:
+        arbiter.stop()
+
+def test_decision_latency_p99():
+    arbiter = CommandArbiter(lambda data, source: None)
+    sources = [f'source{index}' for index in range(6)]
+    for index, name in enumerate(sources):
+        arbiter.register(name, priority=index * 10, preempt_stop=index == len(sources) - 1)
+    latencies = []
+    for step in range(20000):
+        name = sources[step % len(sources)]
+        command = 'WASDX'[step % 5] if name == sources[-1] else 'WASD'[step % 4]
+        start = time.perf_counter()
+        arbiter.submit(name, command, now=step * 0.001)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    assert latencies[int(len(latencies) * 0.99)] < DECISION_P99_BOUND
+
+def test_concurrent_submits_are_all_decided():
+    arbiter = CommandArbiter(lambda data, source: None)
+    sources = [f'source{index}' for index in range(6)]
+    for index, name in enumerate(sources):
+        arbiter.register(name, priority=index * 10)
+    per_thread = 2000
+    barrier = threading.Barrier(len(sources))
+
+    def hammer(name):
+        barrier.wait()
+        for count in range(per_thread):
+            arbiter.submit(name, 'WASD'[count % 4])
+
+    threads = [threading.Thread(target=hammer, args=(name,)) for name in sources]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for row in arbiter.snapshot():
+        assert row['forwarded'] + row['dropped'] == per_thread
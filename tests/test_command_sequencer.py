@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""CommandSequencer step timing against a recording writer, and step validation."""
+import threading
+import time
+
+import pytest
+
+from command_sequencer import CommandSequencer, parse_steps
+
+# Largest allowed gap between a step's scheduled and applied time
+DRIFT_BOUND = 0.02
+
+class RecordingWriter:
+    def __init__(self):
+        self.applied = []
+
+    def __call__(self, command):
+        self.applied.append((command, time.monotonic()))
+
+def run_sequence(steps):
+    writer = RecordingWriter()
+    sequencer = CommandSequencer(writer)
+    start = time.monotonic()
+    sequencer.start(steps)
+    sequencer.wait(timeout=10.0)
+    return writer.applied, start, sequencer.status()
+
+def test_step_timing_does_not_drift():
+    steps = [('WASD'[index % 4], 0.03) for index in range(20)]
+    applied, start, status = run_sequence(steps)
+    assert [command for command, _ in applied] == [command for command, _ in steps] + ['X']
+    first = applied[0][1]
+    assert first - start < DRIFT_BOUND
+    # Deadlines are absolute, so the error stays bounded instead of growing per step
+    expected = 0.0
+    for (command, duration), (_, at) in zip(steps + [('X', 0.0)], applied):
+        assert abs((at - first) - expected) < DRIFT_BOUND, command
+        expected += duration
+    assert not status['active'] and not status['cancelled']
+    for row in status['timing']:
+        assert abs(row['actual_s'] - row['scheduled_s']) < DRIFT_BOUND
+
+def test_cancel_skips_final_stop():
+    writer = RecordingWriter()
+    sequencer = CommandSequencer(writer)
+    sequencer.start([('W', 5.0)])
+    threading.Event().wait(0.05)
+    assert sequencer.cancel()
+    assert [command for command, _ in writer.applied] == ['W']
+    assert sequencer.status()['cancelled']
+
+def test_explicit_cancel_applies_final_stop():
+    writer = RecordingWriter()
+    sequencer = CommandSequencer(writer)
+    sequencer.start([('W', 5.0)])
+    threading.Event().wait(0.05)
+    assert sequencer.cancel(stop=True)
+    assert [command for command, _ in writer.applied] == ['W', 'X']
+
+def test_parse_steps_accepts_both_forms():
+    assert parse_steps({'steps': [{'command': 'w', 'duration': 2}, ['X', '0.5']]}) == [('W', 2.0), ('X', 0.5)]
+
+@pytest.mark.parametrize('payload', [
+    [],
+    {'steps': [['W', True]]},
+    {'steps': [{'command': 'W', 'duration': False}]},
+    [['W', 0]],
+    [['W', 31]],
+    [['Q', 1]],
+    [['W', 'soon']],
+])
+def test_parse_steps_rejects(payload):
+    with pytest.raises(ValueError):
+        parse_steps(payload)
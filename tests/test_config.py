@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""Settings layers, and bad settings as a catchable error for importers vs. exit status 2 for scripts."""
+import os
+import subprocess
+import sys
+
+import pytest
+
+import config
+
+CAMERA_SERVER = os.path.join(os.path.dirname(__file__), '..', 'camera', 'camera_server.py')
+
+def test_later_layers_win():
+    loaded = config.load(argv=['prog', '--set', 'camera.port=5001'],
+                         environ={'SMARTCAR_CAMERA_PORT': '5002', 'SMARTCAR_SERIAL_BAUD_RATE': '115200'})
+    assert loaded.get('camera.port') == 5001
+    assert loaded.origins['camera.port'] == '--set'
+    assert loaded.get('serial.baud_rate') == 115200
+
+def test_bad_setting_raises_config_error(monkeypatch):
+    monkeypatch.setattr(config, '_settings', None)
+    monkeypatch.setattr(sys, 'argv', ['prog', '--set', 'camera.port=http'])
+    with pytest.raises(config.ConfigError):
+        config.get('camera.port', 5000)
+    with pytest.raises(SystemExit) as exited:
+        config.load_or_exit()
+    assert exited.value.code == 2
+
+def test_script_exits_with_status_2():
+    env = dict(os.environ, SMARTCAR_CAMERA_PORT='http')
+    result = subprocess.run([sys.executable, CAMERA_SERVER], env=env, capture_output=True, text=True)
+    assert result.returncode == 2
+    assert 'Configuration error: camera.port' in result.stdout
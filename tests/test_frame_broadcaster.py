@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""FrameBroadcaster fan-out under load with the synthetic camera."""
+import pytest
+
+pytest.importorskip('cv2')
+
+from frame_broadcaster import FrameBroadcaster, run_load_trial
+from video_source import SyntheticSource
+
+FPS = 30
+DURATION = 1.0
+
+def load_trial(n_clients, slow_clients):
+    broadcaster = FrameBroadcaster(SyntheticSource(160, 120, FPS), adaptive=False, source_fps=FPS)
+    encode = broadcaster.encode
+    calls = []
+
+    def counting_encode(frame, variant=None):
+        calls.append(variant)
+        return encode(frame, variant)
+
+    broadcaster.encode = counting_encode
+    broadcaster.start()
+    _, stats = run_load_trial(broadcaster, n_clients, slow_clients, DURATION)
+    return broadcaster, len(calls), stats
+
+def test_encode_count_does_not_depend_on_clients():
+    single, single_calls, _ = load_trial(1, 0)
+    many, many_calls, stats = load_trial(8, 2)
+    assert len(stats) == 8
+    # One encode per captured frame however many clients read it
+    assert single_calls == single.frames_encoded
+    assert many_calls == many.frames_encoded
+    assert many.frames_encoded <= many.frames_captured
+    assert abs(many.frames_encoded - single.frames_encoded) <= 0.2 * single.frames_encoded
+
+def test_slow_clients_drop_frames():
+    broadcaster, _, stats = load_trial(4, 2)
+    # Readers attach from their own threads, so match them by address
+    stats = sorted(stats, key=lambda client: client['address'])
+    fast, slow = stats[:2], stats[2:]
+    for client in slow:
+        assert client['frames_dropped'] > 0
+        assert client['frames_sent'] < broadcaster.frames_encoded / 2
+    for client in fast:
+        assert client['frames_sent'] >= 0.8 * broadcaster.frames_encoded
+        assert client['frames_dropped'] <= 0.1 * broadcaster.frames_encoded
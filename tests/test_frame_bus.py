@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""FrameBusWriter ownership: a live writer keeps its segment, a crashed one is replaced."""
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('cv2')
+
+import frame_bus
+from frame_bus import FrameBusError, FrameBusReader, FrameBusWriter, live_writer
+
+WIDTH, HEIGHT = 8, 6
+
+@pytest.fixture
+def bus_name():
+    return f'smartcar_test_{os.getpid()}'
+
+def frame(value):
+    return np.full((HEIGHT, WIDTH, 3), value, dtype=np.uint8)
+
+def crash(writer):
+    """Drop the mapping without the clean close() that unlinks the segment."""
+    writer._seg = None
+    writer._shm.close()
+    writer._shm = None
+
+def test_second_writer_refuses_live_segment(bus_name):
+    writer = FrameBusWriter(bus_name, WIDTH, HEIGHT)
+    reader = FrameBusReader(bus_name, consumer='test')
+    try:
+        assert live_writer(bus_name) == os.getpid()
+        with pytest.raises(FrameBusError, match='in use'):
+            FrameBusWriter(bus_name, WIDTH, HEIGHT)
+        # The original writer and its reader are untouched
+        writer.write(frame(7))
+        seq, _, data = reader.read(timeout=1.0, copy=True)
+        assert seq == 1 and data[0, 0, 0] == 7
+    finally:
+        reader.close()
+        writer.close()
+    assert live_writer(bus_name) is None
+
+def test_segment_with_stale_heartbeat_is_replaced(bus_name, monkeypatch):
+    stale = FrameBusWriter(bus_name, WIDTH, HEIGHT)
+    stale.write(frame(1))
+    crash(stale)
+    # Same PID (e.g. PID reuse after a crash), but no write for longer than the stale limit
+    monkeypatch.setattr(frame_bus, 'WRITER_STALE_AFTER', 0.0)
+    assert live_writer(bus_name) is None
+    writer = FrameBusWriter(bus_name, WIDTH, HEIGHT)
+    try:
+        assert writer.seq == 0
+        assert live_writer(bus_name) is None
+        monkeypatch.undo()
+        assert live_writer(bus_name) == os.getpid()
+    finally:
+        writer.close()
+
+def test_segment_of_dead_process_is_replaced(bus_name):
+    stale = FrameBusWriter(bus_name, WIDTH, HEIGHT)
+    stale._seg.header[frame_bus._WRITER_PID] = 2 ** 22 + 1  # above the default pid_max
+    crash(stale)
+    writer = FrameBusWriter(bus_name, WIDTH, HEIGHT)
+    writer.close()
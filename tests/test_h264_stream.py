@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""H264Stream fragment lookup by sequence number."""
+import threading
+import time
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('av')
+
+from h264_stream import H264Stream
+
+def test_wait_fragment_returns_capture_time():
+    stream = H264Stream(64, 48, fps=10)
+    stream.start()
+    viewer = stream.fragments()
+
+    def watch():
+        for _ in zip(range(4), viewer):
+            pass
+
+    # The encoder only runs while a viewer is attached
+    threading.Thread(target=watch, daemon=True).start()
+    try:
+        deadline = time.monotonic() + 2.0
+        while not stream.has_clients and time.monotonic() < deadline:
+            time.sleep(0.01)
+        for index in range(6):
+            stream.submit(np.full((48, 64, 3), index * 40, np.uint8), captured_at=100.0 + index)
+            time.sleep(0.05)
+        keyframe, captured_at, data = stream.wait_fragment(1, timeout=2.0)
+        assert keyframe and captured_at == 100.0 and data[4:8] == b'moof'
+        assert stream.wait_fragment(99, timeout=0.1) is None
+    finally:
+        stream.stop()
+    assert stream.wait_fragment(99) is None
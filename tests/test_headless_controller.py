@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Input-to-serial latency accounting of the headless controller."""
+import time
+
+import headless_controller
+from headless_controller import HeadlessController
+
+def test_port_auto_detects_without_configuration(monkeypatch):
+    monkeypatch.setattr(headless_controller, 'COM_PORT', None)
+    monkeypatch.setattr(headless_controller, 'auto_detect_port', lambda: None)
+    assert not HeadlessController('test').connect()
+
+def test_input_that_changes_output_is_measured():
+    ctrl = HeadlessController('test', test_mode=True)
+    ctrl.press('W', event_time=time.time())
+    ctrl.link.step(time.monotonic())
+    assert len(ctrl.latencies) == 1
+    assert ctrl._input_time is None
+
+def test_input_without_output_change_is_not_measured():
+    ctrl = HeadlessController('test', test_mode=True)
+    now = time.monotonic()
+    ctrl.link.step(now)
+    # Releasing a key that is not held changes nothing
+    ctrl.release('A', event_time=time.time() - 1.0)
+    assert ctrl.link.step(time.monotonic()) == b''
+    assert ctrl._input_time is None
+    # The next write (here a real press) is measured from its own input, not the stale one
+    ctrl.press('W')
+    ctrl.link.step(time.monotonic())
+    assert len(ctrl.latencies) == 1 and ctrl.latencies[0] < 0.5
+
+def test_ramp_keeps_pending_input_until_output_changes():
+    ctrl = HeadlessController('test', test_mode=True)
+    start = time.monotonic()
+    ctrl.press('W')
+    ctrl.link.step(start)
+    ctrl.release('W')
+    # Still ramping down: nothing written yet, but the release stays pending
+    assert ctrl.link.step(start + 0.001) == b''
+    assert ctrl._input_time is not None
+    ctrl.link.step(start + 0.2)
+    assert ctrl.link.output == ('X', None)
+    assert len(ctrl.latencies) == 2
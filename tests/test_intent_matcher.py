@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""Resolution rules of the compiled intent matcher and the benchmark's difference split."""
+import pytest
+
+from intent_matcher import (IntentMatcher, _LEGACY_VOICE_COMMANDS, _compare, _legacy_match,
+                            match_intent)
+
+@pytest.mark.parametrize('text, command', [
+    ('go back', 'S'),
+    ('please turn left now', 'A'),
+    ('go forward then stop', 'X'),
+    ('the feedback was alright', None),
+    ('go   straight', 'W'),
+    ('', None),
+])
+def test_resolution(text, command):
+    result = match_intent(text)
+    assert (result.command if result else None) == command
+
+def test_conflicting_vocabulary_is_rejected():
+    with pytest.raises(ValueError):
+        IntentMatcher({'W': ['go'], 'X': ['go']})
+
+def test_compare_separates_rule_errors_from_vocabulary():
+    corpus = ['go back', 'alright', 'straight', 'wait', 'turn left']
+    compiled = [IntentMatcher().command(t) for t in corpus]
+    legacy = [_legacy_match(t, _LEGACY_VOICE_COMMANDS) for t in corpus]
+    rules = [IntentMatcher(_LEGACY_VOICE_COMMANDS).command(t) for t in corpus]
+    # 'alright' -> D is a substring error; 'straight' and 'wait' are new phrases
+    assert _compare(compiled, legacy, rules) == (1, 2)
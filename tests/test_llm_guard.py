@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""GuardedExecutor deadlines and the circuit breaker's open, half-open and recovery paths on a fake clock."""
+import threading
+
+from llm_guard import CIRCUIT_OPEN, ERROR, OK, REJECTED, TIMEOUT, CircuitBreaker, GuardedExecutor
+
+RESET = 30.0
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def failing():
+    raise ConnectionError("model down")
+
+def guarded(clock, **options):
+    return GuardedExecutor('test', failure_threshold=2, reset_timeout=RESET, clock=clock, **options)
+
+def test_timeout_returns_by_deadline_and_counts_as_failure():
+    release = threading.Event()
+    guard = guarded(FakeClock(), timeout=0.05)
+    try:
+        assert guard.call(release.wait) == (TIMEOUT, None)
+        assert guard.breaker.failures == 1
+    finally:
+        release.set()
+        guard.shutdown()
+
+def test_hung_calls_exhaust_slots_and_reject():
+    release = threading.Event()
+    guard = guarded(FakeClock(), max_concurrent=1, timeout=0.02)
+    try:
+        assert guard.call(release.wait)[0] == TIMEOUT
+        # The timed-out call still holds the only slot
+        assert guard.call(lambda: 'intent')[0] == REJECTED
+    finally:
+        release.set()
+        guard.shutdown()
+
+def test_breaker_opens_then_recovers_through_half_open_probe():
+    clock = FakeClock()
+    guard = guarded(clock)
+    calls = []
+    try:
+        assert guard.call(failing)[0] == ERROR
+        assert guard.breaker.state == 'closed'
+        assert guard.call(failing)[0] == ERROR
+        assert guard.breaker.state == 'open'
+        assert guard.call(calls.append, 'skipped') == (CIRCUIT_OPEN, None)
+        assert calls == []
+
+        clock.now += RESET - 0.1
+        assert guard.call(calls.append, 'skipped')[0] == CIRCUIT_OPEN
+        clock.now += 0.1
+        assert guard.breaker.state == 'half_open'
+        assert guard.call(lambda: 'W') == (OK, 'W')
+        assert guard.breaker.state == 'closed'
+        assert guard.breaker.failures == 0
+    finally:
+        guard.shutdown()
+
+def test_half_open_allows_one_probe_and_a_failed_probe_reopens():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=RESET, clock=clock)
+    breaker.record_failure()
+    clock.now += RESET
+    assert breaker.allow()
+    # Only one probe at a time while half-open
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert breaker.opened_at == clock.now
+    clock.now += RESET
+    assert breaker.state == 'half_open'
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Route labels and the request metrics mixin shared by the web servers."""
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import metrics
+
+@pytest.mark.parametrize('path, label', [
+    ('/', '/'),
+    ('/status?verbose=1', '/status'),
+    ('/cmd/W', '/cmd'),
+    ('/sequence/cancel', '/sequence/cancel'),
+    ('/favicon.ico', 'other'),
+])
+def test_route_label(path, label):
+    assert metrics.route_label(path) == label
+
+class Handler(metrics.RequestMetricsMixin, BaseHTTPRequestHandler):
+    metrics_server = 'test'
+
+    def do_GET(self):
+        self.send_response(200 if self.path == '/status' else 404)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def test_mixin_records_status_and_latency():
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    ok = metrics.HTTP_REQUESTS.labels('test', 'GET', '/status', '200')
+    missing = metrics.HTTP_REQUESTS.labels('test', 'GET', 'other', '404')
+    before_ok, before_missing = ok.get(), missing.get()
+    try:
+        urllib.request.urlopen(base + '/status').close()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(base + '/nowhere')
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert ok.get() == before_ok + 1
+    assert missing.get() == before_missing + 1
+    assert 'smartcar_http_request_seconds_count{server="test",route="/status"}' in metrics.render()
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""ParseCache persistence round trip and tolerance of malformed files."""
+import json
+import time
+
+import pytest
+
+from parse_cache import ParseCache
+
+def write(path, data):
+    path.write_text(json.dumps(data), encoding='utf-8')
+    return str(path)
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'cache.json')
+    cache = ParseCache('test', path=path)
+    cache.put('Go  forward!', {'command': 'W'})
+    assert cache.save()
+    assert ParseCache('test', path=path).get('go forward') == {'command': 'W'}
+
+@pytest.mark.parametrize('data', [[], 'entries', 42, None, {'entries': {'a': 1}}])
+def test_wrong_shape_is_ignored(tmp_path, data, capsys):
+    cache = ParseCache('test', path=write(tmp_path / 'cache.json', data))
+    assert cache.stats()['entries'] == 0
+    assert 'Warning' in capsys.readouterr().out
+
+def test_malformed_rows_are_skipped(tmp_path, capsys):
+    now = time.time()
+    rows = [['stop', now, {'command': 'X'}],
+            ['left', now],
+            ['right', 'yesterday', {'command': 'D'}],
+            ['back', True, {'command': 'S'}],
+            [3, now, {'command': 'W'}],
+            'go',
+            ['expired', now - 10 ** 6, {'command': 'W'}]]
+    cache = ParseCache('test', path=write(tmp_path / 'cache.json', {'version': 1, 'entries': rows}))
+    assert cache.stats()['entries'] == 1
+    assert cache.get('stop') == {'command': 'X'}
+    assert 'Skipped 5 malformed entries' in capsys.readouterr().out
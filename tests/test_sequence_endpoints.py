@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""POST /sequence and /sequence/cancel on both web servers, in simulation mode."""
+import json
+import threading
+import time
+import urllib.request
+from http.server import HTTPServer
+
+import pytest
+
+import local_server
+
+def post(base, path, payload=None):
+    request = urllib.request.Request(base + path, data=json.dumps(payload or {}).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'}, method='POST')
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+def get(base, path):
+    with urllib.request.urlopen(base + path) as response:
+        return response.read()
+
+@pytest.fixture(params=['local', 'cloud'])
+def server(request, monkeypatch):
+    if request.param == 'local':
+        module, controller = local_server, local_server.SmartCarController(test_mode=True)
+    else:
+        module = pytest.importorskip('cloud_server')
+        controller = module.SmartCarController(test_mode=True, enable_llm=False)
+    monkeypatch.setattr(module, 'controller', controller)
+    monkeypatch.setattr(module.SmartCarRequestHandler, 'log_message', lambda *args: None)
+    httpd = HTTPServer(('127.0.0.1', 0), module.SmartCarRequestHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}', controller
+    httpd.shutdown()
+    httpd.server_close()
+    controller.stop()
+
+def test_cancel_endpoint_stops_the_car(server):
+    base, controller = server
+    assert post(base, '/sequence', {'steps': [['W', 5.0]]})['success']
+    time.sleep(0.05)
+    assert controller.current_command == 'W'
+    assert post(base, '/sequence/cancel')['cancelled']
+    assert controller.current_command == 'X'
+    assert not controller.sequencer.status()['active']
+
+def test_manual_command_takes_over_without_stop(server):
+    base, controller = server
+    post(base, '/sequence', {'steps': [['W', 5.0]]})
+    time.sleep(0.05)
+    get(base, '/cmd/A')
+    assert controller.current_command == 'A'
+    assert controller.sequencer.status()['cancelled']
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+"""The voice controller leaves NumPy-based modules to the modes that use them."""
+import os
+import subprocess
+import sys
+
+VOICE_DIR = os.path.join(os.path.dirname(__file__), '..', 'voice')
+
+def test_import_does_not_load_numpy():
+    code = ("import sys; import voice_controller; "
+            "print(sorted(m for m in ('numpy', 'voice_stream', 'keyword_spotter') if m in sys.modules))")
+    output = subprocess.run([sys.executable, '-c', code], cwd=VOICE_DIR, capture_output=True,
+                            text=True, check=True).stdout
+    assert output.strip().splitlines()[-1] == '[]'
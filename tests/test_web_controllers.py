@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Both web controllers write through a CommandArbiter: leases renew, a stalled loop is stopped."""
+import threading
+import time
+
+import pytest
+
+from command_arbiter import DEFAULT_LEASE, WATCHDOG_TICK
+import local_server
+
+class RecordingPort:
+    is_open = True
+
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+    def close(self):
+        self.is_open = False
+
+@pytest.fixture(params=['local', 'cloud'])
+def controller(request):
+    if request.param == 'local':
+        ctrl = local_server.SmartCarController(test_mode=True)
+    else:
+        ctrl = pytest.importorskip('cloud_server').SmartCarController(test_mode=True, enable_llm=False)
+    ctrl.ser = RecordingPort()
+    ctrl.test_mode = False
+    yield ctrl
+    ctrl.stop()
+
+def test_commands_reach_the_port_through_the_arbiter(controller):
+    controller.send_command('W')
+    time.sleep(0.1)
+    assert controller.ser.written[-1] == b'W'
+    assert controller.arbiter.output == b'W'
+
+def test_watchdog_stops_a_stalled_send_loop(controller):
+    controller.send_command('W')
+    time.sleep(0.1)
+    # Stall the send loop: the lease is no longer renewed
+    controller.is_running = False
+    controller.command_changed.set()
+    controller.send_thread.join(timeout=1.0)
+    threading.Event().wait(DEFAULT_LEASE + 4 * WATCHDOG_TICK)
+    assert controller.ser.written[-1] == b'X'
+    assert controller.arbiter.watchdog_stops == 1
+
+def test_cloud_history_stays_bounded_under_concurrent_commands():
+    cloud_server = pytest.importorskip('cloud_server')
+    ctrl = cloud_server.SmartCarController(test_mode=True, enable_llm=False)
+    per_thread = 200
+    barrier = threading.Barrier(8)
+
+    def hammer():
+        barrier.wait()
+        for count in range(per_thread):
+            ctrl.send_command('WASD'[count % 4])
+
+    threads = [threading.Thread(target=hammer) for _ in range(8)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(ctrl.command_history) == 50
+        assert len(ctrl.get_status()['history']) == 10
+    finally:
+        ctrl.stop()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""LinkTester against the pty loopback: loss accounting, reports and the CI exit code."""
+import os
+
+import pytest
+import serial
+
+from fake_serial import FakeSerialLink
+from zigbee_serial_test import EchoResponder, LinkTester, check_thresholds, main
+
+pytestmark = pytest.mark.skipif(os.name != 'posix', reason='FakeSerialLink needs a pseudo-terminal')
+
+BAUD = 115200
+
+def run_link(duration=1.0, rate=50, interval=0.5, **responder):
+    with FakeSerialLink(baud_rate=BAUD, responder=EchoResponder(BAUD, **responder), keep_bytes=False) as link:
+        with serial.Serial(link.port, BAUD, timeout=0.1) as ser:
+            return LinkTester(ser, rate=rate, interval=interval).run(duration, drain=0.3)
+
+def test_clean_link_echoes_everything(capsys):
+    result = run_link()
+    assert result['sent'] == 50
+    assert result['echoed'] == result['sent']
+    assert result['loss'] == 0.0
+    assert result['corrupt'] == result['duplicates'] == 0
+    assert 0 < result['rtt_p99'] < 0.2
+    assert check_thresholds(result, max_loss=0.0, max_rtt=0.2) == []
+    # Two full windows, no partial one, then the drain window
+    lines = [line.split()[0] for line in capsys.readouterr().out.splitlines()]
+    assert lines == ['t=', 't=', 'drain=']
+
+def test_lossy_link_fails_loss_threshold():
+    result = run_link(loss=0.2, seed=1)
+    assert 0 < result['lost'] < result['sent']
+    assert result['loss'] == result['lost'] / result['sent']
+    failures = check_thresholds(result, max_loss=0.05)
+    assert len(failures) == 1 and failures[0].startswith('loss')
+
+def test_reordered_echoes_are_counted():
+    result = run_link(reorder=0.2, seed=2)
+    assert result['reordered'] > 0
+    assert result['lost'] == 0
+
+def test_reports_are_not_starved_by_sending(capsys):
+    # Sending every 5 ms keeps a send due at almost every loop pass
+    run_link(duration=1.0, rate=200, interval=0.25)
+    labels = [line.split('=')[0].strip() for line in capsys.readouterr().out.splitlines()]
+    assert labels.count('t') >= 4
+    assert labels[-1] == 'drain'
+
+@pytest.mark.parametrize('extra, code', [
+    (['--max-loss', '0.05'], 1),
+    (['--max-loss', '0.9', '--max-rtt', '1000'], None),
+])
+def test_main_exit_code(extra, code):
+    argv = ['--fake', '--baud', str(BAUD), '--duration', '0.5', '--rate', '40',
+            '--loss', '0.3', '--seed', '1'] + extra
+    if code is None:
+        main(argv)
+    else:
+        with pytest.raises(SystemExit) as exit_info:
+            main(argv)
+        assert exit_info.value.code == code
@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+"""
+keyword_spotter.py - Offline Keyword Spotting with MFCC Templates and DTW
+Recognizes the small fixed command vocabulary on the CPU without network:
+each enrolled example ("template") is reduced to MFCC features, and an
+utterance is compared with every template by dynamic time warping. Both
+steps are vectorized in NumPy; one utterance against a few dozen templates
+takes a few milliseconds.
+
+Templates are 16-bit mono WAV files under TEMPLATE_DIR, one sub-directory per
+phrase (keywords/stop/01.wav, keywords/turn_left/01.wav). Record them with
+  python keyword_spotter.py --enroll stop --count 5
+and measure accuracy and latency over a labelled test set with
+  python keyword_spotter.py --benchmark TEST_DIR
+(test files are named or foldered by phrase; "unknown" marks negatives).
+"""
+import os
+import sys
+import time
+import wave
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+import metrics
+from intent_matcher import default_matcher
+
+TEMPLATE_DIR = os.getenv('SMARTCAR_KWS_TEMPLATES', os.path.join(os.path.dirname(__file__), 'keywords'))
+SAMPLE_RATE = 16000
+
+# MFCC front end: 25 ms Hamming windows every 10 ms, 26 mel bands, 13 cepstra
+FRAME_MS = 25
+HOP_MS = 10
+N_FFT = 512
+N_MELS = 26
+N_CEPSTRA = 13
+PRE_EMPHASIS = 0.97
+
+# Template edges quieter than this (relative to the peak) are trimmed
+TRIM_DB = 30.0
+# Mean per-frame distance between normalized MFCCs accepted as a match, and
+# how much closer the best phrase must be than the runner-up
+MATCH_THRESHOLD = 2.5
+MARGIN = 0.15
+# Run a spotting pass on the growing utterance this often while it is spoken
+PARTIAL_INTERVAL_MS = 100
+
+_SPOT_SECONDS = metrics.histogram(
+    'smartcar_voice_kws_seconds', 'Keyword spotting time per pass (MFCC + DTW)')
+_SPOT_RESULTS = metrics.counter(
+    'smartcar_voice_kws_results_total', 'Keyword spotting decisions', ['result'])
+_SPOT_MATCH = _SPOT_RESULTS.labels(result='match')
+_SPOT_REJECT = _SPOT_RESULTS.labels(result='reject')
+
+_filterbanks = {}
+
+def _mel_filterbank(rate):
+    if rate not in _filterbanks:
+        def hz_to_mel(hz):
+            return 2595.0 * np.log10(1.0 + hz / 700.0)
+
+        mels = np.linspace(hz_to_mel(20.0), hz_to_mel(rate / 2.0), N_MELS + 2)
+        bins = np.floor((N_FFT + 1) * 700.0 * (10 ** (mels / 2595.0) - 1.0) / rate).astype(int)
+        bank = np.zeros((N_MELS, N_FFT // 2 + 1))
+        for m in range(1, N_MELS + 1):
+            left, center, right = bins[m - 1], bins[m], bins[m + 1]
+            if center > left:
+                bank[m - 1, left:center] = (np.arange(left, center) - left) / (center - left)
+            if right > center:
+                bank[m - 1, center:right] = (right - np.arange(center, right)) / (right - center)
+        # DCT-II basis taking the log mel energies to cepstra
+        n = np.arange(N_MELS)
+        dct = np.cos(np.pi / N_MELS * (n + 0.5)[None, :] * np.arange(N_CEPSTRA)[:, None])
+        _filterbanks[rate] = (bank.T, dct.T)
+    return _filterbanks[rate]
+
+def mfcc(audio, rate=SAMPLE_RATE):
+    """MFCC matrix (frames x N_CEPSTRA) of 16-bit PCM bytes or an int16 array, CMVN-normalized."""
+    samples = np.frombuffer(audio, dtype='<i2') if isinstance(audio, (bytes, bytearray, memoryview)) else audio
+    samples = samples.astype(np.float32)
+    frame = rate * FRAME_MS // 1000
+    hop = rate * HOP_MS // 1000
+    if samples.size < frame:
+        return np.zeros((0, N_CEPSTRA), dtype=np.float32)
+    emphasized = np.append(samples[0], samples[1:] - PRE_EMPHASIS * samples[:-1])
+    frames = np.lib.stride_tricks.sliding_window_view(emphasized, frame)[::hop] * np.hamming(frame)
+    power = np.abs(np.fft.rfft(frames, N_FFT)) ** 2 / N_FFT
+    bank, dct = _mel_filterbank(rate)
+    cepstra = np.log(power @ bank + 1e-6) @ dct
+    # Cepstral mean and variance normalization removes the microphone/channel response
+    # and level, so distances are comparable across speakers and recordings
+    return ((cepstra - cepstra.mean(axis=0)) / (cepstra.std(axis=0) + 1e-6)).astype(np.float32)
+
+def trim_silence(audio, rate=SAMPLE_RATE, floor_db=TRIM_DB):
+    """Cut leading/trailing audio more than floor_db below the loudest 10 ms."""
+    samples = np.frombuffer(audio, dtype='<i2') if isinstance(audio, (bytes, bytearray, memoryview)) else audio
+    hop = rate * HOP_MS // 1000
+    count = samples.size // hop
+    if count == 0:
+        return samples
+    energy = (samples[:count * hop].astype(np.float32).reshape(count, hop) ** 2).mean(axis=1)
+    loud = np.flatnonzero(10 * np.log10(energy + 1e-6) > 10 * np.log10(energy.max() + 1e-6) - floor_db)
+    return samples[loud[0] * hop:(loud[-1] + 1) * hop]
+
+def dtw_distances(templates, lengths, features):
+    """Best subsequence DTW distance of each template within an utterance.
+
+    templates: (T, L, C) zero-padded template features, lengths: (T,) true
+    lengths, features: (N, C). Every path step advances one template frame and
+    0-2 utterance frames, so each row depends only on the previous one and the
+    recursion vectorizes over templates and utterance frames; a template may
+    start and end anywhere in the utterance (leading noise, trailing words).
+    Returns (T,) mean per-frame distances.
+    """
+    count, max_len, _ = templates.shape
+    if features.shape[0] == 0:
+        return np.full(count, np.inf)
+    # Euclidean frame distances via |a|^2 + |b|^2 - 2ab, without a (T, L, N, C) temporary
+    squared = ((templates * templates).sum(axis=2)[:, :, None] + (features * features).sum(axis=1)[None, None, :]
+               - 2.0 * templates @ features.T)
+    cost = np.sqrt(np.maximum(squared, 0.0))
+    best = np.full(count, np.inf)
+    row = cost[:, 0, :]
+    for i in range(max_len):
+        if i:
+            previous = row
+            stay = previous
+            step = np.concatenate([np.full((count, 1), np.inf), previous[:, :-1]], axis=1)
+            skip = np.concatenate([np.full((count, 2), np.inf), previous[:, :-2]], axis=1)
+            row = cost[:, i, :] + np.minimum(np.minimum(stay, step), skip)
+        done = lengths == i + 1
+        if done.any():
+            best[done] = row[done].min(axis=1) / lengths[done]
+    return best
+
+def read_wav(path):
+    with wave.open(path, 'rb') as f:
+        if f.getnchannels() != 1 or f.getsampwidth() != 2:
+            raise ValueError(f"{path}: expected 16-bit mono WAV")
+        return f.readframes(f.getnframes()), f.getframerate()
+
+def label_for(path, root=None):
+    """Phrase label from a test/template path: parent folder under root, else the file name."""
+    relative = os.path.relpath(path, root) if root else os.path.basename(path)
+    parts = relative.split(os.sep)
+    name = parts[0] if len(parts) > 1 else os.path.splitext(parts[-1])[0]
+    words = [w for w in name.replace('-', '_').split('_') if w and not w.isdigit()]
+    return ' '.join(words).lower()
+
+def _wav_files(root):
+    for folder, _, files in sorted(os.walk(root)):
+        for name in sorted(files):
+            if name.lower().endswith('.wav'):
+                yield os.path.join(folder, name)
+
+class KeywordSpotter:
+    """Template bank of enrolled phrases matched with DTW."""
+    def __init__(self, template_dir=TEMPLATE_DIR, threshold=MATCH_THRESHOLD, margin=MARGIN, rate=SAMPLE_RATE):
+        self.threshold = threshold
+        self.margin = margin
+        self.rate = rate
+        self.labels = []
+        self.sources = []
+        self._features = []
+        if template_dir and os.path.isdir(template_dir):
+            for path in _wav_files(template_dir):
+                pcm, rate = read_wav(path)
+                self.add(label_for(path, template_dir), pcm, rate, source=path, pack=False)
+        self._pack()
+
+    def add(self, label, pcm, rate=SAMPLE_RATE, source=None, pack=True):
+        # Templates are trimmed; utterances keep their edges, the DTW start/end is free
+        features = mfcc(trim_silence(pcm, rate), rate)
+        if len(features):
+            self.labels.append(label)
+            self.sources.append(source)
+            self._features.append(features)
+            if pack:
+                self._pack()
+
+    def keep(self, indices):
+        """Restrict the bank to the given template indices."""
+        self.labels = [self.labels[i] for i in indices]
+        self.sources = [self.sources[i] for i in indices]
+        self._features = [self._features[i] for i in indices]
+        self._pack()
+
+    def _pack(self):
+        self.lengths = np.array([len(f) for f in self._features], dtype=int)
+        max_len = int(self.lengths.max()) if len(self.lengths) else 0
+        self.templates = np.zeros((len(self._features), max_len, N_CEPSTRA), dtype=np.float32)
+        for i, features in enumerate(self._features):
+            self.templates[i, :len(features)] = features
+
+    def __len__(self):
+        return len(self.labels)
+
+    def scores(self, pcm, rate=None, exclude=None):
+        """Best distance per phrase for an utterance; exclude drops one template index."""
+        distances = dtw_distances(self.templates, self.lengths, mfcc(pcm, rate or self.rate))
+        if exclude is not None:
+            distances[exclude] = np.inf
+        best = {}
+        for label, distance in zip(self.labels, distances):
+            best[label] = min(best.get(label, np.inf), float(distance))
+        return best
+
+    def spot(self, pcm, rate=None, exclude=None):
+        """Return (phrase or None, distance) for an utterance."""
+        start = time.perf_counter()
+        if not self.labels:
+            return None, float('inf')
+        ranked = sorted(self.scores(pcm, rate, exclude).items(), key=lambda item: item[1])
+        _SPOT_SECONDS.observe(time.perf_counter() - start)
+        label, distance = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else np.inf
+        if distance <= self.threshold and runner_up - distance >= self.margin:
+            _SPOT_MATCH.inc()
+            return label, distance
+        _SPOT_REJECT.inc()
+        return None, distance
+
+class KeywordEngine:
+    """voice_stream engine spotting keywords while the utterance is spoken."""
+    streaming = True
+
+    def __init__(self, rate=SAMPLE_RATE, spotter=None, template_dir=TEMPLATE_DIR):
+        self.spotter = spotter or KeywordSpotter(template_dir, rate=rate)
+        if not len(self.spotter):
+            raise RuntimeError(f"No keyword templates in {template_dir} "
+                               f"(enroll with: python keyword_spotter.py --enroll stop)")
+        self.rate = rate
+        self._audio = bytearray()
+        self._checked = 0
+        self._interval = rate * PARTIAL_INTERVAL_MS // 1000 * 2
+
+    def start(self):
+        self._audio = bytearray()
+        self._checked = 0
+
+    def accept(self, pcm):
+        self._audio += pcm
+        if len(self._audio) - self._checked < self._interval:
+            return ''
+        self._checked = len(self._audio)
+        return self.spotter.spot(bytes(self._audio), self.rate)[0] or ''
+
+    def finish(self):
+        return self.spotter.spot(bytes(self._audio), self.rate)[0] or ''
+
+class TieredEngine:
+    """Local engine first; the (cloud) fallback only hears utterances it could not place."""
+    def __init__(self, first, fallback):
+        self.first = first
+        self.fallback = fallback
+        self.streaming = first.streaming
+
+    def start(self):
+        self.first.start()
+        self.fallback.start()
+
+    def accept(self, pcm):
+        self.fallback.accept(pcm)
+        return self.first.accept(pcm)
+
+    def finish(self):
+        return self.first.finish() or self.fallback.finish()
+
+def enroll(phrase, count=5, template_dir=TEMPLATE_DIR):
+    """Record count examples of a phrase from the microphone as templates."""
+    from voice_stream import MicrophoneStream, EnergyVAD
+
+    folder = os.path.join(template_dir, phrase.replace(' ', '_'))
+    os.makedirs(folder, exist_ok=True)
+    existing = len([n for n in os.listdir(folder) if n.endswith('.wav')])
+    source = MicrophoneStream()
+    vad = EnergyVAD(source.rate, source.chunk_ms)
+    print(f"Say '{phrase}' {count} times, pausing in between.")
+    recorded = 0
+    utterance = bytearray()
+    try:
+        for pcm, _ in source.chunks():
+            event = vad.process(pcm)
+            if event == 'start':
+                utterance = bytearray(vad.take_preroll())
+            elif event in ('speech', 'end'):
+                utterance += pcm
+            if event == 'end':
+                path = os.path.join(folder, f'{existing + recorded + 1:02d}.wav')
+                with wave.open(path, 'wb') as f:
+                    f.setnchannels(1)
+                    f.setsampwidth(2)
+                    f.setframerate(source.rate)
+                    f.writeframes(bytes(utterance))
+                recorded += 1
+                print(f"  saved {path} ({len(utterance) / 2 / source.rate:.2f}s)")
+                if recorded >= count:
+                    break
+    finally:
+        source.stop()
+
+def benchmark(test_dir, template_dir=None):
+    """Accuracy and latency over a labelled WAV test set.
+
+    Without template_dir every test file is classified against all the other
+    test files (leave-one-out), so one recorded set is enough.
+    """
+    matcher = default_matcher()
+    leave_one_out = template_dir is None
+    spotter = KeywordSpotter(test_dir if leave_one_out else template_dir)
+    if leave_one_out:
+        # Negatives never serve as templates
+        spotter.keep([i for i, label in enumerate(spotter.labels) if matcher.command(label)])
+
+    print("=" * 60)
+    print(f"KEYWORD SPOTTING BENCHMARK ({len(spotter)} templates, "
+          f"{'leave-one-out' if leave_one_out else template_dir})")
+    print("=" * 60)
+    correct = wrong = missed = false_accepts = negatives = 0
+    timings, audio_seconds = [], 0.0
+    for path in _wav_files(test_dir):
+        label = label_for(path, test_dir)
+        expected = matcher.command(label)
+        pcm, rate = read_wav(path)
+        exclude = spotter.sources.index(path) if leave_one_out and path in spotter.sources else None
+        start = time.perf_counter()
+        phrase, distance = spotter.spot(pcm, rate, exclude)
+        timings.append(time.perf_counter() - start)
+        audio_seconds += len(pcm) / 2 / rate
+        got = matcher.command(phrase) if phrase else None
+        if expected is None:
+            negatives += 1
+            false_accepts += got is not None
+        elif got == expected:
+            correct += 1
+        elif got is None:
+            missed += 1
+        else:
+            wrong += 1
+        mark = 'ok' if got == expected else f'expected {expected or "-"}'
+        print(f"  {os.path.relpath(path, test_dir):32s} -> {phrase or '-':12s} d={distance:5.2f} {mark}")
+    positives = correct + wrong + missed
+    if not timings:
+        print("No WAV files found.")
+        return
+    p50, p99 = np.percentile(np.array(timings) * 1000, [50, 99])
+    print(f"\nAccuracy: {correct}/{positives} correct, {wrong} wrong, {missed} rejected"
+          + (f" | false accepts {false_accepts}/{negatives}" if negatives else ""))
+    print(f"Latency per utterance: p50 {p50:.2f} ms | p99 {p99:.2f} ms | "
+          f"real-time factor {sum(timings) / audio_seconds:.4f}")
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if '--enroll' in args:
+        count = int(args[args.index('--count') + 1]) if '--count' in args else 5
+        enroll(args[args.index('--enroll') + 1], count)
+    elif '--benchmark' in args:
+        test_dir = args[args.index('--benchmark') + 1]
+        templates = args[args.index('--templates') + 1] if '--templates' in args else None
+        benchmark(test_dir, templates)
+    else:
+        print(__doc__)
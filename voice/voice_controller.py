@@ -1,28 +1,83 @@
 # -*- coding: utf-8 -*-
 """
 voice_controller.py - Natural Language Voice Command Recognition for Smart Car using LangChain
+
+speech_recognition, LangChain and the NumPy-based streaming and keyword
+spotting modules are imported only by the modes that use them, and the LLM
+chain, microphone calibration and serial connection are brought up
+concurrently. --startup-benchmark prints the startup timeline.
 """
-import speech_recognition as sr
-import serial
 import time
+STARTUP_T0 = time.perf_counter()
+
+import json
+import serial
 import sys
 import os
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-from langchain_openai import ChatOpenAI
+import queue
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'serial_bridge'))
+import config
+if __name__ == "__main__":
+    config.load_or_exit()
+import metrics
+from command_arbiter import CommandArbiter
+from llm_guard import GuardedExecutor, LatencyTracker, OK as LLM_OK
+from parse_cache import ParseCache
+from intent_matcher import VOCABULARY, default_matcher
+from intent_classifier import make_backend
+from voice_pipeline import (UtteranceQueue, CommandDispatcher, STAGE_SECONDS,
+                            UTTERANCE_QUEUE_SIZE, RECOGNITION_WORKERS)
+
+IMPORTED_AT = time.perf_counter()
 
 # Configuration defaults
-COM_PORT = 'COM8'
-BAUD_RATE = 9600
+COM_PORT = config.get('serial.port', 'COM8')
+BAUD_RATE = config.get('serial.baud_rate', 9600)
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+# Same default as keyword_spotter.TEMPLATE_DIR; checked here so NumPy is only
+# imported when keyword templates have been enrolled
+KWS_TEMPLATE_DIR = os.getenv('SMARTCAR_KWS_TEMPLATES', os.path.join(os.path.dirname(__file__), 'keywords'))
+
+# Ambient noise calibration: the measured energy threshold is reused across runs
+# until it is older than CALIBRATION_MAX_AGE (--recalibrate forces a new one)
+CALIBRATION_SECONDS = 2
+CALIBRATION_MAX_AGE = 24 * 3600.0
+CALIBRATION_PATH = os.getenv('SMARTCAR_VOICE_CALIBRATION',
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), '.calibration.json'))
+
+# Launch to ready, excluding the Arduino reset wait on the serial link
+STARTUP_TARGET = 0.5
+
+# LLM call guard: hard deadline, concurrent call limit and circuit breaker
+LLM_TIMEOUT = config.get('voice.llm_timeout', 1.5)
+LLM_MAX_CONCURRENT = 1
+LLM_FAILURE_THRESHOLD = 3
+LLM_RESET_TIMEOUT = 30.0
 
-# Supported command dictionary
-COMMANDS = {
-    'W': ['forward', 'go forward', 'drive ahead', 'move forward', 'ahead'],
-    'S': ['reverse', 'move back', 'go backward', 'backward', 'back'],
-    'A': ['left', 'turn left', 'steer left', 'go left'],
-    'D': ['right', 'turn right', 'steer right', 'go right'],
-    'X': ['stop', 'halt', 'brake', 'emergency stop']
+# LLM parse result cache (set SMARTCAR_VOICE_PARSE_CACHE to a file path to persist)
+PARSE_CACHE_SIZE = config.get('voice.parse_cache_size', 256)
+PARSE_CACHE_TTL = 6 * 3600.0
+PARSE_CACHE_PATH = os.getenv('SMARTCAR_VOICE_PARSE_CACHE')
+
+_WRITES = metrics.SERIAL_WRITES.labels(source='voice')
+_WRITE_ERRORS = metrics.SERIAL_WRITE_ERRORS.labels(source='voice')
+_WRITE_SECONDS = metrics.SERIAL_WRITE_SECONDS.labels(source='voice')
+_STAGE_QUEUE = STAGE_SECONDS.labels(stage='queue')
+_STAGE_RECOGNIZE = STAGE_SECONDS.labels(stage='recognize')
+_STAGE_PARSE = STAGE_SECONDS.labels(stage='parse')
+
+# Supported command dictionary (shared with the cloud server via intent_matcher)
+COMMANDS = VOCABULARY
+
+COMMAND_NAMES = {
+    'W': 'FORWARD',
+    'S': 'REVERSE',
+    'A': 'LEFT',
+    'D': 'RIGHT',
+    'X': 'STOP'
 }
 
 def auto_detect_port():
@@ -38,28 +93,150 @@ def auto_detect_port():
         return usb_ports[0].device
     return ports[0].device if ports else None
 
+def load_calibration(path=CALIBRATION_PATH, max_age=CALIBRATION_MAX_AGE):
+    """Cached microphone energy threshold, or None if missing or stale."""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        if time.time() - data['measured_at'] <= max_age:
+            return float(data['energy_threshold'])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+def save_calibration(threshold, path=CALIBRATION_PATH):
+    try:
+        with open(path, 'w') as f:
+            json.dump({'energy_threshold': threshold, 'measured_at': time.time()}, f)
+    except OSError as e:
+        print(f"Could not save microphone calibration: {e}")
+
 class VoiceController:
-    def __init__(self, use_langchain=True):
-        self.use_langchain = use_langchain
-        self.recognizer = sr.Recognizer()
-        self.microphone = sr.Microphone()
-        self.ser = None
+    def __init__(self, use_langchain=True, streaming=False, engine='vosk', model_path=None,
+                 keyword_spotting=True, recalibrate=False, intent_backend='keyword', ser=None,
+                 arbiter=None, source='voice'):
+        init_start = time.perf_counter()
+        self.startup_times = {'imports': (0.0, IMPORTED_AT - STARTUP_T0)}
+        self.use_langchain = use_langchain and bool(OPENAI_API_KEY)
+        self.streaming = streaming
+        self.engine = engine
+        self.model_path = model_path
+        self.recalibrate = recalibrate
+        self.intent_backend = intent_backend
+        self.intent = None
+        # Streaming mode owns the microphone through MicrophoneStream instead;
+        # the blocking listener's microphone is opened during startup()
+        self.recognizer = None
+        if not streaming:
+            import speech_recognition as sr
+            self.recognizer = sr.Recognizer()
+        self.microphone = None
+        self.llm = None
+        self.listener = None
+        self.spotter = None
+        # Offline first tier: enrolled keywords are recognized locally, before any cloud call
+        self.kws = None
+        if keyword_spotting and not streaming and os.path.isdir(KWS_TEMPLATE_DIR) and os.listdir(KWS_TEMPLATE_DIR):
+            from keyword_spotter import KeywordSpotter
+            self.kws = KeywordSpotter(KWS_TEMPLATE_DIR)
+            if not len(self.kws):
+                self.kws = None
+        # An already-open link (e.g. a supervisor port) replaces connect_arduino()
+        self.ser = ser
+        # Stop preempts other sources sharing the arbiter; a move holds a lease until the watchdog stops it.
+        # A shared arbiter (the supervisor's) already has `source` registered.
+        self.source = source
+        self.owns_arbiter = arbiter is None
+        self.arbiter = arbiter or CommandArbiter(self.write_serial, name='voice').register(source, preempt_stop=True)
         self.is_running = False
         self.current_command = 'X'
         self.command_count = 0
+        # Parsing runs on several worker threads; each keeps its own last method
+        self._local = threading.local()
+        self.last_parse_method = None
+        # Listen-while-processing: producer -> recognition workers -> dispatcher
+        self.utterances = UtteranceQueue(UTTERANCE_QUEUE_SIZE)
+        self.dispatcher = CommandDispatcher(self.dispatch)
+        self.workers = []
+        self.producer = None
+        self._stream_onset = None
+        self._stream_seq = 0
+        self.matcher = default_matcher()
+        self.parse_latency = LatencyTracker()
+        self.guard = GuardedExecutor(
+            'voice',
+            max_concurrent=LLM_MAX_CONCURRENT,
+            timeout=LLM_TIMEOUT,
+            failure_threshold=LLM_FAILURE_THRESHOLD,
+            reset_timeout=LLM_RESET_TIMEOUT
+        )
+        self.cache = ParseCache(
+            'voice',
+            max_entries=PARSE_CACHE_SIZE,
+            ttl=PARSE_CACHE_TTL,
+            path=PARSE_CACHE_PATH
+        )
         
-        if use_langchain and OPENAI_API_KEY:
-            self.setup_langchain()
-        else:
+        if not self.use_langchain:
             print("Using simple keyword matching mode (LangChain offline).")
-            self.llm = None
-        
-        self.calibrate_microphone()
+        self._mark('init', init_start)
+    
+    def _mark(self, phase, start):
+        self.startup_times[phase] = (start - STARTUP_T0, time.perf_counter() - STARTUP_T0)
+    
+    def _timed(self, phase, fn):
+        start = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            self._mark(phase, start)
+    
+    def startup(self):
+        """Set up the LLM chain and microphone in the background while the serial link connects."""
+        tasks = [('intent', self.load_intent_backend)]
+        if self.use_langchain:
+            tasks.append(('langchain', self.setup_langchain))
+        if not self.streaming:
+            tasks.append(('microphone', self.calibrate_microphone))
+        threads = [threading.Thread(target=self._timed, args=task, name=f'voice-{task[0]}', daemon=True)
+                   for task in tasks]
+        for thread in threads:
+            thread.start()
+        connected = self._timed('serial', self.connect_arduino)
+        for thread in threads:
+            thread.join()
+        self.startup_times['ready'] = (0.0, time.perf_counter() - STARTUP_T0)
+        return connected
+    
+    def report_startup(self):
+        """Print the startup timeline and compare it against STARTUP_TARGET."""
+        print("\nSTARTUP TIMELINE (ms since launch, interpreter start not included)")
+        for phase, (start, end) in sorted(self.startup_times.items(), key=lambda item: item[1][1]):
+            print(f"  {phase:<11} {start * 1000:7.0f} -> {end * 1000:7.0f}  ({(end - start) * 1000:6.0f} ms)")
+        # The serial link waits for the Arduino to reset; everything else should be ready before it
+        critical = max(end for phase, (start, end) in self.startup_times.items()
+                       if phase not in ('serial', 'ready'))
+        status = 'OK' if critical <= STARTUP_TARGET else 'OVER TARGET'
+        print(f"  Ready without serial settle: {critical * 1000:.0f} ms "
+              f"(target {STARTUP_TARGET * 1000:.0f} ms) {status}")
+        return critical
+    
+    @property
+    def last_parse_method(self):
+        return getattr(self._local, 'parse_method', None)
+    
+    @last_parse_method.setter
+    def last_parse_method(self, method):
+        self._local.parse_method = method
     
     def setup_langchain(self):
         """Configure LangChain with OpenAI LLM model."""
         try:
-            self.llm = ChatOpenAI(
+            from langchain.prompts import PromptTemplate
+            from langchain.chains import LLMChain
+            from langchain_openai import ChatOpenAI
+            
+            llm = ChatOpenAI(
                 model="gpt-3.5-turbo",
                 temperature=0,
                 openai_api_key=OPENAI_API_KEY
@@ -84,7 +261,8 @@ Do not include any explanation.
                 input_variables=["user_input"],
                 template=template
             )
-            self.chain = LLMChain(llm=self.llm, prompt=self.prompt)
+            self.chain = LLMChain(llm=llm, prompt=self.prompt)
+            self.llm = llm
             print("LangChain AI Voice Agent initialized (OpenAI GPT-3.5).")
         
         except Exception as e:
@@ -92,15 +270,33 @@ Do not include any explanation.
             print("Falling back to simple keyword matching mode.")
             self.llm = None
     
+    def load_intent_backend(self):
+        """Build the local intent backend (the 'local' classifier trains here)."""
+        self.intent = make_backend(self.intent_backend)
+        if self.intent.authoritative:
+            print(f"Local intent classifier ready ({self.intent.name}).")
+    
     def calibrate_microphone(self):
-        """Calibrate microphone for ambient background noise."""
+        """Open the microphone and set the energy threshold, from the cache when it is fresh."""
+        import speech_recognition as sr
+        self.microphone = sr.Microphone()
+        threshold = None if self.recalibrate else load_calibration()
+        if threshold is not None:
+            # dynamic_energy_threshold keeps adapting it from here on
+            self.recognizer.energy_threshold = threshold
+            print(f"Microphone energy threshold {threshold:.0f} (cached calibration).")
+            return
         print("Calibrating microphone for ambient noise...")
         with self.microphone as source:
-            self.recognizer.adjust_for_ambient_noise(source, duration=2)
+            self.recognizer.adjust_for_ambient_noise(source, duration=CALIBRATION_SECONDS)
+        save_calibration(self.recognizer.energy_threshold)
         print("Microphone calibration complete.")
     
     def connect_arduino(self):
         """Establish serial connection to Arduino microcontroller."""
+        if self.ser is not None:
+            self.is_running = True
+            return True
         try:
             port = COM_PORT if COM_PORT else auto_detect_port()
             if not port:
@@ -129,19 +325,37 @@ Do not include any explanation.
     
     def listen(self):
         """Capture microphone input and transcribe speech to text."""
+        return self.recognize(self.capture())
+    
+    def capture(self):
+        """Block until one utterance has been recorded from the microphone."""
+        import speech_recognition as sr
         try:
             with self.microphone as source:
                 print("\nListening for voice command...")
-                audio = self.recognizer.listen(source, timeout=5, phrase_time_limit=3)
+                return self.recognizer.listen(source, timeout=5, phrase_time_limit=3)
+        except sr.WaitTimeoutError:
+            print("Listening timeout - no audio detected.")
+            return None
+    
+    def recognize(self, audio):
+        """Transcribe captured audio: offline keyword spotter first, then Google."""
+        if audio is None:
+            return None
+        import speech_recognition as sr
+        try:
+            if self.kws:
+                rate = self.kws.rate
+                phrase, distance = self.kws.spot(audio.get_raw_data(convert_rate=rate, convert_width=2), rate)
+                if phrase:
+                    print(f"Keyword spotted offline: '{phrase}' (distance {distance:.2f})")
+                    return phrase
             
             print("Processing voice audio...")
             text = self.recognizer.recognize_google(audio)
             print(f"Transcribed audio text: '{text}'")
             return text.lower()
         
-        except sr.WaitTimeoutError:
-            print("Listening timeout - no audio detected.")
-            return None
         except sr.UnknownValueError:
             print("Speech recognition could not understand audio.")
             return None
@@ -150,35 +364,54 @@ Do not include any explanation.
             return None
     
     def parse_command_simple(self, text):
-        """Parse command using keyword matching."""
+        """Parse command with the local intent backend (keyword matcher or classifier)."""
+        self.last_parse_method = self.intent.name
         if not text:
             return None
-        
-        text_lower = text.lower()
-        for cmd, keywords in COMMANDS.items():
-            for keyword in keywords:
-                if keyword in text_lower:
-                    return cmd
-        return None
+        result = self.intent.classify(text)
+        return result.command if result else None
     
     def parse_command_langchain(self, text):
         """Parse command using LangChain LLM intent classification."""
         if not text or not self.llm:
             return self.parse_command_simple(text)
         
-        try:
-            result = self.chain.run(user_input=text)
-            cmd = result.strip().upper()[0]
-            
-            if cmd in ['W', 'S', 'A', 'D', 'X']:
-                return cmd
-            else:
-                print(f"Invalid LLM response: {result}")
-                return self.parse_command_simple(text)
+        # Stop, and exact vocabulary phrases such as spotted keywords, never wait on the model
+        match = self.matcher.match(text)
+        if match and (match.command == 'X' or match.phrase == ' '.join(text.lower().split())):
+            self.last_parse_method = 'keyword'
+            return match.command
         
-        except Exception as e:
-            print(f"LangChain processing error: {e}")
-            return self.parse_command_simple(text)
+        # A confident local classifier answer is final; only what it abstains on reaches the LLM
+        if self.intent.authoritative:
+            result = self.intent.classify(text)
+            if result:
+                self.last_parse_method = self.intent.name
+                return result.command
+        
+        cached = self.cache.get(text)
+        if cached:
+            self.last_parse_method = 'cache'
+            return cached
+        
+        outcome, result = self.guard.call(self.chain.run, user_input=text)
+        if outcome != LLM_OK:
+            detail = f": {result}" if result else ""
+            print(f"LangChain unavailable ({outcome}{detail}), using keyword match")
+            command = self.parse_command_simple(text)
+            self.last_parse_method = 'keyword_fallback'
+            return command
+        
+        cmd = result.strip().upper()[:1]
+        if cmd in ['W', 'S', 'A', 'D', 'X']:
+            self.last_parse_method = 'langchain'
+            self.cache.put(text, cmd)
+            return cmd
+        
+        print(f"Invalid LLM response: {result}")
+        command = self.parse_command_simple(text)
+        self.last_parse_method = 'keyword_fallback'
+        return command
     
     def send_command(self, command):
         """Transmit command character to Arduino over serial link."""
@@ -186,61 +419,64 @@ Do not include any explanation.
             return False
         
         try:
+            start = time.perf_counter()
             self.ser.write(command.encode())
+            _WRITE_SECONDS.observe(time.perf_counter() - start)
+            _WRITES.inc()
             self.current_command = command
             self.command_count += 1
             return True
         except Exception as e:
+            _WRITE_ERRORS.inc()
             print(f"Serial transmission error: {e}")
             return False
     
-    def run(self):
+    def write_serial(self, data, source):
+        """Arbiter callback for commands and watchdog stops."""
+        self.send_command(data.decode())
+    
+    def run(self, startup_benchmark=False):
         """Main event loop for voice command controller."""
         print("\n" + "=" * 60)
         print("SMART CAR AI VOICE CONTROL SERVICE")
         print("=" * 60)
+        
+        connected = self.startup()
+        if startup_benchmark:
+            self.report_startup()
+            self.cleanup()
+            return
+        
         print(f"Mode: {'LangChain + OpenAI' if self.llm else 'Keyword Matcher'}")
+        print(f"Recognition: {f'streaming ({self.engine})' if self.streaming else 'blocking listen + Google'}")
+        if self.kws and not self.streaming:
+            print(f"Offline keyword spotting: {len(self.kws)} templates ({', '.join(sorted(set(self.kws.labels)))})")
         print(f"Commands: FORWARD | REVERSE | LEFT | RIGHT | STOP")
         print("=" * 60)
         print()
         
-        if not self.connect_arduino():
+        if not connected:
             print("\nRunning in simulation mode (no serial hardware).")
-            input("Press Enter to begin...")
+            if sys.stdin.isatty():
+                input("Press Enter to begin...")
             self.is_running = True
         
         print("\nVoice control ready. Speak commands into your microphone.")
         print("Press Ctrl+C to terminate.\n")
         
         try:
-            while self.is_running:
-                text = self.listen()
-                
-                if text:
-                    if self.llm:
-                        command = self.parse_command_langchain(text)
-                    else:
-                        command = self.parse_command_simple(text)
-                    
-                    if command:
-                        cmd_names = {
-                            'W': 'FORWARD',
-                            'S': 'REVERSE',
-                            'A': 'LEFT',
-                            'D': 'RIGHT',
-                            'X': 'STOP'
-                        }
-                        print(f"Action: {cmd_names[command]} ({command})")
-                        
-                        if self.ser:
-                            self.send_command(command)
-                            print(f"Sent command #{self.command_count}")
-                        else:
-                            print(f"Simulation Mode: {cmd_names[command]}")
-                    else:
-                        print("Unrecognized command -> Executing STOP")
-                        if self.ser:
-                            self.send_command('X')
+            if self.owns_arbiter:
+                self.arbiter.start()
+            self.start_pipeline()
+            if self.streaming:
+                self.run_streaming()
+            else:
+                self.producer = threading.Thread(target=self.capture_loop, name='voice-capture', daemon=True)
+                self.producer.start()
+            
+            while self.is_running and (self.streaming and self.listener.running or
+                                       not self.streaming and self.producer.is_alive()):
+                time.sleep(0.2)
         
         except KeyboardInterrupt:
             print("\nTerminating voice control service...")
@@ -248,8 +484,110 @@ Do not include any explanation.
         finally:
             self.cleanup()
     
+    def start_pipeline(self):
+        """Start the dispatcher and the recognition worker pool."""
+        self.dispatcher.start()
+        for index in range(RECOGNITION_WORKERS):
+            worker = threading.Thread(target=self.recognition_worker, name=f'voice-worker-{index}', daemon=True)
+            worker.start()
+            self.workers.append(worker)
+    
+    def capture_loop(self):
+        """Producer: keep recording utterances while earlier ones are still being processed."""
+        while self.is_running:
+            audio = self.capture()
+            if audio is not None and self.is_running:
+                self.utterances.put(audio=audio)
+    
+    def recognition_worker(self):
+        """Worker: transcribe queued audio (or take a streaming final) and parse it."""
+        while self.is_running:
+            try:
+                utterance = self.utterances.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            _STAGE_QUEUE.observe(time.monotonic() - utterance.captured_at)
+            text = utterance.text
+            if text is None:
+                start = time.perf_counter()
+                text = self.recognize(utterance.audio)
+                _STAGE_RECOGNIZE.observe(time.perf_counter() - start)
+            if text:
+                self.handle_text(text, utterance.seq, utterance.captured_at)
+    
+    def handle_text(self, text, seq, captured_at=None):
+        """Parse a complete transcript and hand the resulting command to the dispatcher."""
+        start = time.perf_counter()
+        if self.llm:
+            command = self.parse_command_langchain(text)
+        else:
+            command = self.parse_command_simple(text)
+        elapsed = time.perf_counter() - start
+        method = self.last_parse_method
+        self.parse_latency.record(method, elapsed)
+        metrics.LLM_PARSE_SECONDS.labels('voice', method).observe(elapsed)
+        metrics.LLM_PARSE_CALLS.labels('voice', method).inc()
+        _STAGE_PARSE.observe(elapsed)
+        
+        if not command:
+            print("Unrecognized command -> Executing STOP")
+            command = 'X'
+        if not self.dispatcher.submit(seq, command, captured_at, text):
+            print(f"Dropped stale command from '{text}' (a newer utterance was already acted on)")
+    
+    def dispatch(self, command, text):
+        """Dispatcher thread: the only place that writes to the serial link."""
+        self.execute(command)
+    
+    def execute(self, command):
+        """Send a parsed command to the car (or report it in simulation mode)."""
+        print(f"Action: {COMMAND_NAMES[command]} ({command})")
+        if self.ser:
+            if self.arbiter.submit(self.source, command) and not self.owns_arbiter:
+                # A shared arbiter writes through its owner, so track the command here
+                self.current_command = command
+                self.command_count += 1
+            print(f"Sent command #{self.command_count}")
+        else:
+            print(f"Simulation Mode: {COMMAND_NAMES[command]}")
+    
+    def on_transcript(self, text, final, info):
+        """StreamingListener callback: fire keyword commands on partials, parse the rest on finals."""
+        if info['onset'] != self._stream_onset:
+            self._stream_onset = info['onset']
+            self._stream_seq = self.utterances.next_seq()
+        command = self.spotter.update(text, final)
+        fired = self.spotter.fired
+        if final:
+            self.spotter.reset()
+        if command:
+            heard_ms = (time.monotonic() - info['onset']) * 1000
+            print(f"Heard '{text}'{'' if final else ' (partial)'} {heard_ms:.0f} ms after speech onset")
+            self.dispatcher.submit(self._stream_seq, command, info['onset'], text)
+        elif final and text and fired is None:
+            print(f"Transcribed audio text: '{text}'")
+            self.utterances.put(text=text, seq=self._stream_seq)
+    
+    def run_streaming(self):
+        """Keep the microphone open and recognize incrementally until stopped."""
+        from voice_stream import StreamingListener, MicrophoneStream, CommandSpotter, make_engine, VOSK_MODEL_PATH
+        self.spotter = CommandSpotter()
+        engine = make_engine(self.engine, model_path=self.model_path or VOSK_MODEL_PATH)
+        self.listener = StreamingListener(MicrophoneStream(), engine, self.on_transcript)
+        self.listener.start()
+        print(f"Streaming recognition active ({self.engine}, "
+              f"{'partial results' if engine.streaming else 'per utterance'}).")
+    
     def cleanup(self):
         """Release resources on termination."""
+        self.is_running = False
+        if self.listener:
+            self.listener.stop()
+        self.dispatcher.stop()
+        for worker in self.workers:
+            worker.join(timeout=1.0)
+        if self.owns_arbiter:
+            self.arbiter.stop()
         if self.ser and self.ser.is_open:
             print("Transmitting stop command...")
             self.ser.write(b'X')
@@ -257,7 +595,22 @@ Do not include any explanation.
             self.ser.close()
             print("Serial connection closed.")
         
+        self.guard.shutdown()
+        self.cache.save()
+        if self.microphone is not None and self.producer is not None:
+            # Keep the threshold the recognizer adapted to during the session
+            save_calibration(self.recognizer.energy_threshold)
+        
         print(f"\nTotal commands dispatched: {self.command_count}")
+        print(f"  Pipeline: {self.utterances.dropped} utterances dropped (queue full), "
+              f"{self.dispatcher.stale} stale and {self.dispatcher.superseded} superseded commands")
+        for method, stats in self.parse_latency.percentiles().items():
+            print(f"  Parse latency [{method}]: n={stats['count']} "
+                  f"p50={stats['p50_ms']}ms p90={stats['p90_ms']}ms p99={stats['p99_ms']}ms")
+        if self.llm:
+            cache_stats = self.cache.stats()
+            print(f"  Parse cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+                  f"(hit rate {cache_stats['hit_rate']:.0%})")
         print("Service stopped cleanly.")
 
 def main():
@@ -268,6 +621,21 @@ def main():
                        help='Use simple keyword matching without OpenAI API')
     parser.add_argument('--demo', action='store_true',
                        help='Run in demonstration mode without serial hardware')
+    parser.add_argument('--stream', action='store_true',
+                       help='Continuous capture with VAD endpointing and incremental recognition')
+    parser.add_argument('--engine', choices=['vosk', 'google', 'kws', 'kws+google'], default='vosk',
+                       help='Speech engine for --stream (vosk and kws run offline)')
+    parser.add_argument('--no-kws', action='store_true',
+                       help='Skip the offline keyword spotter before Google recognition')
+    parser.add_argument('--vosk-model',
+                       help='Vosk model directory (default: $SMARTCAR_VOSK_MODEL)')
+    parser.add_argument('--intent', choices=['keyword', 'local'], default='keyword',
+                       help='Local intent backend: vocabulary matcher or the trained classifier')
+    parser.add_argument('--recalibrate', action='store_true',
+                       help='Measure ambient noise again instead of reusing the cached threshold')
+    parser.add_argument('--startup-benchmark', action='store_true',
+                       help='Print the startup timeline once ready, then exit')
+    config.add_arguments(parser)
     
     args = parser.parse_args()
     
@@ -278,8 +646,11 @@ def main():
         print("Defaulting to simple keyword matching mode...\n")
         use_langchain = False
     
-    controller = VoiceController(use_langchain=use_langchain)
-    controller.run()
+    controller = VoiceController(use_langchain=use_langchain, streaming=args.stream,
+                                 engine=args.engine, model_path=args.vosk_model,
+                                 keyword_spotting=not args.no_kws, recalibrate=args.recalibrate,
+                                 intent_backend=args.intent)
+    controller.run(startup_benchmark=args.startup_benchmark)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+voice_pipeline.py - Listen-While-Processing Voice Pipeline
+Splits the voice loop into three stages joined by queues, so the microphone
+keeps being read while an utterance is recognized, parsed by the LLM or
+written to the serial link:
+
+  producer    captures utterances (blocking listen or the streaming listener)
+  workers     recognize and parse utterances in parallel
+  dispatcher  single owner of the serial link
+
+Every utterance is numbered when captured and the dispatcher only moves
+forward in that order: a command from an older utterance that finishes after
+a newer one is dropped, and a pending command is replaced by a newer one
+before it is sent (latest command wins). Stop preempts: it is sent ahead of
+any pending command and invalidates every older utterance still in flight.
+
+Run this module to compare the sequential loop with the pipeline on a
+simulated talker and a slow LLM.
+"""
+import collections
+import itertools
+import os
+import queue
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+import config
+if __name__ == "__main__":
+    config.load_or_exit()
+import metrics
+from intent_matcher import STOP_COMMAND
+
+UTTERANCE_QUEUE_SIZE = config.get('voice.utterance_queue_size', 4)
+RECOGNITION_WORKERS = config.get('voice.recognition_workers', 2)
+
+STAGE_SECONDS = metrics.histogram(
+    'smartcar_voice_stage_seconds', 'Voice pipeline stage latency', ['stage'])
+DROPPED = metrics.counter(
+    'smartcar_voice_dropped_total', 'Utterances or commands dropped by the voice pipeline', ['reason'])
+_STAGE_DISPATCH = STAGE_SECONDS.labels(stage='dispatch')
+_STAGE_END_TO_END = STAGE_SECONDS.labels(stage='end_to_end')
+_DROPPED_QUEUE = DROPPED.labels(reason='queue_full')
+_DROPPED_STALE = DROPPED.labels(reason='stale')
+_DROPPED_SUPERSEDED = DROPPED.labels(reason='superseded')
+
+Utterance = collections.namedtuple('Utterance', ['seq', 'captured_at', 'audio', 'text'])
+
+class UtteranceQueue:
+    """Bounded FIFO between producer and workers; drops the oldest utterance when full."""
+    def __init__(self, maxsize=UTTERANCE_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._seq = itertools.count(1)
+        self.dropped = 0
+
+    def next_seq(self):
+        return next(self._seq)
+
+    def put(self, audio=None, text=None, seq=None, captured_at=None):
+        utterance = Utterance(seq or self.next_seq(), captured_at or time.monotonic(), audio, text)
+        while True:
+            try:
+                self._queue.put_nowait(utterance)
+                return utterance
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                    _DROPPED_QUEUE.inc()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """Next utterance; raises queue.Empty after timeout."""
+        return self._queue.get(timeout=timeout)
+
+    def qsize(self):
+        return self._queue.qsize()
+
+class CommandDispatcher:
+    """Sends commands in utterance order from one thread: newest wins, stop first.
+
+    send(command, label) performs the actual write and runs on the dispatcher
+    thread only, so the serial port has a single owner.
+    """
+    def __init__(self, send):
+        self.send = send
+        self.running = False
+        self.dispatched = 0
+        self.stale = 0
+        self.superseded = 0
+        self._cond = threading.Condition()
+        self._pending = None
+        self._stop_pending = None
+        self._last_seq = 0
+        self._stop_seq = 0
+        self._thread = None
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name='voice-dispatcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2.0)
+
+    def submit(self, seq, command, captured_at=None, label=''):
+        """Queue the command parsed from utterance seq. Returns False if it was dropped."""
+        item = (seq, command, captured_at or time.monotonic(), time.monotonic(), label)
+        with self._cond:
+            if command == STOP_COMMAND:
+                # Stop is never dropped, and cancels older moves that have not gone out yet
+                self._stop_seq = max(self._stop_seq, seq)
+                if self._pending and self._pending[0] <= seq:
+                    self._supersede()
+                self._stop_pending = item
+                self._cond.notify_all()
+                return True
+            if seq < max(self._last_seq, self._stop_seq) or (self._pending and self._pending[0] > seq):
+                self.stale += 1
+                _DROPPED_STALE.inc()
+                return False
+            if self._pending:
+                self._supersede()
+            self._pending = item
+            self._cond.notify_all()
+            return True
+
+    def _supersede(self):
+        self._pending = None
+        self.superseded += 1
+        _DROPPED_SUPERSEDED.inc()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._stop_pending or self._pending or not self.running)
+                if not self.running:
+                    return
+                if self._stop_pending:
+                    item, self._stop_pending = self._stop_pending, None
+                else:
+                    item, self._pending = self._pending, None
+                self._last_seq = max(self._last_seq, item[0])
+            seq, command, captured_at, submitted_at, label = item
+            _STAGE_DISPATCH.observe(time.monotonic() - submitted_at)
+            self.send(command, label)
+            self.dispatched += 1
+            _STAGE_END_TO_END.observe(time.monotonic() - captured_at)
+
+    def as_dict(self):
+        return {'dispatched': self.dispatched, 'stale': self.stale, 'superseded': self.superseded}
+
+def simulate(utterances=12, gap=0.6, speech=0.4, parse_seconds=1.2):
+    """Sequential loop vs pipeline for a talker issuing commands faster than the LLM answers."""
+    script = [('forward', 'W'), ('left', 'A'), ('right', 'D')] * (utterances // 3)
+    script[-2] = ('stop', STOP_COMMAND)
+    spoken_at = [i * (speech + gap) for i in range(len(script))]
+
+    def parse(text):
+        if text != 'stop':
+            time.sleep(parse_seconds)
+        return dict(script)[text]
+
+    print("=" * 60)
+    print(f"VOICE PIPELINE SIMULATION ({len(script)} utterances every {speech + gap:.1f}s, "
+          f"LLM parse {parse_seconds:.1f}s)")
+    print("=" * 60)
+
+    # Sequential: an utterance is only heard if the loop was listening when it started
+    sent, heard_until = [], 0.0
+    for text, spoken in zip([t for t, _ in script], spoken_at):
+        if spoken < heard_until:
+            continue
+        heard = spoken + speech
+        heard_until = heard + parse_seconds * (text != 'stop')
+        sent.append((text, heard_until - heard))
+    lost = len(script) - len(sent)
+    latency = sorted(l for _, l in sent)
+    print(f"  sequential: {len(sent):2d} executed, {lost:2d} utterances lost, "
+          f"stop {'executed' if any(t == 'stop' for t, _ in sent) else 'LOST'}, "
+          f"median speech-end->serial {latency[len(latency) // 2] * 1000:6.0f} ms")
+
+    utterance_queue = UtteranceQueue()
+    results = []
+    dispatcher = CommandDispatcher(lambda command, label: results.append((command, time.monotonic())))
+    dispatcher.start()
+    running = threading.Event()
+    running.set()
+
+    def worker():
+        while running.is_set():
+            try:
+                utterance = utterance_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            dispatcher.submit(utterance.seq, parse(utterance.text), utterance.captured_at, utterance.text)
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(RECOGNITION_WORKERS)]
+    for thread in workers:
+        thread.start()
+    start = time.monotonic()
+    stop_heard = None
+    for (text, _), spoken in zip(script, spoken_at):
+        time.sleep(max(0.0, start + spoken + speech - time.monotonic()))
+        utterance = utterance_queue.put(text=text)
+        if text == 'stop':
+            stop_heard = utterance.captured_at
+    time.sleep(parse_seconds + 0.2)
+    running.clear()
+    dispatcher.stop()
+    stop_latency = next((t - stop_heard for c, t in results if c == STOP_COMMAND), None)
+    stop_text = f"stop after {stop_latency * 1000:.1f} ms" if stop_latency is not None else "stop LOST"
+    print(f"  pipeline:   {len(results):2d} executed, {utterance_queue.dropped:2d} utterances dropped, "
+          f"{dispatcher.stale} stale, {dispatcher.superseded} superseded, {stop_text}")
+    print(f"  last command sent: {results[-1][0] if results else '-'} (spoken last: {script[-1][1]})")
+
+if __name__ == "__main__":
+    simulate()
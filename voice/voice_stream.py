@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+"""
+voice_stream.py - Streaming Voice Capture, VAD Endpointing and Incremental Recognition
+Replaces the blocking listen()/recognize round trip: a capture thread keeps
+the microphone open, an energy (or WebRTC) voice activity detector cuts
+utterances out of the stream, and the recognizer is fed while the user is
+still talking. With a streaming engine (Vosk, offline) keyword commands fire
+on partial hypotheses, so "stop" reaches the serial link about as soon as
+the word has been said instead of after the phrase time limit plus a cloud
+round trip.
+
+Engines:
+  vosk        offline, incremental partial results, grammar limited to the
+              command vocabulary (pip install vosk + a model directory)
+  google      speech_recognition's recognize_google on each endpointed utterance
+  kws         offline MFCC/DTW keyword spotter over enrolled templates
+              (keyword_spotter.py), spotting while the utterance is spoken
+  kws+google  keyword spotter first, Google only for utterances it rejects
+
+Run with --benchmark over recorded 16-bit mono WAV files to measure
+speech-to-serial latency through a fake serial link. Name files after the
+command spoken (stop_01.wav, turn_left.wav) to also score accuracy.
+"""
+import collections
+import importlib.util
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import wave
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+import metrics
+from intent_matcher import VOCABULARY, STOP_COMMAND, default_matcher
+
+try:
+    import pyaudio
+    PYAUDIO_AVAILABLE = True
+except ImportError:
+    PYAUDIO_AVAILABLE = False
+
+try:
+    import webrtcvad
+    WEBRTCVAD_AVAILABLE = True
+except ImportError:
+    WEBRTCVAD_AVAILABLE = False
+
+# Vosk is imported when the first VoskEngine is built; it adds ~0.1 s to startup
+VOSK_AVAILABLE = importlib.util.find_spec('vosk') is not None
+
+SAMPLE_RATE = 16000
+CHUNK_MS = 20
+
+# Endpointing: voiced audio needed to open an utterance, silence that closes
+# it, audio kept from before the onset so the first phoneme is not clipped
+START_MS = 60
+HANGOVER_MS = 300
+PREROLL_MS = 200
+MAX_UTTERANCE_S = 4.0
+# Speech threshold relative to the adaptive noise floor, and its absolute minimum
+ENERGY_RATIO = 3.0
+MIN_RMS = 300.0
+NOISE_ADAPT = 0.05
+
+VOSK_MODEL_PATH = os.getenv('SMARTCAR_VOSK_MODEL', 'vosk-model-small-en-us-0.15')
+
+_UTTERANCES = metrics.counter(
+    'smartcar_voice_utterances_total', 'Utterances cut from the microphone stream by the VAD')
+_PARTIALS = metrics.counter(
+    'smartcar_voice_partial_results_total', 'Partial recognition hypotheses received')
+_FINALIZE_SECONDS = metrics.histogram(
+    'smartcar_voice_finalize_seconds', 'Time from endpoint to final recognition result')
+_OVERRUNS = metrics.counter(
+    'smartcar_voice_capture_overruns_total', 'Microphone chunks dropped because the recognizer fell behind')
+
+class MicrophoneStream:
+    """Background microphone capture yielding (pcm bytes, capture time) chunks."""
+    def __init__(self, rate=SAMPLE_RATE, chunk_ms=CHUNK_MS, device_index=None, max_chunks=250):
+        if not PYAUDIO_AVAILABLE:
+            raise RuntimeError("Streaming voice capture needs PyAudio: pip install pyaudio")
+        self.rate = rate
+        self.chunk_ms = chunk_ms
+        self.device_index = device_index
+        self.running = False
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._audio = None
+        self._stream = None
+
+    def _callback(self, data, frame_count, time_info, status):
+        try:
+            self._queue.put_nowait((data, time.monotonic()))
+        except queue.Full:
+            # Keep the newest audio; stale speech is worse than a gap
+            _OVERRUNS.inc()
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._queue.put_nowait((data, time.monotonic()))
+        return (None, pyaudio.paContinue)
+
+    def start(self):
+        self._audio = pyaudio.PyAudio()
+        self._stream = self._audio.open(
+            format=pyaudio.paInt16, channels=1, rate=self.rate, input=True,
+            frames_per_buffer=self.rate * self.chunk_ms // 1000,
+            input_device_index=self.device_index, stream_callback=self._callback)
+        self.running = True
+        self._stream.start_stream()
+        return self
+
+    def chunks(self):
+        if not self.running:
+            self.start()
+        while self.running:
+            try:
+                yield self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+    def stop(self):
+        self.running = False
+        if self._stream:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+        if self._audio:
+            self._audio.terminate()
+            self._audio = None
+
+class WavStream:
+    """Plays a 16-bit mono WAV file as microphone chunks.
+
+    With realtime=True chunks are released at the pace they would be captured,
+    so latencies measured against the returned timestamps match a live mic.
+    Trailing silence is appended so the last utterance is endpointed.
+    """
+    def __init__(self, path, chunk_ms=CHUNK_MS, realtime=True, tail_ms=HANGOVER_MS + 200):
+        with wave.open(path, 'rb') as f:
+            if f.getnchannels() != 1 or f.getsampwidth() != 2:
+                raise ValueError(f"{path}: expected 16-bit mono WAV")
+            self.rate = f.getframerate()
+            self.pcm = f.readframes(f.getnframes())
+        self.path = path
+        self.chunk_ms = chunk_ms
+        self.realtime = realtime
+        self.pcm += b'\x00\x00' * (self.rate * tail_ms // 1000)
+        self.running = False
+        self.origin = None
+
+    @property
+    def duration(self):
+        return len(self.pcm) / 2 / self.rate
+
+    def chunks(self):
+        step = self.rate * self.chunk_ms // 1000 * 2
+        self.running = True
+        self.origin = time.monotonic()
+        for i, offset in enumerate(range(0, len(self.pcm), step)):
+            if not self.running:
+                return
+            # A chunk exists once its last sample has been "captured"
+            due = self.origin + (i + 1) * self.chunk_ms / 1000.0
+            if self.realtime:
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            yield self.pcm[offset:offset + step], due
+
+    def stop(self):
+        self.running = False
+
+class EnergyVAD:
+    """Chunk-level voice activity detector with onset/hangover endpointing.
+
+    Uses WebRTC VAD for the voiced decision when installed, otherwise RMS
+    energy against a noise floor that adapts while nobody is speaking.
+    """
+    def __init__(self, rate=SAMPLE_RATE, chunk_ms=CHUNK_MS, start_ms=START_MS, hangover_ms=HANGOVER_MS,
+                 preroll_ms=PREROLL_MS, energy_ratio=ENERGY_RATIO, min_rms=MIN_RMS, aggressiveness=2):
+        self.rate = rate
+        self.chunk_s = chunk_ms / 1000.0
+        self.start_chunks = max(1, start_ms // chunk_ms)
+        self.hangover_chunks = max(1, hangover_ms // chunk_ms)
+        self.energy_ratio = energy_ratio
+        self.min_rms = min_rms
+        self.noise_rms = None
+        self.rms = 0.0
+        self.in_speech = False
+        self._preroll = collections.deque(maxlen=max(self.start_chunks, preroll_ms // chunk_ms))
+        self._voiced_run = 0
+        self._silent_run = 0
+        self._webrtc = None
+        if WEBRTCVAD_AVAILABLE and chunk_ms in (10, 20, 30) and rate in (8000, 16000, 32000, 48000):
+            self._webrtc = webrtcvad.Vad(aggressiveness)
+
+    @property
+    def threshold(self):
+        return max(self.min_rms, (self.noise_rms or 0.0) * self.energy_ratio)
+
+    def is_voiced(self, pcm):
+        samples = np.frombuffer(pcm, dtype='<i2').astype(np.float32)
+        self.rms = float(np.sqrt(np.mean(samples * samples))) if samples.size else 0.0
+        if self.noise_rms is None:
+            self.noise_rms = self.rms
+        if self._webrtc and len(pcm) == int(self.rate * self.chunk_s) * 2:
+            voiced = self.rms > self.min_rms and self._webrtc.is_speech(pcm, self.rate)
+        else:
+            voiced = self.rms > self.threshold
+        if not voiced and not self.in_speech:
+            self.noise_rms += NOISE_ADAPT * (self.rms - self.noise_rms)
+        return voiced
+
+    def process(self, pcm):
+        """Classify one chunk: 'silence', 'start', 'speech' or 'end'."""
+        voiced = self.is_voiced(pcm)
+        if not self.in_speech:
+            self._preroll.append(pcm)
+            self._voiced_run = self._voiced_run + 1 if voiced else 0
+            if self._voiced_run >= self.start_chunks:
+                self.in_speech = True
+                self._silent_run = 0
+                return 'start'
+            return 'silence'
+        self._silent_run = 0 if voiced else self._silent_run + 1
+        if self._silent_run >= self.hangover_chunks:
+            self.reset()
+            return 'end'
+        return 'speech'
+
+    def take_preroll(self):
+        """Audio buffered up to and including the onset chunk."""
+        data = b''.join(self._preroll)
+        self._preroll.clear()
+        return data
+
+    def reset(self):
+        self.in_speech = False
+        self._voiced_run = 0
+        self._silent_run = 0
+        self._preroll.clear()
+
+class VoskEngine:
+    """Offline incremental recognizer restricted to the command vocabulary."""
+    streaming = True
+    _models = {}
+
+    def __init__(self, rate=SAMPLE_RATE, model_path=VOSK_MODEL_PATH, vocabulary=VOCABULARY):
+        if not VOSK_AVAILABLE:
+            raise RuntimeError("Offline recognition needs Vosk: pip install vosk")
+        if not os.path.isdir(model_path):
+            raise RuntimeError(f"Vosk model not found at {model_path} (set SMARTCAR_VOSK_MODEL)")
+        import vosk
+        vosk.SetLogLevel(-1)
+        if model_path not in VoskEngine._models:
+            VoskEngine._models[model_path] = vosk.Model(model_path)
+        words = sorted({word for phrases in vocabulary.values() for phrase in phrases
+                        for word in phrase.lower().split()})
+        # A closed grammar decodes faster and cannot drift into look-alike words
+        self._recognizer = vosk.KaldiRecognizer(VoskEngine._models[model_path], rate,
+                                                json.dumps(words + ['[unk]']))
+        self._text = []
+
+    def start(self):
+        self._recognizer.Reset()
+        self._text = []
+
+    def accept(self, pcm):
+        """Feed audio; return the transcript so far."""
+        if self._recognizer.AcceptWaveform(pcm):
+            self._text.append(json.loads(self._recognizer.Result()).get('text', ''))
+            partial = ''
+        else:
+            partial = json.loads(self._recognizer.PartialResult()).get('partial', '')
+        return ' '.join(t for t in self._text + [partial] if t).replace('[unk]', '').strip()
+
+    def finish(self):
+        self._text.append(json.loads(self._recognizer.FinalResult()).get('text', ''))
+        return ' '.join(t for t in self._text if t).replace('[unk]', '').strip()
+
+class SpeechRecognitionEngine:
+    """Whole-utterance recognition through speech_recognition (Google Web Speech)."""
+    streaming = False
+
+    def __init__(self, rate=SAMPLE_RATE):
+        import speech_recognition as sr
+        self._sr = sr
+        self._recognizer = sr.Recognizer()
+        self.rate = rate
+        self._audio = bytearray()
+
+    def start(self):
+        self._audio = bytearray()
+
+    def accept(self, pcm):
+        self._audio += pcm
+        return ''
+
+    def finish(self):
+        audio = self._sr.AudioData(bytes(self._audio), self.rate, 2)
+        try:
+            return self._recognizer.recognize_google(audio).lower()
+        except (self._sr.UnknownValueError, self._sr.RequestError):
+            return ''
+
+def make_engine(name, rate=SAMPLE_RATE, model_path=VOSK_MODEL_PATH):
+    if name == 'vosk':
+        return VoskEngine(rate, model_path)
+    if name == 'google':
+        return SpeechRecognitionEngine(rate)
+    if name in ('kws', 'kws+google'):
+        from keyword_spotter import KeywordEngine, TieredEngine
+        engine = KeywordEngine(rate)
+        return engine if name == 'kws' else TieredEngine(engine, SpeechRecognitionEngine(rate))
+    raise ValueError(f"Unknown speech engine '{name}'")
+
+class CommandSpotter:
+    """Turns a growing transcript into commands as soon as they are unambiguous.
+
+    Stop fires on the first partial that contains it. Other phrases wait only
+    while they could still grow into a longer phrase ("go" -> "go back").
+    Each command fires at most once per utterance.
+    """
+    def __init__(self, matcher=None, vocabulary=VOCABULARY):
+        self.matcher = matcher or default_matcher()
+        phrases = [' '.join(p.lower().split()) for ps in vocabulary.values() for p in ps]
+        self._extendable = {p for p in phrases if any(q.startswith(p + ' ') for q in phrases)}
+        self.fired = None
+
+    def reset(self):
+        self.fired = None
+
+    def update(self, text, final):
+        match = self.matcher.match(text)
+        if match is None:
+            return None
+        if (not final and match.command != STOP_COMMAND and match.phrase in self._extendable
+                and text.rstrip().endswith(match.phrase)):
+            return None
+        if match.command == self.fired:
+            return None
+        self.fired = match.command
+        return match.command
+
+class StreamingListener:
+    """Runs VAD and recognition over an audio source on a background thread.
+
+    on_text(text, final, info) is called with every new partial transcript
+    and once with the final one per utterance; info carries the utterance's
+    onset time and, for finals, the estimated end of speech (monotonic).
+    """
+    def __init__(self, source, engine, on_text, vad=None, max_utterance_s=MAX_UTTERANCE_S):
+        self.source = source
+        self.engine = engine
+        self.on_text = on_text
+        self.vad = vad or EnergyVAD(getattr(source, 'rate', SAMPLE_RATE), getattr(source, 'chunk_ms', CHUNK_MS))
+        self.max_utterance_s = max_utterance_s
+        self.running = False
+        self._thread = None
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self.run, name='voice-listener', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.source.stop()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2.0)
+
+    def run(self):
+        self.running = True
+        onset = None
+        last_partial = ''
+        for pcm, heard in self.source.chunks():
+            if not self.running:
+                break
+            event = self.vad.process(pcm)
+            if event == 'silence':
+                continue
+            if event == 'start':
+                _UTTERANCES.inc()
+                onset = heard - self.vad.start_chunks * self.vad.chunk_s
+                last_partial = ''
+                self.engine.start()
+                pcm = self.vad.take_preroll()
+            partial = self.engine.accept(pcm)
+            if partial and partial != last_partial:
+                _PARTIALS.inc()
+                last_partial = partial
+                self.on_text(partial, False, {'onset': onset, 'heard': heard})
+            timed_out = heard - onset >= self.max_utterance_s
+            if event == 'end' or timed_out:
+                if timed_out:
+                    self.vad.reset()
+                speech_end = heard - (self.vad.hangover_chunks * self.vad.chunk_s if event == 'end' else 0.0)
+                start = time.perf_counter()
+                text = self.engine.finish()
+                _FINALIZE_SECONDS.observe(time.perf_counter() - start)
+                self.on_text(text, True, {'onset': onset, 'heard': heard, 'speech_end': speech_end})
+
+def _percentiles(values):
+    if not values:
+        return "n/a"
+    p50, p90 = np.percentile(np.array(values) * 1000, [50, 90])
+    return f"p50 {p50:7.1f} ms | p90 {p90:7.1f} ms"
+
+def latency_benchmark(paths, engine_name='vosk', model_path=VOSK_MODEL_PATH):
+    """Speech-to-serial latency over WAV files, endpoint-only vs partial-result firing."""
+    import serial
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'serial_bridge'))
+    from fake_serial import FakeSerialLink
+
+    print("=" * 60)
+    print(f"VOICE SPEECH-TO-SERIAL LATENCY BENCHMARK ({engine_name}, {len(paths)} files)")
+    print("=" * 60)
+    matcher = default_matcher()
+    with FakeSerialLink() as link, serial.Serial(link.port, 9600, timeout=1) as port:
+        for mode in ('endpoint', 'streaming'):
+            from_onset, from_end, correct, scored = [], [], 0, 0
+            for path in paths:
+                source = WavStream(path)
+                engine = make_engine(engine_name, source.rate, model_path)
+                if mode == 'streaming' and not engine.streaming:
+                    print(f"  {engine_name} has no partial results; streaming mode skipped")
+                    break
+                spotter = CommandSpotter(matcher)
+                fired = []
+                utterances = []
+
+                def on_text(text, final, info):
+                    if final:
+                        utterances.append(info)
+                    if mode == 'endpoint' and not final:
+                        return
+                    command = spotter.update(text, final)
+                    if final:
+                        spotter.reset()
+                    if command:
+                        port.write(command.encode())
+                        fired.append((command, info))
+
+                before = link.bytes_received
+                StreamingListener(source, engine, on_text).run()
+                link.wait_for_bytes(before + len(fired))
+                arrivals = link.commands()[before:before + len(fired)]
+                expected = matcher.command(os.path.splitext(os.path.basename(path))[0].replace('_', ' '))
+                first = fired[0][0] if fired else None
+                if expected:
+                    scored += 1
+                    correct += first == expected
+                if fired and utterances:
+                    arrived = arrivals[0][0]
+                    from_onset.append(arrived - fired[0][1]['onset'])
+                    from_end.append(arrived - utterances[0]['speech_end'])
+                print(f"  [{mode:9s}] {os.path.basename(path):24s} -> {first or '-'}"
+                      f"{'' if not expected else (' ok' if first == expected else f' (expected {expected})')}")
+            else:
+                print(f"  {mode}: onset->serial {_percentiles(from_onset)}")
+                print(f"  {mode}: speech end->serial {_percentiles(from_end)} (negative = before the speaker finished)")
+                if scored:
+                    print(f"  {mode}: accuracy {correct}/{scored}")
+
+if __name__ == "__main__":
+    if '--benchmark' in sys.argv:
+        args = sys.argv[1:]
+        engine_name = args[args.index('--engine') + 1] if '--engine' in args else 'vosk'
+        model_path = args[args.index('--vosk-model') + 1] if '--vosk-model' in args else VOSK_MODEL_PATH
+        wavs = [a for a in args if a.lower().endswith('.wav')]
+        if not wavs:
+            print("Usage: python voice_stream.py --benchmark [--engine vosk|google|kws|kws+google] "
+                  "[--vosk-model DIR] file.wav ...")
+            sys.exit(1)
+        latency_benchmark(wavs, engine_name, model_path)
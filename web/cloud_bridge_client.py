@@ -9,11 +9,27 @@ import requests
 import sys
 import os
 
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'serial_bridge'))
+import config
+if __name__ == "__main__":
+    config.load_or_exit()
+import metrics
+from command_arbiter import CommandArbiter
+
 # Configuration defaults
-SERVER_URL = "https://voicecar.pngha.io.vn"
-COM_PORT = 'COM8'
-BAUD_RATE = 9600
-POLL_INTERVAL = 0.1
+SERVER_URL = config.get('bridge.server_url', "https://voicecar.pngha.io.vn")
+COM_PORT = config.get('serial.port', 'COM8')
+BAUD_RATE = config.get('serial.baud_rate', 9600)
+POLL_INTERVAL = config.get('bridge.poll_interval', 0.1)
+
+_WRITES = metrics.SERIAL_WRITES.labels(source='cloud_bridge')
+_WRITE_ERRORS = metrics.SERIAL_WRITE_ERRORS.labels(source='cloud_bridge')
+_WRITE_SECONDS = metrics.SERIAL_WRITE_SECONDS.labels(source='cloud_bridge')
+_POLL_SECONDS = metrics.histogram(
+    'smartcar_bridge_poll_seconds', 'Cloud bridge status poll round-trip latency')
+_POLL_ERRORS = metrics.counter(
+    'smartcar_bridge_poll_errors_total', 'Cloud bridge status poll failures')
 
 def auto_detect_port():
     """Auto-detect connected USB serial COM ports."""
@@ -29,18 +45,30 @@ def auto_detect_port():
     return ports[0].device if ports else None
 
 class LocalBridgeClient:
-    def __init__(self, server_url, com_port=None, baud_rate=BAUD_RATE, test_mode=False):
+    def __init__(self, server_url, com_port=None, baud_rate=BAUD_RATE, test_mode=False, ser=None,
+                 arbiter=None, source='cloud'):
+        """ser is an already-open link (e.g. a supervisor port) used instead of connecting.
+
+        arbiter is a shared CommandArbiter with `source` already registered
+        (the supervisor's); without one a private arbiter writes to ser.
+        """
         self.server_url = server_url
-        self.com_port = com_port or auto_detect_port()
+        self.com_port = com_port or (ser.port if ser is not None else auto_detect_port())
         self.baud_rate = baud_rate
         self.test_mode = test_mode
-        self.ser = None
+        self.ser = ser
         self.last_command = None
         self.is_running = False
         self.command_count = 0
         self.error_count = 0
+        # Each relayed command renews the lease; a stalled poll lets the watchdog stop the car
+        self.source = source
+        self.owns_arbiter = arbiter is None
+        self.arbiter = arbiter or CommandArbiter(self.write_serial, name='cloud_bridge').register(source)
         
-        if not test_mode:
+        if ser is not None:
+            self.is_running = True
+        elif not test_mode:
             self.connect_arduino()
         else:
             print("SIMULATION MODE ACTIVE — Running without active Arduino hardware.")
@@ -79,10 +107,12 @@ class LocalBridgeClient:
     def get_server_status(self):
         """Poll active command telemetry from remote cloud web server."""
         try:
+            start = time.perf_counter()
             response = requests.get(
                 f"{self.server_url}/status",
                 timeout=2
             )
+            _POLL_SECONDS.observe(time.perf_counter() - start)
             
             if response.status_code == 200:
                 data = response.json()
@@ -94,21 +124,31 @@ class LocalBridgeClient:
             if self.error_count % 10 == 0:
                 print(f"Warning: Cloud server connection error: {e}")
             self.error_count += 1
+            _POLL_ERRORS.inc()
             return None
     
     def send_to_arduino(self, command):
         """Send command character code to Arduino over serial link."""
+        forwarded = self.arbiter.submit(self.source, command)
+        if forwarded and not self.owns_arbiter:
+            # A shared arbiter writes through its owner, so count forwarded commands here
+            self.command_count += 1
+        return forwarded
+    
+    def write_serial(self, data, source):
+        """Arbiter callback: the only writer to the serial port."""
         try:
             if self.test_mode:
                 self.command_count += 1
-                return True
             elif self.ser and self.ser.is_open:
-                self.ser.write(command.encode())
+                start = time.perf_counter()
+                self.ser.write(data)
+                _WRITE_SECONDS.observe(time.perf_counter() - start)
+                _WRITES.inc()
                 self.command_count += 1
-                return True
         except Exception as e:
+            _WRITE_ERRORS.inc()
             print(f"Error: Transmission to Arduino failed: {e}")
-            return False
     
     def run(self):
         """Main polling loop."""
@@ -119,6 +159,8 @@ class LocalBridgeClient:
         print(f"\nMonitoring command events from cloud server...")
         print(f"Press Ctrl+C to terminate.\n")
         
+        if self.owns_arbiter:
+            self.arbiter.start()
         try:
             while self.is_running:
                 command = self.get_server_status()
@@ -141,6 +183,8 @@ class LocalBridgeClient:
     def stop(self):
         """Stop bridge process and safely release serial resources."""
         self.is_running = False
+        if self.owns_arbiter:
+            self.arbiter.stop()
         
         if not self.test_mode and self.ser and self.ser.is_open:
             print("Sending STOP command to Arduino...")
@@ -151,6 +195,7 @@ class LocalBridgeClient:
         print(f"\nCloud Bridge Client terminated cleanly.")
         print(f"  Total Commands Relayed: {self.command_count}")
         print(f"  Network Errors: {self.error_count}")
+        print(f"  Watchdog Stops: {self.arbiter.watchdog_stops}")
 
 def main():
     print("=" * 70)
@@ -176,9 +221,15 @@ def main():
     if len(sys.argv) > 1 and not sys.argv[1].startswith('-'):
         com_port = sys.argv[1]
         print(f"Using specified COM port: {com_port}")
+    elif config.get('serial.port'):
+        print(f"Using configured COM port: {com_port}")
     else:
         detected_port = auto_detect_port()
-        if detected_port:
+        if detected_port and not sys.stdin.isatty():
+            # Unattended start (systemd): take the detected port instead of prompting
+            com_port = detected_port
+            print(f"Auto-detected serial port: {detected_port}")
+        elif detected_port:
             print(f"Auto-detected serial port: {detected_port}")
             use_detected = input(f"Use {detected_port}? (y/n): ").strip().lower()
             if use_detected == 'y':
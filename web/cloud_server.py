@@ -4,7 +4,7 @@ aws_web_voice_control.py - Smart Car AWS Voice Control Server
 DATE: 24/02/2026
 Voice input/output with Amazon Polly and Web Speech API
 """
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import serial
 import time
 import threading
@@ -13,6 +13,20 @@ import socket
 import os
 import sys
 import base64
+import collections
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'serial_bridge'))
+import config
+if __name__ == "__main__":
+    config.load_or_exit()
+import metrics
+from command_arbiter import CommandArbiter
+from session_recorder import SessionRecorder, cli_record_path
+from command_sequencer import CommandSequencer, parse_steps
+from llm_guard import GuardedExecutor, LatencyTracker, OK as LLM_OK
+from parse_cache import ParseCache
+from intent_classifier import make_backend
 
 # AWS Bedrock imports
 try:
@@ -24,9 +38,10 @@ except ImportError:
     print("WARNING: boto3 not installed. LLM and voice features will be disabled.")
     print("Install with: pip install boto3")
 
-COM_PORT = '/dev/ttyUSB0'  # Linux/EC2 default
-BAUD_RATE = 9600
-SERVER_PORT = 8080
+COM_PORT = config.get('serial.port', '/dev/ttyUSB0')  # Linux/EC2 default
+BAUD_RATE = config.get('serial.baud_rate', 9600)
+SERVER_PORT = config.get('cloud_server.port', 8080)
+SEND_INTERVAL = config.get('cloud_server.send_interval', 0.05)
 
 # AWS Configuration
 AWS_REGION = 'ap-southeast-1'
@@ -34,6 +49,21 @@ MODEL_ID = 'amazon.nova-2-sonic-v1:0'  # Nova 2 Sonic - Speech-to-Speech
 TEXT_MODEL_ID = 'anthropic.claude-3-haiku-20240307-v1:0'  # Fallback for text
 NOVA_VOICE_ID = 'en-US-Female-1'  # Nova 2 Sonic voice
 
+# LLM call guard: hard deadline, concurrent call limit and circuit breaker
+LLM_TIMEOUT = config.get('cloud_server.llm_timeout', 2.0)
+LLM_MAX_CONCURRENT = 2
+LLM_FAILURE_THRESHOLD = 3
+LLM_RESET_TIMEOUT = 30.0
+
+# LLM parse result cache (set SMARTCAR_PARSE_CACHE to a file path to persist)
+PARSE_CACHE_SIZE = config.get('cloud_server.parse_cache_size', 512)
+PARSE_CACHE_TTL = 6 * 3600.0
+PARSE_CACHE_PATH = os.getenv('SMARTCAR_PARSE_CACHE')
+
+_WRITES = metrics.SERIAL_WRITES.labels(source='cloud_web')
+_WRITE_ERRORS = metrics.SERIAL_WRITE_ERRORS.labels(source='cloud_web')
+_WRITE_SECONDS = metrics.SERIAL_WRITE_SECONDS.labels(source='cloud_web')
+
 def auto_detect_port():
     import serial.tools.list_ports
     ports = list(serial.tools.list_ports.comports())
@@ -48,12 +78,26 @@ def auto_detect_port():
 
 class AWSBedrockLLM:
     """AWS Bedrock client for Nova 2 Sonic (Speech-to-Speech)"""
-    def __init__(self, region=AWS_REGION, model_id=MODEL_ID):
+    def __init__(self, region=AWS_REGION, model_id=MODEL_ID, intent_backend='keyword'):
         self.region = region
         self.model_id = model_id
         self.text_model_id = TEXT_MODEL_ID
         self.client = None
         self.available = False
+        self.intent = make_backend(intent_backend)
+        self.guard = GuardedExecutor(
+            'cloud_server',
+            max_concurrent=LLM_MAX_CONCURRENT,
+            timeout=LLM_TIMEOUT,
+            failure_threshold=LLM_FAILURE_THRESHOLD,
+            reset_timeout=LLM_RESET_TIMEOUT
+        )
+        self.cache = ParseCache(
+            'cloud_server',
+            max_entries=PARSE_CACHE_SIZE,
+            ttl=PARSE_CACHE_TTL,
+            path=PARSE_CACHE_PATH
+        )
         
         if AWS_AVAILABLE:
             try:
@@ -68,64 +112,47 @@ class AWSBedrockLLM:
             print("✗ boto3 not available. Voice features disabled")
     
     def parse_command(self, user_input):
-        """Parse natural language input to car command using keyword matching (LLM fallback)"""
-        # Keyword-based parsing (works without AWS Bedrock)
-        text = user_input.lower().strip()
-        
-        # Forward commands
-        if any(word in text for word in ['forward', 'ahead', 'go', 'move forward', 'straight']):
+        """Parse natural language input to car command using the local intent backend (LLM fallback)"""
+        # Keyword matcher or local classifier (works without AWS Bedrock)
+        match = self.intent.classify(user_input)
+        if match:
             return {
                 'success': True,
-                'command': 'W',
-                'explanation': 'Moving forward',
+                'command': match.command,
+                'explanation': match.explanation,
                 'raw_input': user_input,
-                'method': 'keyword'
+                'method': self.intent.name
             }
         
-        # Backward commands
-        if any(word in text for word in ['back', 'backward', 'reverse']):
-            return {
-                'success': True,
-                'command': 'S',
-                'explanation': 'Moving backward',
-                'raw_input': user_input,
-                'method': 'keyword'
-            }
-        
-        # Left commands
-        if any(word in text for word in ['left', 'turn left']):
-            return {
-                'success': True,
-                'command': 'A',
-                'explanation': 'Turning left',
-                'raw_input': user_input,
-                'method': 'keyword'
-            }
-        
-        # Right commands
-        if any(word in text for word in ['right', 'turn right']):
-            return {
-                'success': True,
-                'command': 'D',
-                'explanation': 'Turning right',
-                'raw_input': user_input,
-                'method': 'keyword'
-            }
-        
-        # Stop commands
-        if any(word in text for word in ['stop', 'halt', 'brake', 'wait']):
-            return {
-                'success': True,
-                'command': 'X',
-                'explanation': 'Stopping',
-                'raw_input': user_input,
-                'method': 'keyword'
-            }
-        
-        # If LLM is available, try using it
+        # If LLM is available, try it under the guard deadline
         if self.available:
-            try:
-                system_prompt = """You are a Smart Car command parser. Convert natural language to car commands.
+            cached = self.cache.get(user_input)
+            if cached:
+                return dict(cached, raw_input=user_input, method='cache')
+            
+            outcome, result = self.guard.call(self._classify_with_llm, user_input)
+            if outcome == LLM_OK and result:
+                self.cache.put(user_input, {
+                    'success': True,
+                    'command': result['command'],
+                    'explanation': result.get('explanation', '')
+                })
+                return result
+            if outcome != LLM_OK:
+                detail = f": {result}" if result else ""
+                print(f"LLM parsing unavailable ({outcome}{detail})")
+        
+        # No match found
+        return {
+            'success': False,
+            'error': 'Could not understand command. Try: forward, back, left, right, stop',
+            'command': None,
+            'method': 'none'
+        }
+    
+    def _classify_with_llm(self, user_input):
+        """Blocking Bedrock converse call. Runs on the guard pool, never the handler thread."""
+        system_prompt = """You are a Smart Car command parser. Convert natural language to car commands.
 
 Available commands:
 - W: Move forward (go forward, move ahead, drive forward)
@@ -142,45 +169,36 @@ User: "go forward" -> {"command": "W", "explanation": "Moving forward"}
 User: "turn left" -> {"command": "A", "explanation": "Turning left"}
 User: "stop" -> {"command": "X", "explanation": "Stopping"}
 """
-                
-                request_body = {
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": [{"text": f"{system_prompt}\n\nUser input: {user_input}"}]
-                        }
-                    ],
-                    "inferenceConfig": {
-                        "maxTokens": 100,
-                        "temperature": 0.1,
-                        "topP": 0.9
-                    }
-                }
-                
-                response = self.client.converse(
-                    modelId=self.text_model_id,
-                    messages=request_body["messages"],
-                    inferenceConfig=request_body["inferenceConfig"]
-                )
-                
-                response_text = response['output']['message']['content'][0]['text']
-                result = json.loads(response_text)
-                
-                if result.get('command') in ['W', 'A', 'S', 'D', 'X']:
-                    result['method'] = 'llm'
-                    result['raw_input'] = user_input
-                    return result
-                    
-            except Exception as e:
-                print(f"LLM parsing failed, using keyword match: {e}")
         
-        # No match found
-        return {
-            'success': False,
-            'error': 'Could not understand command. Try: forward, back, left, right, stop',
-            'command': None,
-            'method': 'none'
+        request_body = {
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [{"text": f"{system_prompt}\n\nUser input: {user_input}"}]
+                }
+            ],
+            "inferenceConfig": {
+                "maxTokens": 100,
+                "temperature": 0.1,
+                "topP": 0.9
+            }
         }
+        
+        response = self.client.converse(
+            modelId=self.text_model_id,
+            messages=request_body["messages"],
+            inferenceConfig=request_body["inferenceConfig"]
+        )
+        
+        response_text = response['output']['message']['content'][0]['text']
+        result = json.loads(response_text)
+        
+        if result.get('command') in ['W', 'A', 'S', 'D', 'X']:
+            result['success'] = True
+            result['method'] = 'llm'
+            result['raw_input'] = user_input
+            return result
+        return None
     
     def text_to_speech(self, text):
         """Convert text to speech - returns text for browser TTS"""
@@ -194,18 +212,31 @@ User: "stop" -> {"command": "X", "explanation": "Stopping"}
         }
 
 class SmartCarController:
-    def __init__(self, test_mode=False, enable_llm=True):
+    def __init__(self, test_mode=False, enable_llm=True, recorder=None, intent_backend='keyword',
+                 arbiter=None, source='web'):
+        """arbiter is a shared CommandArbiter with `source` already registered;
+        without one a private arbiter writes to the serial port."""
         self.test_mode = test_mode
+        self.recorder = recorder
         self.ser = None
         self.current_command = 'X'
         self.command_count = 0
         self.llm_command_count = 0
         self.voice_command_count = 0
         self.is_running = False
-        self.command_history = []
+        self.command_changed = threading.Event()
+        self.sequencer = CommandSequencer(
+            lambda command: self.send_command(command, source='sequence'))
+        # Appended from every handler thread; the deque bounds it without a lock
+        self.command_history = collections.deque(maxlen=50)
+        self.parse_latency = LatencyTracker()
+        # The send loop renews the lease; if it stalls the watchdog stops the car
+        self.source = source
+        self.owns_arbiter = arbiter is None
+        self.arbiter = arbiter or CommandArbiter(self.write_serial, name='cloud_server').register(source)
         
         # Initialize LLM
-        self.llm = AWSBedrockLLM() if enable_llm else None
+        self.llm = AWSBedrockLLM(intent_backend=intent_backend) if enable_llm else None
         
         if not test_mode:
             self.connect_arduino()
@@ -213,6 +244,8 @@ class SmartCarController:
             self.is_running = True
             print("TEST MODE - No Arduino needed")
         
+        if self.owns_arbiter:
+            self.arbiter.start()
         self.send_thread = threading.Thread(target=self.continuous_send, daemon=True)
         self.send_thread.start()
     
@@ -248,7 +281,12 @@ class SmartCarController:
         if command not in ['W', 'A', 'S', 'D', 'X']:
             return False
         
+        if source != 'sequence':
+            self.sequencer.cancel()
         self.current_command = command
+        self.command_changed.set()
+        if self.recorder:
+            self.recorder.record_command(command, source)
         timestamp = time.strftime("%H:%M:%S")
         
         # Add to history
@@ -258,15 +296,14 @@ class SmartCarController:
             'source': source
         })
         
-        if len(self.command_history) > 50:
-            self.command_history = self.command_history[-50:]
-        
         if source == 'llm':
             self.llm_command_count += 1
             print(f"[{timestamp}] LLM Command: {command}")
         elif source == 'voice':
             self.voice_command_count += 1
             print(f"[{timestamp}] Voice Command: {command}")
+        elif source == 'sequence':
+            print(f"[{timestamp}] Sequence Command: {command}")
         else:
             print(f"[{timestamp}] Manual Command: {command}")
         
@@ -274,14 +311,25 @@ class SmartCarController:
     
     def parse_natural_language(self, text):
         """Parse natural language using LLM"""
-        if not self.llm or not self.llm.available:
+        # The local classifier parses on its own; the keyword matcher needs Bedrock to be up
+        if not self.llm or not (self.llm.available or self.llm.intent.authoritative):
             return {
                 'success': False,
                 'error': 'LLM not available',
                 'command': None
             }
         
-        return self.llm.parse_command(text)
+        start = time.perf_counter()
+        result = self.llm.parse_command(text)
+        elapsed = time.perf_counter() - start
+        method = result.get('method', 'none')
+        self.parse_latency.record(method, elapsed)
+        metrics.LLM_PARSE_SECONDS.labels('cloud_server', method).observe(elapsed)
+        metrics.LLM_PARSE_CALLS.labels('cloud_server', method).inc()
+        if self.recorder:
+            self.recorder.record_event('parse', text=text, command=result.get('command'),
+                                       method=method, latency_ms=round(elapsed * 1000, 2))
+        return result
     
     def text_to_speech(self, text):
         """Convert text to speech"""
@@ -295,16 +343,27 @@ class SmartCarController:
     
     def continuous_send(self):
         while self.is_running:
+            self.command_changed.clear()
+            if self.arbiter.submit(self.source, self.current_command) and not self.owns_arbiter:
+                # A shared arbiter writes through its owner, so count forwarded commands here
+                self.command_count += 1
+            # Wake early when the command changes so it reaches the link immediately
+            self.command_changed.wait(SEND_INTERVAL)
+    
+    def write_serial(self, data, source):
+        """Arbiter callback: the only writer to the serial port."""
+        if self.test_mode:
+            self.command_count += 1
+        elif self.ser and self.ser.is_open:
             try:
-                if self.test_mode:
-                    self.command_count += 1
-                elif self.ser and self.ser.is_open:
-                    self.ser.write(self.current_command.encode())
-                    self.command_count += 1
-                time.sleep(0.05)
+                start = time.perf_counter()
+                self.ser.write(data)
+                _WRITE_SECONDS.observe(time.perf_counter() - start)
+                _WRITES.inc()
+                self.command_count += 1
             except Exception as e:
+                _WRITE_ERRORS.inc()
                 print(f"Send error: {e}")
-                break
     
     def get_status(self):
         return {
@@ -316,20 +375,35 @@ class SmartCarController:
             'test_mode': self.test_mode,
             'llm_available': self.llm.available if self.llm else False,
             'nova_sonic_available': self.llm.available if self.llm else False,
-            'history': self.command_history[-10:]
+            'llm_circuit': self.llm.guard.breaker.state if self.llm else 'disabled',
+            'parse_latency': self.parse_latency.percentiles(),
+            'parse_cache': self.llm.cache.stats() if self.llm else None,
+            'watchdog_stops': self.arbiter.watchdog_stops,
+            'sequence': self.sequencer.status(),
+            'history': list(self.command_history)[-10:]
         }
     
     def stop(self):
         self.is_running = False
+        self.sequencer.cancel()
+        if self.owns_arbiter:
+            self.arbiter.stop()
+        if self.llm:
+            self.llm.guard.shutdown()
+            self.llm.cache.save()
         if self.ser and self.ser.is_open:
             self.ser.write(b'X')
             time.sleep(0.2)
             self.ser.close()
+        if self.recorder:
+            self.recorder.close()
 
 # Global controller instance
 controller = None
 
-class SmartCarRequestHandler(BaseHTTPRequestHandler):
+class SmartCarRequestHandler(metrics.RequestMetricsMixin, BaseHTTPRequestHandler):
+    metrics_server = 'cloud'
+    
     def do_GET(self):
         if self.path == '/':
             self.send_response(200)
@@ -340,6 +414,16 @@ class SmartCarRequestHandler(BaseHTTPRequestHandler):
             with open(html_path, 'r', encoding='utf-8') as f:
                 self.wfile.write(f.read().encode('utf-8'))
         
+        elif self.path == '/metrics':
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-type', metrics.CONTENT_TYPE)
+            self.end_headers()
+            self.wfile.write(body)
+        
+        elif self.path == '/sequence':
+            self.send_json(200, controller.sequencer.status())
+        
         elif self.path == '/status':
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
@@ -377,7 +461,29 @@ class SmartCarRequestHandler(BaseHTTPRequestHandler):
             self.end_headers()
     
     def do_POST(self):
-        if self.path == '/llm/parse':
+        if self.path == '/sequence':
+            try:
+                content_length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(content_length).decode('utf-8'))
+                steps = parse_steps(payload)
+            except (ValueError, UnicodeDecodeError) as e:
+                self.send_json(400, {'success': False, 'error': str(e)})
+                return
+            
+            sequence_id = controller.sequencer.start(steps)
+            self.send_json(200, {
+                'success': True,
+                'sequence_id': sequence_id,
+                'steps': len(steps),
+                'total_duration': round(sum(d for _, d in steps), 3)
+            })
+        
+        elif self.path == '/sequence/cancel':
+            # An explicit cancel stops the car; the send loop would otherwise repeat the last step
+            cancelled = controller.sequencer.cancel(stop=True)
+            self.send_json(200, {'success': True, 'cancelled': cancelled})
+        
+        elif self.path == '/llm/parse':
             content_length = int(self.headers['Content-Length'])
             post_data = self.rfile.read(content_length)
             
@@ -454,6 +560,14 @@ class SmartCarRequestHandler(BaseHTTPRequestHandler):
             self.send_response(404)
             self.end_headers()
     
+    def send_json(self, code, payload):
+        """Write a JSON response with the given status code."""
+        self.send_response(code)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(json.dumps(payload).encode('utf-8'))
+    
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
@@ -475,7 +589,7 @@ def get_local_ip():
     except:
         return "localhost"
 
-def main(test_mode=False, enable_llm=True):
+def main(test_mode=False, enable_llm=True, record_path=None, intent_backend='keyword'):
     global controller
     
     print("=" * 70)
@@ -483,10 +597,12 @@ def main(test_mode=False, enable_llm=True):
     print("Web Speech API - Voice Recognition with Keyword Matching")
     print("=" * 70)
     
-    controller = Smart CarController(test_mode=test_mode, enable_llm=enable_llm)
+    recorder = SessionRecorder(record_path, source='cloud_web') if record_path else None
+    controller = SmartCarController(test_mode=test_mode, enable_llm=enable_llm, recorder=recorder,
+                                    intent_backend=intent_backend)
     
     local_ip = get_local_ip()
-    server = HTTPServer(('0.0.0.0', SERVER_PORT), Smart CarRequestHandler)
+    server = ThreadingHTTPServer(('0.0.0.0', SERVER_PORT), SmartCarRequestHandler)
     
     print(f"\n✓ Server running at:")
     print(f"  - Local:  http://localhost:{SERVER_PORT}")
@@ -496,7 +612,7 @@ def main(test_mode=False, enable_llm=True):
     print(f"\n✓ Voice Features: ENABLED")
     print(f"  - Voice Input: Web Speech API (browser-based)")
     print(f"  - Voice Output: Web Speech API (browser TTS)")
-    print(f"  - Command Parsing: Keyword matching")
+    print(f"  - Command Parsing: {'Local intent classifier' if intent_backend == 'local' else 'Keyword matching'}")
     print(f"  - Supported: forward, back, left, right, stop")
     
     if controller.llm and controller.llm.available:
@@ -509,6 +625,9 @@ def main(test_mode=False, enable_llm=True):
         print(f"  - No AWS Bedrock required")
         print(f"  - Direct command recognition")
     
+    if record_path:
+        print(f"\n✓ Recording commands to: {record_path}")
+    
     print(f"\nOpen browser: https://voicecar.pngha.io.vn")
     print(f"Press Ctrl+C to stop server")
     print("=" * 70)
@@ -524,4 +643,6 @@ def main(test_mode=False, enable_llm=True):
 if __name__ == "__main__":
     test_mode = '--test' in sys.argv or '-t' in sys.argv
     no_llm = '--no-llm' in sys.argv
-    main(test_mode=test_mode, enable_llm=not no_llm)
+    intent_backend = 'local' if '--local-intent' in sys.argv else 'keyword'
+    main(test_mode=test_mode, enable_llm=not no_llm, record_path=cli_record_path(sys.argv),
+         intent_backend=intent_backend)
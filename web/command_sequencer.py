@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+command_sequencer.py - Server-Side Timed Maneuver Scheduler
+Runs a list of (command, duration) steps against a controller's serial send
+loop on a monotonic clock, so a maneuver such as "forward 2 s, left 0.5 s,
+stop" needs one HTTP request instead of one per step. Step deadlines are
+absolute offsets from the sequence start, so wake-up jitter does not
+accumulate across steps. Any manual command cancels the running sequence.
+Run this module to print the timing error; tests/test_command_sequencer.py
+asserts a bound on it.
+"""
+import itertools
+import threading
+import time
+
+VALID_COMMANDS = ('W', 'A', 'S', 'D', 'X')
+MAX_STEPS = 100
+MAX_STEP_DURATION = 30.0
+
+# Sleep until this close to a deadline, then spin for sub-millisecond accuracy
+SPIN_THRESHOLD = 0.002
+
+def parse_steps(payload, commands=VALID_COMMANDS):
+    """Validate a request payload into a list of (command, duration) tuples.
+
+    Accepts {"steps": [...]} or a bare list, where each step is either
+    {"command": "W", "duration": 2.0} or ["W", 2.0]. Raises ValueError.
+    """
+    steps = payload.get('steps') if isinstance(payload, dict) else payload
+    if not isinstance(steps, list) or not steps:
+        raise ValueError("Expected a non-empty 'steps' list")
+    if len(steps) > MAX_STEPS:
+        raise ValueError(f"At most {MAX_STEPS} steps per sequence")
+
+    parsed = []
+    for index, step in enumerate(steps):
+        if isinstance(step, dict):
+            command, duration = step.get('command'), step.get('duration')
+        elif isinstance(step, (list, tuple)) and len(step) == 2:
+            command, duration = step
+        else:
+            raise ValueError(f"Step {index}: expected {{command, duration}} or [command, duration]")
+
+        command = str(command).upper()
+        if command not in commands:
+            raise ValueError(f"Step {index}: invalid command {command!r}. Expected: {', '.join(commands)}")
+        if isinstance(duration, bool):
+            raise ValueError(f"Step {index}: duration must be a number of seconds")
+        try:
+            duration = float(duration)
+        except (TypeError, ValueError):
+            raise ValueError(f"Step {index}: duration must be a number of seconds")
+        if not 0 < duration <= MAX_STEP_DURATION:
+            raise ValueError(f"Step {index}: duration must be in (0, {MAX_STEP_DURATION}] seconds")
+        parsed.append((command, duration))
+    return parsed
+
+class CommandSequencer:
+    """Background scheduler applying timed command steps to a controller.
+
+    apply_command(command) must switch the streamed command and return quickly;
+    the controllers wake their send loop so the change hits the serial link
+    immediately instead of on the next 50 ms tick.
+    """
+    def __init__(self, apply_command, final_command='X'):
+        self.apply_command = apply_command
+        self.final_command = final_command
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._thread = None
+        self._state = {'id': None, 'active': False, 'steps': [], 'step_index': None,
+                       'cancelled': False, 'timing': []}
+
+    def start(self, steps):
+        """Cancel any running sequence and start a new one. Returns its id."""
+        self.cancel()
+        with self._lock:
+            sequence_id = next(self._ids)
+            self._cancel = threading.Event()
+            self._state = {'id': sequence_id, 'active': True, 'steps': list(steps),
+                           'step_index': None, 'cancelled': False, 'timing': []}
+            self._thread = threading.Thread(
+                target=self._run, args=(sequence_id, list(steps), self._cancel), daemon=True)
+            self._thread.start()
+        return sequence_id
+
+    def cancel(self, stop=False):
+        """Stop the running sequence. Returns True if one was running.
+
+        A manual command overriding the sequence cancels without stop, so
+        nothing is sent; an explicit cancel passes stop=True to apply the
+        final command even when no sequence was running.
+        """
+        cancelled = self._cancel_running()
+        if stop and self.final_command:
+            self.apply_command(self.final_command)
+        return cancelled
+
+    def _cancel_running(self):
+        with self._lock:
+            thread = self._thread
+            if thread is None or not self._state['active']:
+                return False
+            self._cancel.set()
+        if thread is not threading.current_thread():
+            thread.join(timeout=1.0)
+        return True
+
+    def status(self):
+        with self._lock:
+            state = dict(self._state)
+            state['steps'] = [{'command': c, 'duration': d} for c, d in state['steps']]
+            state['timing'] = list(state['timing'])
+            return state
+
+    def wait(self, timeout=None):
+        """Block until the current sequence ends (for scripts and self-tests)."""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self, sequence_id, steps, cancel):
+        start = time.monotonic()
+        deadline = start
+        completed = True
+        for index, (command, duration) in enumerate(steps):
+            if cancel.is_set():
+                completed = False
+                break
+            actual = time.monotonic() - start
+            self.apply_command(command)
+            with self._lock:
+                if self._state['id'] == sequence_id:
+                    self._state['step_index'] = index
+                    self._state['timing'].append({
+                        'command': command,
+                        'scheduled_s': round(deadline - start, 6),
+                        'actual_s': round(actual, 6)
+                    })
+            deadline += duration
+            if not _sleep_until(deadline, cancel):
+                completed = False
+                break
+
+        if completed and self.final_command:
+            self.apply_command(self.final_command)
+        with self._lock:
+            if self._state['id'] == sequence_id:
+                self._state['active'] = False
+                self._state['cancelled'] = not completed
+                self._state['step_index'] = None
+                self._state['elapsed_s'] = round(time.monotonic() - start, 6)
+
+def _sleep_until(deadline, cancel):
+    """Wait for a monotonic deadline. Returns False if cancelled first."""
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return True
+        if remaining > SPIN_THRESHOLD:
+            if cancel.wait(remaining - SPIN_THRESHOLD):
+                return False
+        elif cancel.is_set():
+            return False
+
+def measure_timing_accuracy(steps=None):
+    """Run a sequence against a recording stub and report per-step timing error."""
+    steps = steps or [('W', 0.5), ('A', 0.25), ('D', 0.25), ('S', 0.5), ('X', 0.1)]
+    applied = []
+    origin = time.monotonic()
+
+    def record(command):
+        applied.append((command, time.monotonic() - origin))
+
+    sequencer = CommandSequencer(record)
+    sequencer.start(steps)
+    sequencer.wait()
+
+    print("=" * 60)
+    print("COMMAND SEQUENCER TIMING ACCURACY")
+    print("=" * 60)
+    expected = 0.0
+    errors = []
+    for (command, duration), (applied_cmd, at) in zip(steps, applied):
+        error_ms = (at - expected) * 1000
+        errors.append(abs(error_ms))
+        print(f"  {command} scheduled {expected:7.3f}s  applied {at:7.3f}s  error {error_ms:+7.3f} ms")
+        expected += duration
+    final = applied[len(steps)][1] if len(applied) > len(steps) else None
+    if final is not None:
+        error_ms = (final - expected) * 1000
+        errors.append(abs(error_ms))
+        print(f"  final X at {final:7.3f}s (expected {expected:.3f}s) error {error_ms:+7.3f} ms")
+    print(f"Max absolute error: {max(errors):.3f} ms | Mean: {sum(errors) / len(errors):.3f} ms")
+    return max(errors)
+
+if __name__ == "__main__":
+    measure_timing_accuracy()
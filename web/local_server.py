@@ -9,10 +9,26 @@ import threading
 import json
 import socket
 import os
+import sys
 
-COM_PORT = 'COM8'
-BAUD_RATE = 9600
-SERVER_PORT = 8080
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'serial_bridge'))
+import config
+if __name__ == "__main__":
+    config.load_or_exit()
+import metrics
+from command_arbiter import CommandArbiter
+from session_recorder import SessionRecorder, cli_record_path
+from command_sequencer import CommandSequencer, parse_steps
+
+COM_PORT = config.get('serial.port', 'COM8')
+BAUD_RATE = config.get('serial.baud_rate', 9600)
+SERVER_PORT = config.get('local_web.port', 8080)
+SEND_INTERVAL = config.get('local_web.send_interval', 0.05)
+
+_WRITES = metrics.SERIAL_WRITES.labels(source='local_web')
+_WRITE_ERRORS = metrics.SERIAL_WRITE_ERRORS.labels(source='local_web')
+_WRITE_SECONDS = metrics.SERIAL_WRITE_SECONDS.labels(source='local_web')
 
 def auto_detect_port():
     """Auto-detect connected USB serial COM ports."""
@@ -28,19 +44,36 @@ def auto_detect_port():
     return ports[0].device if ports else None
 
 class SmartCarController:
-    def __init__(self, test_mode=False):
+    def __init__(self, test_mode=False, recorder=None, ser=None, arbiter=None, source='web'):
+        """ser is an already-open link (e.g. a supervisor port) used instead of connecting.
+
+        arbiter is a shared CommandArbiter with `source` already registered
+        (the supervisor's); without one a private arbiter writes to ser.
+        """
         self.test_mode = test_mode
-        self.ser = None
+        self.recorder = recorder
+        self.ser = ser
         self.current_command = 'X'
         self.command_count = 0
         self.is_running = False
+        self.command_changed = threading.Event()
+        self.sequencer = CommandSequencer(
+            lambda command: self.send_command(command, source='sequence'))
+        # The send loop renews the web lease; if it stalls the watchdog stops the car
+        self.source = source
+        self.owns_arbiter = arbiter is None
+        self.arbiter = arbiter or CommandArbiter(self.write_serial, name='local_web').register(source)
         
-        if not test_mode:
+        if ser is not None:
+            self.is_running = True
+        elif not test_mode:
             self.connect_arduino()
         else:
             self.is_running = True
             print("SIMULATION MODE ACTIVE — Running without active Arduino hardware.")
         
+        if self.owns_arbiter:
+            self.arbiter.start()
         self.send_thread = threading.Thread(target=self.continuous_send, daemon=True)
         self.send_thread.start()
     
@@ -73,29 +106,45 @@ class SmartCarController:
             self.test_mode = True
             self.is_running = True
     
-    def send_command(self, command):
+    def send_command(self, command, source='manual'):
         """Register active vehicle movement command code."""
         if command not in ['W', 'A', 'S', 'D', 'X']:
             return False
         
+        if source != 'sequence':
+            self.sequencer.cancel()
         self.current_command = command
+        self.command_changed.set()
+        if self.recorder:
+            self.recorder.record_command(command, source)
         timestamp = time.strftime("%H:%M:%S")
-        print(f"[{timestamp}] Command: {command}")
+        print(f"[{timestamp}] Command: {command}" + (" (sequence)" if source == 'sequence' else ""))
         return True
     
     def continuous_send(self):
         """Background thread sending serial command codes at 20Hz (50ms interval)."""
         while self.is_running:
+            self.command_changed.clear()
+            if self.arbiter.submit(self.source, self.current_command) and not self.owns_arbiter:
+                # A shared arbiter writes through its owner, so count forwarded commands here
+                self.command_count += 1
+            # Wake early when the command changes so it reaches the link immediately
+            self.command_changed.wait(SEND_INTERVAL)
+    
+    def write_serial(self, data, source):
+        """Arbiter callback: the only writer to the serial port."""
+        if self.test_mode:
+            self.command_count += 1
+        elif self.ser and self.ser.is_open:
             try:
-                if self.test_mode:
-                    self.command_count += 1
-                elif self.ser and self.ser.is_open:
-                    self.ser.write(self.current_command.encode())
-                    self.command_count += 1
-                time.sleep(0.05)
+                start = time.perf_counter()
+                self.ser.write(data)
+                _WRITE_SECONDS.observe(time.perf_counter() - start)
+                _WRITES.inc()
+                self.command_count += 1
             except Exception as e:
+                _WRITE_ERRORS.inc()
                 print(f"Serial transmission error: {e}")
-                break
     
     def get_status(self):
         """Return vehicle connection and command telemetry dictionary."""
@@ -103,20 +152,29 @@ class SmartCarController:
             'current_command': self.current_command,
             'command_count': self.command_count,
             'is_running': self.is_running,
-            'test_mode': self.test_mode
+            'test_mode': self.test_mode,
+            'watchdog_stops': self.arbiter.watchdog_stops,
+            'sequence': self.sequencer.status()
         }
     
     def stop(self):
         """Close serial connection safely."""
         self.is_running = False
+        self.sequencer.cancel()
+        if self.owns_arbiter:
+            self.arbiter.stop()
         if self.ser and self.ser.is_open:
             self.ser.write(b'X')
             time.sleep(0.2)
             self.ser.close()
+        if self.recorder:
+            self.recorder.close()
 
 controller = None
 
-class SmartCarRequestHandler(BaseHTTPRequestHandler):
+class SmartCarRequestHandler(metrics.RequestMetricsMixin, BaseHTTPRequestHandler):
+    metrics_server = 'local'
+    
     def do_GET(self):
         if self.path == '/':
             self.send_response(200)
@@ -127,6 +185,16 @@ class SmartCarRequestHandler(BaseHTTPRequestHandler):
             with open(html_path, 'r', encoding='utf-8') as f:
                 self.wfile.write(f.read().encode('utf-8'))
         
+        elif self.path == '/metrics':
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-type', metrics.CONTENT_TYPE)
+            self.end_headers()
+            self.wfile.write(body)
+        
+        elif self.path == '/sequence':
+            self.send_json(200, controller.sequencer.status())
+        
         elif self.path == '/status':
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
@@ -160,6 +228,40 @@ class SmartCarRequestHandler(BaseHTTPRequestHandler):
             self.send_response(404)
             self.end_headers()
     
+    def do_POST(self):
+        if self.path == '/sequence':
+            try:
+                content_length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(content_length).decode('utf-8'))
+                steps = parse_steps(payload)
+            except (ValueError, UnicodeDecodeError) as e:
+                self.send_json(400, {'success': False, 'error': str(e)})
+                return
+            
+            sequence_id = controller.sequencer.start(steps)
+            self.send_json(200, {
+                'success': True,
+                'sequence_id': sequence_id,
+                'steps': len(steps),
+                'total_duration': round(sum(d for _, d in steps), 3)
+            })
+        
+        elif self.path == '/sequence/cancel':
+            # An explicit cancel stops the car; the send loop would otherwise repeat the last step
+            cancelled = controller.sequencer.cancel(stop=True)
+            self.send_json(200, {'success': True, 'cancelled': cancelled})
+        
+        else:
+            self.send_response(404)
+            self.end_headers()
+    
+    def send_json(self, code, payload):
+        """Write a JSON response with the given status code."""
+        self.send_response(code)
+        self.send_header('Content-type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(payload).encode('utf-8'))
+    
     def log_message(self, format, *args):
         timestamp = time.strftime("%H:%M:%S")
         print(f"[{timestamp}] {args[0]} - {args[1]}")
@@ -175,16 +277,17 @@ def get_local_ip():
     except Exception:
         return "localhost"
 
-def main(test_mode=False):
+def main(test_mode=False, record_path=None):
     global controller
     
     print("=" * 60)
     print("SMART CAR LAN WEB CONTROL SERVER")
     print("=" * 60)
     
-    controller = Smart CarController(test_mode=test_mode)
+    recorder = SessionRecorder(record_path, source='local_web') if record_path else None
+    controller = SmartCarController(test_mode=test_mode, recorder=recorder)
     local_ip = get_local_ip()
-    server = HTTPServer(('0.0.0.0', SERVER_PORT), Smart CarRequestHandler)
+    server = HTTPServer(('0.0.0.0', SERVER_PORT), SmartCarRequestHandler)
     
     print(f"\nServer running at:")
     print(f"  - Local:  http://localhost:{SERVER_PORT}")
@@ -196,6 +299,8 @@ def main(test_mode=False):
     print(f"  curl http://{local_ip}:{SERVER_PORT}/cmd/D  # Turn Right")
     print(f"  curl http://{local_ip}:{SERVER_PORT}/cmd/X  # Stop")
     print(f"\nWeb Interface: http://{local_ip}:{SERVER_PORT}")
+    if record_path:
+        print(f"Recording commands to: {record_path}")
     print(f"\nPress Ctrl+C to terminate server.")
     print("=" * 60)
     
@@ -208,6 +313,5 @@ def main(test_mode=False):
         print("Server stopped cleanly.")
 
 if __name__ == "__main__":
-    import sys
     test_mode = '--test' in sys.argv or '-t' in sys.argv
-    main(test_mode=test_mode)
+    main(test_mode=test_mode, record_path=cli_record_path(sys.argv))
@@ -1,7 +1,10 @@
 #!/bin/bash
 # -*- coding: utf-8 -*-
 # setup_systemd.sh - Setup systemd service for SmartCar
-# Usage: sudo bash Web/setup_systemd.sh
+# Usage: sudo bash Web/setup_systemd.sh [MODE]
+#   no MODE: run web/cloud_server.py (AWS deployment)
+#   MODE:    run "run.py MODE --yes" unattended, e.g. web, bridge, voice, supervisor
+# Settings are read from smartcar.ini in the project directory (see common/config.py)
 
 set -e
 
@@ -20,12 +23,22 @@ fi
 CURRENT_USER=${SUDO_USER:-$USER}
 CURRENT_DIR=$(pwd)
 VENV_PATH="$CURRENT_DIR/venv"
-SCRIPT_PATH="$CURRENT_DIR/web/cloud_server.py"
+MODE=$1
+if [ -n "$MODE" ]; then
+    SCRIPT_PATH="$CURRENT_DIR/run.py"
+    SCRIPT_ARGS="$MODE --yes"
+else
+    SCRIPT_PATH="$CURRENT_DIR/web/cloud_server.py"
+    SCRIPT_ARGS=""
+fi
 
 echo "User: $CURRENT_USER"
 echo "Directory: $CURRENT_DIR"
 echo "Virtual env: $VENV_PATH"
-echo "Script: $SCRIPT_PATH"
+echo "Script: $SCRIPT_PATH $SCRIPT_ARGS"
+if [ -f "$CURRENT_DIR/smartcar.ini" ]; then
+    echo "Settings: $CURRENT_DIR/smartcar.ini"
+fi
 echo ""
 
 # Verify paths exist
@@ -55,7 +68,7 @@ Type=simple
 User=$CURRENT_USER
 WorkingDirectory=$CURRENT_DIR
 Environment="PATH=$VENV_PATH/bin"
-ExecStart=$VENV_PATH/bin/python3 $SCRIPT_PATH
+ExecStart=$VENV_PATH/bin/python3 $SCRIPT_PATH $SCRIPT_ARGS
 Restart=always
 RestartSec=10
 StandardOutput=journal
@@ -1,13 +1,302 @@
-import serial
+# -*- coding: utf-8 -*-
+"""
+zigbee_serial_test.py - Zigbee / Serial Link Quality and Throughput Tester
+Sends numbered fixed-size lines at a fixed rate and matches the echoes that
+come back. The far end must echo every line: XBee loopback, an echo sketch
+on the receiving board, or the built-in fake link. Each report interval prints
+the packets sent and echoed, the echo throughput and the round-trip times. The
+final summary adds loss, duplicates, reordering and corrupted lines.
+
+  python zigbee/zigbee_serial_test.py --fake                    # pty loopback paced at 9600 baud
+  python zigbee/zigbee_serial_test.py --fake --loss 0.05 --reorder 0.02
+  python zigbee/zigbee_serial_test.py --port COM8 --rate 20 --size 48 --duration 60
+  python zigbee/zigbee_serial_test.py --fake --max-loss 0.01 --max-rtt 200   # CI gate
+
+With --max-loss and/or --max-rtt (p99, milliseconds) the exit code is 1 when
+the link misses either limit, so the test can gate a CI job.
+
+Line format: 'Z' + 8-digit sequence + ':' + filler + newline, `--size` bytes in
+total. An echo that differs from the line sent counts as corrupt. The fake
+link needs a POSIX pseudo-terminal.
+"""
+import os
+import random
+import sys
+import threading
 import time
 
-PORT = "COM8"
-BAUD = 9600
+import serial
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'serial_bridge'))
+import config
+if __name__ == "__main__":
+    config.load_or_exit()
+
+PORT = config.get('zigbee.port', 'COM8')
+BAUD = config.get('zigbee.baud_rate', 9600)
+RATE = 10.0
+SIZE = 32
+DURATION = 10.0
+REPORT_INTERVAL = 1.0
+# Echoes still in flight when sending stops get this long to arrive
+DRAIN_TIME = 1.0
+
+HEADER = b'Z'
+MIN_SIZE = 11  # header + 8-digit sequence + ':' + newline
+FILLER = b'0123456789abcdefghijklmnopqrstuvwxyz'
+
+def make_packet(seq, size):
+    filler = (FILLER * (size // len(FILLER) + 1))[:size - MIN_SIZE]
+    return HEADER + b'%08d:' % seq + filler + b'\n'
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+class EchoResponder:
+    """Far end for FakeSerialLink: echoes complete lines, optionally dropping or swapping some.
+
+    With a baud rate the echo is paced on the same thread as the receive
+    side, so line and echo share the link like a half-duplex radio hop.
+    """
+    def __init__(self, baud_rate=None, loss=0.0, reorder=0.0, seed=None):
+        self.baud_rate = baud_rate
+        self.loss = loss
+        self.reorder = reorder
+        self.random = random.Random(seed)
+        self.buffer = b''
+        self.held = None
+
+    def __call__(self, data, link):
+        self.buffer += data
+        *lines, self.buffer = self.buffer.split(b'\n')
+        for line in lines:
+            line += b'\n'
+            if self.random.random() < self.loss:
+                continue
+            if self.held is None and self.random.random() < self.reorder:
+                # Hold this line back and send it after the next one
+                self.held = line
+                continue
+            self._send(line, link)
+            if self.held is not None:
+                self._send(self.held, link)
+                self.held = None
+
+    def _send(self, line, link):
+        if self.baud_rate:
+            time.sleep(len(line) * 10.0 / self.baud_rate)
+        link.reply(line)
+
+class LinkTester:
+    """Paced sender plus echo reader for one serial port."""
+    def __init__(self, ser, rate=RATE, size=SIZE, interval=REPORT_INTERVAL):
+        if size < MIN_SIZE:
+            raise ValueError(f"size must be at least {MIN_SIZE} bytes")
+        self.ser = ser
+        self.rate = rate
+        self.size = size
+        self.interval = interval
+        self.sent_at = {}
+        self.received = set()
+        self.rtts = []
+        self.duplicates = 0
+        self.reordered = 0
+        self.corrupt = 0
+        self.highest = -1
+        self.duration = None
+        self.running = False
+        self._window = {'tx': 0, 'rx': 0, 'rtts': [], 'reordered': 0, 'corrupt': 0}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _read(self):
+        buffer = b''
+        while self.running:
+            data = self.ser.read(max(1, self.ser.in_waiting))
+            if not data:
+                continue
+            now = time.monotonic()
+            buffer += data
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                self._echo(line + b'\n', now)
+
+    def _echo(self, line, now):
+        with self._lock:
+            try:
+                seq = int(line[1:9])
+            except ValueError:
+                seq = None
+            if seq is None or seq not in self.sent_at or line != make_packet(seq, self.size):
+                self.corrupt += 1
+                self._window['corrupt'] += 1
+                return
+            if seq in self.received:
+                self.duplicates += 1
+                return
+            self.received.add(seq)
+            rtt = now - self.sent_at[seq]
+            self.rtts.append(rtt)
+            self._window['rx'] += 1
+            self._window['rtts'].append(rtt)
+            if seq < self.highest:
+                self.reordered += 1
+                self._window['reordered'] += 1
+            self.highest = max(self.highest, seq)
+
+    def _report(self, elapsed, span, label='t'):
+        with self._lock:
+            window, self._window = self._window, {'tx': 0, 'rx': 0, 'rtts': [], 'reordered': 0, 'corrupt': 0}
+        rtts = window['rtts']
+        print(f"  {label:>5}={elapsed:5.1f}s  tx {window['tx']:4d}  rx {window['rx']:4d}  "
+              f"{window['rx'] * self.size / max(span, 1e-6):7.0f} B/s  "
+              f"rtt p50 {percentile(rtts, 0.5) * 1000:6.1f}  p95 {percentile(rtts, 0.95) * 1000:6.1f}  "
+              f"max {max(rtts, default=0.0) * 1000:6.1f} ms  reordered {window['reordered']}  "
+              f"corrupt {window['corrupt']}")
+
+    def run(self, duration=DURATION, drain=DRAIN_TIME):
+        """Send for duration seconds on a monotonic schedule, then wait drain seconds for echoes."""
+        self.duration = duration
+        self.ser.reset_input_buffer()
+        self.running = True
+        self._thread = threading.Thread(target=self._read, name='link-reader', daemon=True)
+        self._thread.start()
+        start = time.monotonic()
+        next_report = start + self.interval
+        seq = 0
+        try:
+            while True:
+                now = time.monotonic()
+                # Reports come first, so a send backlog cannot hold them back
+                if now >= next_report:
+                    self._report(next_report - start, self.interval)
+                    next_report += self.interval
+                    continue
+                if now - start >= duration:
+                    break
+                due = start + seq / self.rate
+                if now >= due:
+                    packet = make_packet(seq, self.size)
+                    with self._lock:
+                        self.sent_at[seq] = time.monotonic()
+                        self._window['tx'] += 1
+                    self.ser.write(packet)
+                    seq += 1
+                else:
+                    time.sleep(min(due, next_report, start + duration) - now)
+            # Flush the partial window since the last report, then the echoes that arrive while draining
+            end = time.monotonic()
+            last_report = next_report - self.interval
+            if end - last_report > 1e-3:
+                self._report(end - start, end - last_report)
+            time.sleep(drain)
+            self._report(time.monotonic() - start, drain, label='drain')
+        finally:
+            self.running = False
+            self._thread.join(timeout=1.0)
+        return self.summary()
+
+    def summary(self):
+        sent = len(self.sent_at)
+        lost = sent - len(self.received)
+        return {
+            'sent': sent,
+            'echoed': len(self.received),
+            'lost': lost,
+            'loss': lost / sent if sent else 0.0,
+            'duplicates': self.duplicates,
+            'reordered': self.reordered,
+            'corrupt': self.corrupt,
+            'throughput': len(self.received) * self.size / self.duration,
+            'rtt_p50': percentile(self.rtts, 0.5),
+            'rtt_p90': percentile(self.rtts, 0.9),
+            'rtt_p99': percentile(self.rtts, 0.99),
+            'rtt_max': max(self.rtts, default=0.0)
+        }
+
+def print_summary(result, rate, size, baud):
+    # Line and echo share the link, as on a half-duplex radio hop
+    offered = 2 * rate * size
+    capacity = baud / 10.0
+    print("-" * 64)
+    print(f"  sent {result['sent']}, echoed {result['echoed']}, lost {result['lost']} ({result['loss']:.1%}), "
+          f"duplicates {result['duplicates']}, reordered {result['reordered']}, corrupt {result['corrupt']}")
+    print(f"  echo throughput {result['throughput']:.0f} B/s (offered {offered:.0f} B/s both ways, "
+          f"{offered / capacity:.0%} of {capacity:.0f} B/s at {baud} baud)")
+    print(f"  round trip p50 {result['rtt_p50'] * 1000:.1f} ms, p90 {result['rtt_p90'] * 1000:.1f} ms, "
+          f"p99 {result['rtt_p99'] * 1000:.1f} ms, max {result['rtt_max'] * 1000:.1f} ms")
+
+def check_thresholds(result, max_loss=None, max_rtt=None):
+    """Messages for every limit the result misses; max_rtt is in seconds and applies to p99."""
+    failures = []
+    if max_loss is not None and result['loss'] > max_loss:
+        failures.append(f"loss {result['loss']:.1%} exceeds {max_loss:.1%}")
+    if max_rtt is not None and result['rtt_p99'] > max_rtt:
+        failures.append(f"round trip p99 {result['rtt_p99'] * 1000:.1f} ms exceeds {max_rtt * 1000:.1f} ms")
+    return failures
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Zigbee / serial link quality and throughput tester')
+    parser.add_argument('--port', default=PORT, help=f'Serial port of the Zigbee adapter (default {PORT})')
+    parser.add_argument('--baud', type=int, default=BAUD, help=f'Baud rate (default {BAUD})')
+    parser.add_argument('--rate', type=float, default=RATE, help=f'Packets per second (default {RATE:g})')
+    parser.add_argument('--size', type=int, default=SIZE,
+                        help=f'Packet size in bytes including the newline (default {SIZE}, min {MIN_SIZE})')
+    parser.add_argument('--duration', type=float, default=DURATION, help=f'Seconds to send (default {DURATION:g})')
+    parser.add_argument('--interval', type=float, default=REPORT_INTERVAL, help='Seconds between reports')
+    parser.add_argument('--fake', action='store_true', help='Test against a pty loopback instead of hardware')
+    parser.add_argument('--loss', type=float, default=0.0, help='Fake link: probability of dropping a line')
+    parser.add_argument('--reorder', type=float, default=0.0, help='Fake link: probability of swapping a line')
+    parser.add_argument('--seed', type=int, help='Fake link: random seed for loss and reordering')
+    parser.add_argument('--max-loss', type=float, metavar='FRACTION',
+                        help='Exit with status 1 if the loss exceeds this fraction, e.g. 0.01')
+    parser.add_argument('--max-rtt', type=float, metavar='MS',
+                        help='Exit with status 1 if the p99 round trip exceeds this many milliseconds')
+    config.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.size < MIN_SIZE or args.rate <= 0:
+        parser.error(f"--size must be at least {MIN_SIZE} and --rate positive")
+
+    link = None
+    port = args.port
+    if args.fake:
+        from fake_serial import FakeSerialLink
+        responder = EchoResponder(args.baud, args.loss, args.reorder, args.seed)
+        link = FakeSerialLink(baud_rate=args.baud, responder=responder, keep_bytes=False).start()
+        port = link.port
 
-ser = serial.Serial(PORT, BAUD, timeout=1)
-time.sleep(2)
+    print("=" * 64)
+    print(f"LINK TEST {port} @ {args.baud} baud: {args.rate:g} packets/s x {args.size} bytes "
+          f"for {args.duration:g}s{' (fake loopback)' if link else ''}")
+    print("=" * 64)
+    try:
+        with serial.Serial(port, args.baud, timeout=0.1) as ser:
+            if not link:
+                # Opening the port may reset the board behind the adapter
+                time.sleep(2)
+            tester = LinkTester(ser, args.rate, args.size, args.interval)
+            result = tester.run(args.duration)
+        print_summary(result, args.rate, args.size, args.baud)
+        failures = check_thresholds(result, args.max_loss,
+                                    None if args.max_rtt is None else args.max_rtt / 1000.0)
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        if failures:
+            sys.exit(1)
+    except serial.SerialException as e:
+        print(f"Serial connection error: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print()
+    finally:
+        if link:
+            link.close()
 
-while True:
-    ser.write(b"Hello ESP32/Arduino!\n")
-    print("Sent.")
-    time.sleep(1)   
\ No newline at end of file
+if __name__ == "__main__":
+    main()